@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Logging off the request path, for the proxy and the InfoNodes.
+setup_logging() puts a LogWriter on the root logger: request threads only append the record to a bounded
+queue (no handler lock, no stdout write), one background thread formats and writes them in batches, and
+when the queue is full records are dropped (and counted) instead of blocking the request.
+AccessLog emits one structured record per request, sampled per route; 5xx answers are always kept.
+Access records are written as JSON lines, e.g.
+{"ts":1700000000.123,"service":"proxy","route":"/employees?id","status":200,"method":"GET","ms":1.9,...}
+"""
+import sys
+import json
+import time
+import queue
+import atexit
+import random
+import logging
+import threading
+from typing import Dict, Optional
+
+_STOP = object()
+
+
+def parse_rates(spec: str) -> Dict[str, float]:
+    """'/employees?id=0.01,/employees=0.1,*=1' -> {route: rate}; '*' is the default for other routes."""
+    rates = {}
+    for part in (spec or '').split(','):
+        route, sep, rate = part.strip().rpartition('=')
+        if sep and route:
+            rates[route] = min(max(float(rate), 0.0), 1.0)
+    return rates
+
+
+class LogWriter(logging.Handler):
+    def __init__(self, stream=None, prefix: str = '', queue_size: int = 10000, batch: int = 256):
+        super().__init__()
+        self.stream = stream or sys.stdout
+        self.prefix = prefix
+        self.batch = batch
+        self.dropped = 0
+        self._reported = 0
+        self._queue = queue.Queue(queue_size)
+        self._thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+        self._thread.start()
+
+    def handle(self, record):
+        # replaces Handler.handle(), which would take the handler lock around every record
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+        return True
+
+    def emit(self, record):
+        self.handle(record)
+
+    def format(self, record) -> str:
+        if isinstance(record.msg, dict):
+            return json.dumps(record.msg, separators=(',', ':'), ensure_ascii=False, default=str)
+        return self.prefix + super().format(record)
+
+    def _run(self):
+        while True:
+            records = [self._queue.get()]
+            while len(records) < self.batch:
+                try:
+                    records.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            lines = []
+            for record in records:
+                if record is _STOP:
+                    self._write(lines)
+                    return
+                try:
+                    lines.append(self.format(record))
+                except Exception:
+                    self.handleError(record)
+            if self.dropped != self._reported:
+                lines.append(f"{self.prefix}log queue full: {self.dropped - self._reported} record(s) dropped")
+                self._reported = self.dropped
+            self._write(lines)
+
+    def _write(self, lines):
+        if lines:
+            try:
+                self.stream.write('\n'.join(lines) + '\n')
+                self.stream.flush()
+            except (OSError, ValueError):
+                pass
+
+    def close(self):
+        """Write out what is queued (best effort) and stop the writer thread."""
+        if self._thread.is_alive():
+            try:
+                self._queue.put(_STOP, timeout=1)
+            except queue.Full:
+                pass
+            self._thread.join(timeout=2)
+        super().close()
+
+
+def setup_logging(prefix: str, queue_size: int = 10000, level=logging.INFO) -> LogWriter:
+    """Route every logger through one LogWriter (instead of logging.basicConfig's synchronous stream handler)."""
+    writer = LogWriter(sys.stdout, prefix, queue_size)
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(writer)
+    root.setLevel(level)
+    atexit.register(writer.close)
+    return writer
+
+
+class AccessLog:
+    def __init__(self, service: str, rates: Optional[Dict[str, float]] = None):
+        self.service = service
+        self.rates = dict(rates or {})
+        self.default_rate = self.rates.pop('*', 1.0)
+        self._logger = logging.getLogger('access')
+
+    def record(self, route: str, status: int, **fields):
+        """Log one request if it is sampled; fields become keys of the JSON record."""
+        if status < 500:
+            rate = self.rates.get(route, self.default_rate)
+            if rate < 1.0 and (rate <= 0.0 or random.random() >= rate):
+                return
+        if not self._logger.isEnabledFor(logging.INFO):
+            return
+        entry = {'ts': round(time.time(), 3), 'service': self.service, 'route': route, 'status': status}
+        entry.update(fields)
+        # the dict travels as the message and is serialized by the writer thread
+        self._logger.info(entry)
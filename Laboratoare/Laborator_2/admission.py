@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Admission control: at most `limit` requests of a kind run at once, at most `queue` more wait (up to `max_wait`
+seconds) for a slot, and anything beyond that is turned away immediately so the caller can shed it (503).
+Admitted requests keep roughly the latency of an unloaded proxy instead of all of them slowing down together.
+"""
+import asyncio
+import threading
+from typing import Dict
+
+
+class Admission:
+    def __init__(self, name: str, limit: int, queue: int, max_wait: float):
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.max_wait = max_wait
+        self._slots = threading.BoundedSemaphore(limit)
+        self._lock = threading.Lock()
+        self._running = 0
+        self._waiting = 0
+        self._admitted = 0
+        self._rejected = 0
+
+    def acquire(self) -> bool:
+        """True if admitted (call release() when done), False if the request should be shed."""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                if self._waiting >= self.queue:
+                    self._rejected += 1
+                    return False
+                self._waiting += 1
+            try:
+                admitted = self._slots.acquire(timeout=self.max_wait)
+            finally:
+                with self._lock:
+                    self._waiting -= 1
+            if not admitted:
+                with self._lock:
+                    self._rejected += 1
+                return False
+        with self._lock:
+            self._running += 1
+            self._admitted += 1
+        return True
+
+    def release(self):
+        with self._lock:
+            self._running -= 1
+        self._slots.release()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'limit': self.limit, 'queue': self.queue, 'running': self._running,
+                    'waiting': self._waiting, 'admitted': self._admitted, 'rejected': self._rejected}
+
+
+class AsyncAdmission:
+    """Admission for the asyncio engine; same contract, awaited instead of blocking."""
+
+    def __init__(self, name: str, limit: int, queue: int, max_wait: float):
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.max_wait = max_wait
+        self._slots = asyncio.Semaphore(limit)
+        self._running = 0
+        self._waiting = 0
+        self._admitted = 0
+        self._rejected = 0
+
+    async def acquire(self) -> bool:
+        if self._slots.locked():
+            if self._waiting >= self.queue:
+                self._rejected += 1
+                return False
+            self._waiting += 1
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.max_wait)
+            except asyncio.TimeoutError:
+                self._rejected += 1
+                return False
+            finally:
+                self._waiting -= 1
+        else:
+            await self._slots.acquire()
+        self._running += 1
+        self._admitted += 1
+        return True
+
+    def release(self):
+        self._running -= 1
+        self._slots.release()
+
+    def stats(self) -> Dict[str, int]:
+        return {'limit': self.limit, 'queue': self.queue, 'running': self._running,
+                'waiting': self._waiting, 'admitted': self._admitted, 'rejected': self._rejected}
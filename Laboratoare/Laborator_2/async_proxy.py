@@ -0,0 +1,1094 @@
+#!/usr/bin/env python3
+"""
+asyncio proxy engine: the routing, caching and replication of ProxyHandler on a single event loop.
+Clients are served with asyncio streams and backends are reached over pooled non-blocking keep-alive
+connections, so idle client connections cost a socket instead of an OS thread.
+Cache calls go through the shared (blocking) CacheLayer: on a small thread pool when it talks to Redis or the
+shared cache directory, directly when it is in process memory. Backend pools are pre-warmed before serving.
+Streamed aggregates (PROXY_STREAM_AGGREGATES=1) are returned as an async iterator of chunk frames.
+Hint replay runs on its own thread and hands each request to the loop; appending a hint is a small blocking
+file write done on the loop.
+Run: python -u proxy_server.py --engine asyncio
+"""
+import json
+import time
+import heapq
+import signal
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from http import HTTPStatus
+from email.utils import formatdate
+from urllib.parse import urlparse, urlsplit
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Tuple
+
+from proxy_common import (CACHE_TTL, STALE_WHILE_REVALIDATE, STALE_IF_ERROR, CACHE_STALE_SECONDS,
+                          AGGREGATE_DEADLINE, PARTIAL_CACHE_TTL, WRITE_QUORUM, WRITE_TIMEOUT,
+                          REPLICATION_RETRIES, NEGATIVE_CACHE_TTL, POOL_SIZE, POOL_MAX_IN_FLIGHT,
+                          STREAM_AGGREGATES, STREAM_BUFFER_ITEMS, STREAM_CHUNK_BYTES, STREAM_READ_BYTES,
+                          STREAM_CACHE_MAX_BYTES, STREAM_PAGE_ROWS, MERGE_RULE, MERGE_VERSION_FIELD,
+                          PAGE_MAX_LIMIT, MAX_READS, READ_QUEUE, MAX_WRITES, WRITE_QUEUE, ADMIT_MAX_WAIT,
+                          RETRY_AFTER, BULK_PATH, BULK_CHUNK_ITEMS, BULK_PARALLEL_CHUNKS, HINT_DIR, HINT_SETTINGS,
+                          HINT_STATS_PATH, WRITE_THROUGH, WRITE_THROUGH_LIST_MAX_BYTES, BREAKER_SETTINGS, DRAIN_SECONDS,
+                          KNOWN_IDS, KNOWN_IDS_SETTINGS, KNOWN_IDS_STATS_PATH,
+                          HEDGE_SETTINGS, ADMISSION_STATS_PATH, BREAKER_STATS_PATH, CACHE_IO_WORKERS,
+                          POOL_STATS_PATH, METRICS_PATH, ACCESS_LOG_SAMPLE, HOP_BY_HOP, METRICS, REQUESTS,
+                          REQUEST_SECONDS, IN_FLIGHT, REQUEST_BYTES, RESPONSE_BYTES, CACHE_RESULTS, BACKEND_SECONDS,
+                          BACKEND_FAILURES, route_label, stats_collector, make_cache_key, content_length, Envelope,
+                          decode_cache_entry, store_response, not_modified, accepts_gzip, invalidate_after_write)
+from singleflight import AsyncSingleFlight
+from admission import AsyncAdmission
+from access_log import AccessLog, parse_rates
+from circuit_breaker import CircuitBreakers, CLOSED
+from bulk import BulkBatcher
+from hinted_handoff import HintedHandoff
+from known_ids import KnownIds
+from write_through import WriteThrough, stored_employee
+from hedging import HedgePolicy, AsyncHedgedReads
+from json_stream import ArrayItemParser, ChunkedArrayWriter
+from pagination import page_params, backend_page_path, merge_pages, id_key, row_after
+from dedup import Collapser, Resolver
+from prefork import Drain, notify_ready, watch_master
+
+logger = logging.getLogger("proxy")
+
+# errors that mean "this backend could not answer" (connection, timeout, protocol)
+BACKEND_ERRORS = (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError)
+MAX_HEADERS = 100
+_END = object()
+
+
+async def _read_headers(reader) -> Dict[str, str]:
+    headers = {}
+    for _ in range(MAX_HEADERS):
+        line = await reader.readline()
+        if not line:
+            raise asyncio.IncompleteReadError(b'', None)
+        if line in (b'\r\n', b'\n'):
+            return headers
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip()] = value.strip()
+    raise ValueError('too many headers')
+
+
+def _header(headers, name, default=None):
+    name = name.lower()
+    for k, v in headers.items():
+        if k.lower() == name:
+            return v
+    return default
+
+
+async def _read_chunked(reader) -> bytes:
+    chunks = []
+    while True:
+        size = int((await reader.readline()).split(b';', 1)[0].strip(), 16)
+        if size == 0:
+            # skip trailers up to the terminating blank line
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            return b''.join(chunks)
+        chunks.append(await reader.readexactly(size))
+        await reader.readexactly(2)
+
+
+async def _iter_body(reader, headers, read_size, timeout):
+    """Yield a response body in pieces of at most read_size bytes; timeout applies to each read."""
+    if 'chunked' in _header(headers, 'Transfer-Encoding', '').lower():
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout)
+            size = int(line.split(b';', 1)[0].strip(), 16)
+            if size == 0:
+                while (await asyncio.wait_for(reader.readline(), timeout)) not in (b'\r\n', b'\n', b''):
+                    pass
+                return
+            while size:
+                data = await asyncio.wait_for(reader.readexactly(min(size, read_size)), timeout)
+                size -= len(data)
+                yield data
+            await reader.readexactly(2)
+    elif _header(headers, 'Content-Length') is not None:
+        left = content_length(_header(headers, 'Content-Length'))
+        while left:
+            data = await asyncio.wait_for(reader.read(min(left, read_size)), timeout)
+            if not data:
+                raise asyncio.IncompleteReadError(data, left)
+            left -= len(data)
+            yield data
+    else:
+        while True:
+            data = await asyncio.wait_for(reader.read(read_size), timeout)
+            if not data:
+                return
+            yield data
+
+
+class AsyncBackendPool:
+    """
+    Keep-alive connections to one backend, at most max_connections requests in flight.
+    Every request's outcome and time to the response headers go to the backend metrics and, when one is attached,
+    the circuit breaker; reading the body is not part of the latency.
+    """
+
+    def __init__(self, base_url: str, size: int = 20, max_connections: int = 64, breaker=None):
+        self.base_url = base_url
+        self.breaker = breaker
+        u = urlsplit(base_url)
+        self.host = u.hostname
+        self.port = u.port or 80
+        self.size = size
+        self.max_connections = max_connections
+        self._idle = []
+        self._slots = asyncio.Semaphore(max_connections)
+        self._active = 0
+        self._waits = 0
+        # writes not answered yet: while one is in flight, a 404 from this backend may predate it
+        self._writes = 0
+
+    async def request(self, method, path, headers, body=b'', timeout=5.0) -> Tuple[int, Dict[str, str], bytes]:
+        if method in ('GET', 'HEAD'):
+            return await self._timed_request(method, path, headers, body, timeout)
+        self._writes += 1
+        try:
+            return await self._timed_request(method, path, headers, body, timeout)
+        finally:
+            self._writes -= 1
+
+    def writes_in_flight(self) -> int:
+        return self._writes
+
+    async def _timed_request(self, method, path, headers, body, timeout):
+        if self._slots.locked():
+            self._waits += 1
+        async with self._slots:
+            self._active += 1
+            sent = time.monotonic()
+            generation = self.generation()
+            try:
+                opened = await asyncio.wait_for(self._open(method, path, headers, body), timeout)
+                latency = time.monotonic() - sent
+                result = await asyncio.wait_for(self._read_response(method, *opened),
+                                                max(timeout - latency, 0.001))
+            except BACKEND_ERRORS:
+                self.record(False, generation=generation)
+                raise
+            finally:
+                self._active -= 1
+            self.record(result[0] < 500, latency, generation)
+            return result
+
+    def generation(self):
+        """Breaker generation to tag a request with as it is sent (see circuit_breaker)."""
+        return self.breaker.generation if self.breaker is not None else None
+
+    def record(self, ok: bool, latency: float = None, generation=None):
+        """Outcome of one request to this backend, with its time to headers if it got an answer."""
+        if latency is not None:
+            BACKEND_SECONDS.observe(latency, self.base_url)
+        if not ok:
+            BACKEND_FAILURES.inc(self.base_url)
+        if self.breaker is not None:
+            self.breaker.record(ok, latency, generation)
+
+    def stats(self) -> Dict[str, int]:
+        return {'size': self.size, 'max_in_flight': self.max_connections, 'active': self._active,
+                'writes': self._writes, 'idle': len(self._idle), 'waits': self._waits}
+
+    async def prewarm(self, path: str = '/', timeout: float = 2.0) -> int:
+        """Open up to `size` keep-alive connections ahead of traffic; any HTTP answer counts, errors are only logged."""
+        results = await asyncio.gather(*[asyncio.wait_for(self._request('GET', path, {}, b''), timeout)
+                                         for _ in range(self.size - len(self._idle))], return_exceptions=True)
+        failed = [r for r in results if isinstance(r, BaseException)]
+        if failed:
+            logger.warning("Pre-warming %s: %d of %d connection(s) failed: %s", self.base_url, len(failed),
+                           len(results), str(failed[0]) or failed[0].__class__.__name__)
+        return len(results) - len(failed)
+
+    @asynccontextmanager
+    async def stream(self, path, headers, timeout=5.0, read_size=65536):
+        """GET whose body is consumed piecewise: yields (status, headers, async iterator of body pieces)."""
+        if self._slots.locked():
+            self._waits += 1
+        async with self._slots:
+            self._active += 1
+            sent = time.monotonic()
+            generation = self.generation()
+            try:
+                try:
+                    reader, writer, keep_alive, status, resp_headers = await asyncio.wait_for(
+                        self._open('GET', path, headers, b''), timeout)
+                    latency = time.monotonic() - sent
+                except BACKEND_ERRORS:
+                    self.record(False, generation=generation)
+                    raise
+                complete = False
+
+                async def pieces():
+                    nonlocal complete
+                    async for data in _iter_body(reader, resp_headers, read_size, timeout):
+                        yield data
+                    complete = True
+
+                framed = (_header(resp_headers, 'Content-Length') is not None
+                          or 'chunked' in _header(resp_headers, 'Transfer-Encoding', '').lower())
+                try:
+                    yield status, resp_headers, pieces()
+                except BACKEND_ERRORS:
+                    self.record(False, generation=generation)
+                    raise
+                else:
+                    self.record(status < 500, latency, generation)
+                finally:
+                    # the connection is reusable only if a framed body was read to the end
+                    self._release(reader, writer, keep_alive and framed and complete)
+            finally:
+                self._active -= 1
+
+    async def _request(self, method, path, headers, body):
+        return await self._read_response(method, *await self._open(method, path, headers, body))
+
+    async def _read_response(self, method, reader, writer, keep_alive, status, resp_headers):
+        """Read the body after _open: (status, headers, body); the connection goes back to the pool if reusable."""
+        try:
+            if method == 'HEAD' or status in (204, 304) or status < 200:
+                resp_body = b''
+            elif 'chunked' in _header(resp_headers, 'Transfer-Encoding', '').lower():
+                resp_body = await _read_chunked(reader)
+            elif _header(resp_headers, 'Content-Length') is not None:
+                resp_body = await reader.readexactly(content_length(_header(resp_headers, 'Content-Length')))
+            else:
+                resp_body = await reader.read()
+                keep_alive = False
+        except BaseException:
+            writer.close()
+            raise
+        self._release(reader, writer, keep_alive)
+        return status, resp_headers, resp_body
+
+    def _release(self, reader, writer, reusable):
+        if reusable and len(self._idle) < self.size:
+            self._idle.append((reader, writer))
+        else:
+            writer.close()
+
+    async def _open(self, method, path, headers, body):
+        """Send the request and read the response head: (reader, writer, keep_alive, status, headers)."""
+        if self._idle:
+            reader, writer = self._idle.pop()
+            try:
+                return (reader, writer) + await self._send(reader, writer, method, path, headers, body)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                # the backend closed the idle keep-alive connection; retry once on a fresh one
+                pass
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        return (reader, writer) + await self._send(reader, writer, method, path, headers, body)
+
+    async def _send(self, reader, writer, method, path, headers, body):
+        try:
+            lines = [f"{method} {path} HTTP/1.1", f"Host: {self.host}:{self.port}"]
+            for k, v in headers.items():
+                if k.lower() in HOP_BY_HOP or k.lower() == 'host':
+                    continue
+                lines.append(f"{k}: {v}")
+            lines.append(f"Content-Length: {len(body)}")
+            writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+            await writer.drain()
+
+            status_line = await reader.readline()
+            if not status_line:
+                raise ConnectionResetError('backend closed the connection')
+            version, status, _ = (status_line.decode('latin-1').rstrip('\r\n') + ' ').split(' ', 2)
+            resp_headers = await _read_headers(reader)
+        except BaseException:
+            writer.close()
+            raise
+        keep_alive = version == 'HTTP/1.1' and _header(resp_headers, 'Connection', '').lower() != 'close'
+        return keep_alive, int(status), resp_headers
+
+
+class AsyncProxy:
+    def __init__(self, cache, lb):
+        self.cache = cache
+        self.lb = lb
+        self._pools = {}
+        # backends whose breaker is open are skipped by reads and replication instead of timing out every request
+        self._breakers = CircuitBreakers(**BREAKER_SETTINGS)
+        self._flights = AsyncSingleFlight()
+        self._cache_executor = ThreadPoolExecutor(max_workers=CACHE_IO_WORKERS, thread_name_prefix='cache-io')
+        self._write_through = WriteThrough(cache, WRITE_THROUGH, WRITE_THROUGH_LIST_MAX_BYTES, CACHE_TTL,
+                                           CACHE_STALE_SECONDS)
+        self._hedged = AsyncHedgedReads(HedgePolicy(**HEDGE_SETTINGS))
+        self._resolver = Resolver(MERGE_RULE, MERGE_VERSION_FIELD)
+        # separate budgets so a burst of reads cannot starve replicated writes, and the other way round
+        self._reads = AsyncAdmission('reads', MAX_READS, READ_QUEUE, ADMIT_MAX_WAIT)
+        self._writes = AsyncAdmission('writes', MAX_WRITES, WRITE_QUEUE, ADMIT_MAX_WAIT)
+        self._access = AccessLog('proxy', parse_rates(ACCESS_LOG_SAMPLE))
+        # background replication tasks still running after the client got its answer
+        self._background = set()
+        # writes a backend missed are kept and replayed to it later instead of being dropped
+        self._hints = HintedHandoff(HINT_DIR, self._replay, self._breakers.allow, **HINT_SETTINGS) if HINT_DIR else None
+        # per-id misses for ids never stored are answered without the backends
+        self._known_ids = KnownIds(self.lb.backends, self._page_ids, **KNOWN_IDS_SETTINGS) if KNOWN_IDS else None
+        self._loop = None
+        # requests in flight, idle keep-alive connections and all connections, for a graceful stop
+        self._drain = Drain()
+        self._idle = set()
+        self._connections = set()
+        METRICS.collector(stats_collector(
+            lambda: {backend: pool.stats() for backend, pool in self._pools.items()}, self._breakers.stats,
+            lambda: {'reads': self._reads.stats(), 'writes': self._writes.stats()}, self._hedged.policy.stats,
+            self._hints.stats if self._hints else None))
+
+    def _pool(self, backend) -> AsyncBackendPool:
+        pool = self._pools.get(backend)
+        if pool is None:
+            pool = self._pools[backend] = AsyncBackendPool(backend, POOL_SIZE, POOL_MAX_IN_FLIGHT,
+                                                           self._breakers.get(backend))
+        return pool
+
+    async def serve(self, host='0.0.0.0', port=8080, reuse_port=False):
+        """Serve until SIGTERM (or the pre-fork master going away), then drain: see prefork.py."""
+        self._loop = asyncio.get_running_loop()
+        if self._hints:
+            self._hints.start(self.lb.backends)
+        if self._known_ids:
+            self._known_ids.start()
+        await asyncio.gather(*[self._pool(b).prewarm() for b in self.lb.backends])
+        for b in self.lb.backends:
+            logger.info("Pool for %s pre-warmed: %s", b, self._pool(b).stats())
+        server = await asyncio.start_server(self._handle_client, host, port, reuse_port=reuse_port or None)
+        stopping = asyncio.Event()
+        self._loop.add_signal_handler(signal.SIGTERM, stopping.set)
+        watch_master(lambda: self._loop.call_soon_threadsafe(stopping.set))
+        notify_ready()
+        try:
+            async with server:
+                await stopping.wait()
+                self._drain.draining = True
+                server.close()
+                for writer in list(self._idle):
+                    writer.close()
+                logger.info('Draining %d request(s) in flight...', self._drain.active)
+                deadline = self._loop.time() + DRAIN_SECONDS
+                while self._drain.active and self._loop.time() < deadline:
+                    await asyncio.sleep(0.05)
+                if self._background:
+                    # replication still owed to the slower backends of acknowledged writes
+                    await asyncio.wait(self._background, timeout=max(0.0, deadline - self._loop.time()))
+                if self._drain.active:
+                    logger.warning('%d request(s) still in flight after %ss', self._drain.active, DRAIN_SECONDS)
+                for writer in list(self._connections):
+                    writer.close()
+        finally:
+            self._cache_executor.shutdown(wait=False)
+            if self._hints:
+                self._hints.shutdown()
+            if self._known_ids:
+                self._known_ids.shutdown()
+
+    async def _cache_io(self, fn, *args):
+        """fn(*args) for a blocking cache call: on the cache I/O threads, unless the cache is in process memory."""
+        if self.cache.in_process:
+            return fn(*args)
+        return await asyncio.get_running_loop().run_in_executor(self._cache_executor, fn, *args)
+
+    def _replay(self, backend, method, path, body, timeout):
+        """HintedHandoff send(), called on the replay thread: the request itself runs on the loop."""
+        async def send():
+            status, _, _ = await self._pool(backend).request(method, path, {'Content-Type': 'application/json'},
+                                                             body, timeout=timeout)
+            return status
+        return asyncio.run_coroutine_threadsafe(send(), self._loop).result(timeout + 1)
+
+    def _page_ids(self, backend, after, limit):
+        """KnownIds page(), called on its loader thread: the request itself runs on the loop."""
+        async def get():
+            status, _, body = await self._pool(backend).request('GET', backend_page_path('/employees', limit, after),
+                                                                {}, timeout=AGGREGATE_DEADLINE)
+            if status != 200:
+                raise RuntimeError(f'status {status}')
+            return [str(row['id']) for row in json.loads(body)]
+        return asyncio.run_coroutine_threadsafe(get(), self._loop).result(AGGREGATE_DEADLINE + 1)
+
+    def _write_targets(self, method, target, body):
+        """
+        Backends to send a write to now, (backend, reason) for the others, which count against the quorum, and
+        the hint tickets of the targets: a backend with hints pending gets the write appended behind them, one with
+        an open breaker is hinted.
+        """
+        backends, deferred, tickets = list(self.lb.backends), [], {}
+        if self._hints:
+            tickets, deferred = self._hints.split(backends, method, target, body)
+            backends = list(tickets)
+        targets, skipped = self._breakers.split(backends)
+        for backend in skipped:
+            if self._hints:
+                self._hints.hand_off(backend, tickets[backend])
+        return targets, list(skipped.items()) + [(b, 'hints pending') for b in deferred], tickets
+
+    async def _handle_client(self, reader, writer):
+        client = (writer.get_extra_info('peername') or ('-',))[0]
+        self._connections.add(writer)
+        try:
+            while True:
+                self._idle.add(writer)
+                try:
+                    request_line = await reader.readline()
+                finally:
+                    self._idle.discard(writer)
+                if not request_line.strip():
+                    break
+                self._drain.begin()
+                try:
+                    keep_alive = await self._serve_request(reader, writer, request_line, client)
+                finally:
+                    self._drain.end()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+    async def _serve_request(self, reader, writer, request_line, client) -> bool:
+        """Read the rest of one request and answer it; whether the connection can be kept open."""
+        try:
+            method, target, version = request_line.decode('latin-1').split()
+            headers = await _read_headers(reader)
+            length = content_length(_header(headers, 'Content-Length', 0))
+        except ValueError:
+            self._write_response(writer, 400, {'Content-Type': 'text/plain'}, b'Bad Request', False)
+            return False
+        if method == 'POST' and urlsplit(target).path == BULK_PATH:
+            # a bulk upload is handed over unread, to be parsed and replicated chunk by chunk
+            framed = length or 'chunked' in _header(headers, 'Transfer-Encoding', '').lower()
+            body = _iter_body(reader, headers if framed else {'Content-Length': '0'}, STREAM_READ_BYTES,
+                              WRITE_TIMEOUT)
+        else:
+            body = await reader.readexactly(length) if length else b''
+
+        route = route_label(target)
+        if length:
+            REQUEST_BYTES.inc(route, amount=length)
+        start, status, sent, cache_result = time.monotonic(), 0, 0, None
+        IN_FLIGHT.inc(method)
+        try:
+            status, resp_headers, resp_body = await self.handle(method, target, headers, body, version)
+            if 'X-Proxy-Cache' in resp_headers:
+                cache_result = resp_headers['X-Proxy-Cache']
+                CACHE_RESULTS.inc(cache_result.lower())
+            if isinstance(resp_body, Envelope):
+                resp_body = resp_body.for_encoding(accepts_gzip(_header(headers, 'Accept-Encoding')))
+            if method == 'GET' and not_modified(_header(headers, 'If-None-Match'), resp_body):
+                # the client's copy is current: no body, and nothing was asked of the backends for a
+                # cached entry
+                status, resp_headers, resp_body = 304, dict(resp_headers, ETag=resp_body.etag), b''
+            connection = _header(headers, 'Connection', '').lower()
+            keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+            # a stopping worker answers with Connection: close
+            keep_alive = keep_alive and not self._drain.draining
+            if hasattr(body, '__aiter__') and await anext(body, _END) is not _END:
+                # the bulk body was not read to the end, so the connection cannot be reused
+                keep_alive = False
+            if hasattr(resp_body, '__aiter__'):
+                sent = await self._write_stream(writer, status, resp_headers, resp_body, keep_alive)
+            else:
+                sent = self._write_response(writer, status, resp_headers, resp_body, keep_alive)
+                await writer.drain()
+        finally:
+            IN_FLIGHT.dec(method)
+            elapsed = time.monotonic() - start
+            REQUESTS.inc(route, method, str(status))
+            REQUEST_SECONDS.observe(elapsed, route, method)
+            RESPONSE_BYTES.inc(route, amount=sent)
+            self._access.record(route, status, method=method, path=target, client=client,
+                                ms=round(elapsed * 1000, 3), bytes_in=length, bytes_out=sent,
+                                cache=cache_result)
+        return keep_alive
+
+    @staticmethod
+    def _head_lines(status, headers, keep_alive):
+        try:
+            reason = HTTPStatus(status).phrase
+        except ValueError:
+            reason = ''
+        lines = [f"HTTP/1.1 {status} {reason}", "Server: AsyncProxy", f"Date: {formatdate(usegmt=True)}"]
+        for k, v in headers.items():
+            if k.lower() in HOP_BY_HOP or k.lower() in ('server', 'date'):
+                continue
+            lines.append(f"{k}: {v}")
+        if not keep_alive:
+            lines.append("Connection: close")
+        return lines
+
+    async def _write_stream(self, writer, status, headers, frames, keep_alive):
+        """Chunked response; frames are ready-made chunks, each drained before the next is pulled."""
+        lines = self._head_lines(status, headers, keep_alive)
+        lines.append("Transfer-Encoding: chunked")
+        head = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+        writer.write(head)
+        sent = len(head)
+        try:
+            async for frame in frames:
+                writer.write(frame)
+                sent += len(frame)
+                await writer.drain()
+        finally:
+            await frames.aclose()
+        return sent
+
+    def _write_response(self, writer, status, headers, body, keep_alive) -> int:
+        """Buffers the response on the writer; returns the number of bytes."""
+        lines = self._head_lines(status, headers, keep_alive)
+        if isinstance(body, Envelope):
+            # cache hit: the stored header block, blank line and body follow as they are
+            lines.append(f"Content-Length: {body.body_len}")
+            head = ('\r\n'.join(lines) + '\r\n').encode('latin-1')
+            writer.write(head)
+            writer.write(body.wire)
+            return len(head) + len(body.wire)
+        if status != 304:
+            lines.append(f"Content-Length: {len(body)}")
+        data = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body
+        writer.write(data)
+        return len(data)
+
+    async def handle(self, method, target, headers, body, version='HTTP/1.1') -> Tuple[int, Dict[str, str], bytes]:
+        if method not in ('GET', 'POST', 'PUT'):
+            return 501, {'Content-Type': 'text/plain'}, b'Not Implemented'
+        if method == 'GET' and target == METRICS_PATH:
+            return 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}, METRICS.render().encode('utf-8')
+        if method == 'GET' and target == POOL_STATS_PATH:
+            stats = {backend: pool.stats() for backend, pool in self._pools.items()}
+            return 200, {'Content-Type': 'application/json; charset=utf-8'}, json.dumps(stats).encode('utf-8')
+        if method == 'GET' and target == ADMISSION_STATS_PATH:
+            stats = {'reads': self._reads.stats(), 'writes': self._writes.stats()}
+            return 200, {'Content-Type': 'application/json; charset=utf-8'}, json.dumps(stats).encode('utf-8')
+        if method == 'GET' and target == BREAKER_STATS_PATH:
+            stats = self._breakers.stats()
+            return 200, {'Content-Type': 'application/json; charset=utf-8'}, json.dumps(stats).encode('utf-8')
+        if method == 'GET' and target == HINT_STATS_PATH:
+            stats = self._hints.stats() if self._hints else {}
+            return 200, {'Content-Type': 'application/json; charset=utf-8'}, json.dumps(stats).encode('utf-8')
+        if method == 'GET' and target == KNOWN_IDS_STATS_PATH:
+            stats = self._known_ids.stats() if self._known_ids else {}
+            return 200, {'Content-Type': 'application/json; charset=utf-8'}, json.dumps(stats).encode('utf-8')
+        if method == 'POST' and urlsplit(target).path == BULK_PATH:
+            if not await self._writes.acquire():
+                logger.warning("Shedding bulk write: %s budget exhausted", self._writes.name)
+                return 503, {'Content-Type': 'text/plain', 'Retry-After': str(RETRY_AFTER)}, b'Service Unavailable'
+            try:
+                return await self._bulk(body)
+            finally:
+                self._writes.release()
+
+        cache_key, resource_id = make_cache_key(method, target, body, _header(headers, 'Accept', ''))
+        parsed = urlparse(target)
+        fwd_headers = {k: v for k, v in headers.items() if k.lower() != 'host'}
+
+        page = None
+        if method == 'GET' and not resource_id:
+            try:
+                page = page_params(parsed.query, PAGE_MAX_LIMIT)
+            except ValueError as e:
+                return 400, {'Content-Type': 'text/plain'}, str(e).encode('utf-8')
+
+        stale = None
+        entry = await self._cache_io(self.cache.get_entry, cache_key)
+        if entry:
+            cached, stale_for = entry
+            try:
+                envelope = decode_cache_entry(cached)
+            except ValueError:
+                entry = None
+        if entry and stale_for <= 0:
+            logger.debug("Cache HIT for %s", cache_key)
+            return envelope.status, {'X-Proxy-Cache': 'HIT'}, envelope
+        if entry and method == 'GET' and stale_for <= STALE_WHILE_REVALIDATE:
+            # serve the stale copy now and let a single background fetch refresh the entry
+            self._flights.do_background(cache_key, self._fetcher(cache_key, resource_id, parsed, fwd_headers, page))
+            logger.debug("Cache STALE for %s (%.1fs past TTL), refreshing", cache_key, stale_for)
+            return envelope.status, {'X-Proxy-Cache': 'STALE'}, envelope
+        if entry and stale_for <= STALE_IF_ERROR:
+            stale = (envelope.status, {'X-Proxy-Cache': 'STALE-IF-ERROR'}, envelope)
+        budget = self._reads if method == 'GET' else self._writes
+        if not await budget.acquire():
+            logger.warning("Shedding %s %s: %s budget exhausted", method, target, budget.name)
+            if stale is not None and method == 'GET':
+                return stale
+            return 503, {'Content-Type': 'text/plain', 'Retry-After': str(RETRY_AFTER)}, b'Service Unavailable'
+        released = False
+        try:
+            status, resp_headers, resp_body = await self._forward(method, target, cache_key, resource_id, parsed,
+                                                                  fwd_headers, body, page, version, stale)
+            if hasattr(resp_body, '__aiter__'):
+                # a streamed response holds its slot until the last chunk is written
+                resp_body, released = self._release_after(resp_body, budget), True
+            return status, resp_headers, resp_body
+        finally:
+            if not released:
+                budget.release()
+
+    @staticmethod
+    async def _release_after(frames, budget):
+        try:
+            async for frame in frames:
+                yield frame
+        finally:
+            await frames.aclose()
+            budget.release()
+
+    async def _forward(self, method, target, cache_key, resource_id, parsed, fwd_headers, body, page, version, stale):
+        if method == 'GET' and STREAM_AGGREGATES and not resource_id and not page and version == 'HTTP/1.1':
+            # streamed misses are not coalesced: sharing one would mean buffering it for the followers
+            path_with_query = parsed.path + ('?' + parsed.query if parsed.query else '')
+            status, resp_headers, resp_body = await self._stream_aggregate(cache_key, path_with_query, fwd_headers)
+            if status >= 500 and stale is not None:
+                logger.info("Backends failed for %s, serving stale copy", cache_key)
+                return stale
+            return status, resp_headers, resp_body
+
+        if method == 'GET':
+            # concurrent misses on the same key wait for one backend fetch and share its response
+            fetch = self._fetcher(cache_key, resource_id, parsed, fwd_headers, page)
+            (status, resp_headers, resp_body), shared = await self._flights.do(cache_key, fetch)
+            if status >= 500 and stale is not None:
+                status, resp_headers, resp_body = stale
+                logger.info("Backends failed for %s, serving stale copy", cache_key)
+            elif shared:
+                resp_headers = dict(resp_headers, **{'X-Proxy-Cache': 'COALESCED'})
+            return status, resp_headers, resp_body
+        return await self._replicate(method, target, fwd_headers, body, resource_id)
+
+    def _fetcher(self, cache_key, resource_id, parsed, headers, page=None):
+        if resource_id:
+            return lambda: self._get_by_id(cache_key, resource_id, parsed.path, headers)
+        if page:
+            return lambda: self._page(cache_key, parsed.path, page, headers)
+        path_with_query = parsed.path + ('?' + parsed.query if parsed.query else '')
+        return lambda: self._aggregate(cache_key, path_with_query, headers)
+
+    async def _fetch_json(self, backend, path_with_query, headers):
+        status, _, body = await self._pool(backend).request('GET', path_with_query, headers,
+                                                            timeout=AGGREGATE_DEADLINE)
+        if status != 200:
+            raise ValueError(f"status {status}")
+        return json.loads(body)
+
+    async def _aggregate(self, cache_key, path_with_query, headers):
+        backends = list(self.lb.backends)
+        targets, skipped = self._breakers.split(backends)
+        tasks = {b: asyncio.ensure_future(self._fetch_json(b, path_with_query, headers)) for b in targets}
+        pending = set()
+        if tasks:
+            _, pending = await asyncio.wait(tasks.values(), timeout=AGGREGATE_DEADLINE)
+        for t in pending:
+            t.cancel()
+
+        aggregated = []
+        errors = list(skipped.items())
+        for backend, t in tasks.items():
+            if t in pending:
+                errors.append((backend, 'deadline exceeded'))
+            elif t.exception() is not None:
+                errors.append((backend, str(t.exception()) or t.exception().__class__.__name__))
+            elif isinstance(t.result(), list):
+                aggregated.extend(t.result())
+            elif isinstance(t.result(), dict):
+                aggregated.append(t.result())
+        if len(errors) == len(backends):
+            logger.warning("Aggregated GET %s failed on every backend: %s", path_with_query, errors)
+            return 502, {'Content-Type': 'text/plain'}, b'Bad Gateway'
+        # every write is replicated, so each employee arrives once per backend
+        aggregated = self._resolver.dedupe(aggregated)
+
+        body_bytes = json.dumps(aggregated, ensure_ascii=False).encode('utf-8')
+        resp_headers = {'Content-Type': 'application/json; charset=utf-8', 'X-Backend': 'aggregated'}
+        if errors:
+            resp_headers['X-Missing-Backends'] = ','.join(backend for backend, _ in errors)
+            envelope = await self._cache_io(store_response, self.cache, cache_key, 200, resp_headers, body_bytes,
+                                            PARTIAL_CACHE_TTL)
+        else:
+            envelope = await self._cache_io(store_response, self.cache, cache_key, 200, resp_headers, body_bytes,
+                                            CACHE_TTL, CACHE_STALE_SECONDS)
+        logger.debug("Aggregated GET %s -> total %s items (errors: %s)", path_with_query, len(aggregated), errors)
+        return 200, {'X-Proxy-Cache': 'MISS'}, envelope
+
+    async def _page(self, cache_key, path, page, headers):
+        limit, after = page
+        backend_path = backend_page_path(path, limit, after)
+        backends = list(self.lb.backends)
+        targets, missing = self._breakers.split(backends)
+        results = await asyncio.gather(*[asyncio.wait_for(self._fetch_json(b, backend_path, headers),
+                                                          AGGREGATE_DEADLINE) for b in targets],
+                                       return_exceptions=True)
+        for b, r in zip(targets, results):
+            if isinstance(r, Exception):
+                missing[b] = str(r) or r.__class__.__name__
+        if len(missing) == len(backends):
+            logger.warning("Paged GET %s failed on every backend: %s", backend_path, missing)
+            return 502, {'Content-Type': 'text/plain'}, b'Bad Gateway'
+        rows, next_cursor = merge_pages([r for r in results if isinstance(r, list)], limit, self._resolver)
+        body_bytes = json.dumps(rows, ensure_ascii=False).encode('utf-8')
+        resp_headers = {'Content-Type': 'application/json; charset=utf-8', 'X-Backend': 'aggregated'}
+        if next_cursor:
+            resp_headers['X-Next-Cursor'] = next_cursor
+            resp_headers['Link'] = f'<{path}?limit={limit}&cursor={next_cursor}>; rel="next"'
+        if missing:
+            resp_headers['X-Missing-Backends'] = ','.join(missing)
+            envelope = await self._cache_io(store_response, self.cache, cache_key, 200, resp_headers, body_bytes,
+                                            PARTIAL_CACHE_TTL)
+        else:
+            envelope = await self._cache_io(store_response, self.cache, cache_key, 200, resp_headers, body_bytes,
+                                            CACHE_TTL, CACHE_STALE_SECONDS)
+        logger.debug("Paged GET %s -> %s items (errors: %s)", backend_path, len(rows), missing)
+        return 200, {'X-Proxy-Cache': 'MISS'}, envelope
+
+    async def _stream_aggregate(self, cache_key, path_with_query, headers):
+        backends = list(self.lb.backends)
+        targets, missing = self._breakers.split(backends)
+        if self._resolver.enabled:
+            items = self._merge_items(targets, path_with_query.split('?', 1)[0], headers, missing)
+        else:
+            items = self._gather_items(targets, path_with_query, headers, missing)
+        # hold the status line back until something arrived, so a total failure can still be a 502
+        first = await anext(items, _END)
+        if first is _END and len(missing) == len(backends):
+            logger.warning("Aggregated GET %s failed on every backend: %s", path_with_query, missing)
+            return 502, {'Content-Type': 'text/plain'}, b'Bad Gateway'
+        resp_headers = {'Content-Type': 'application/json; charset=utf-8', 'X-Proxy-Cache': 'MISS',
+                        'X-Backend': 'aggregated', 'Trailer': 'X-Missing-Backends'}
+        return 200, resp_headers, self._stream_frames(cache_key, path_with_query, items, first, missing)
+
+    async def _gather_items(self, backends, path_with_query, headers, missing):
+        """Items of every backend's list in arrival order; at most STREAM_BUFFER_ITEMS wait in between."""
+        queue = asyncio.Queue(STREAM_BUFFER_ITEMS)
+
+        async def read(backend):
+            try:
+                async with self._pool(backend).stream(path_with_query, headers, AGGREGATE_DEADLINE,
+                                                      STREAM_READ_BYTES) as (status, _, pieces):
+                    if status != 200:
+                        raise ValueError(f"status {status}")
+                    parser = ArrayItemParser()
+                    async for data in pieces:
+                        for item in parser.feed(data):
+                            await queue.put((backend, item))
+                    for item in parser.close():
+                        await queue.put((backend, item))
+            except BACKEND_ERRORS as e:
+                missing[backend] = str(e) or e.__class__.__name__
+            await queue.put((backend, _END))
+
+        tasks = [asyncio.ensure_future(read(b)) for b in backends]
+        finished = set()
+        try:
+            while len(finished) < len(backends):
+                try:
+                    backend, item = await asyncio.wait_for(queue.get(), AGGREGATE_DEADLINE)
+                except asyncio.TimeoutError:
+                    for b in backends:
+                        if b not in finished:
+                            missing.setdefault(b, 'deadline exceeded')
+                    return
+                if item is _END:
+                    finished.add(backend)
+                    continue
+                yield item
+        finally:
+            for t in tasks:
+                t.cancel()
+
+    async def _merge_items(self, backends, path, headers, missing):
+        """Rows of every backend walked in token order, merged and collapsed to one row per id."""
+        queues = {b: asyncio.Queue(max(STREAM_BUFFER_ITEMS // max(len(backends), 1), 1)) for b in backends}
+
+        async def read_pages(backend):
+            after = None
+            try:
+                while True:
+                    status, _, body = await self._pool(backend).request(
+                        'GET', backend_page_path(path, STREAM_PAGE_ROWS, after), headers, timeout=AGGREGATE_DEADLINE)
+                    if status != 200:
+                        raise ValueError(f"status {status}")
+                    rows = json.loads(body)
+                    for row in rows:
+                        await queues[backend].put(row)
+                    if len(rows) < STREAM_PAGE_ROWS:
+                        break
+                    after = row_after(rows[-1])
+            except BACKEND_ERRORS as e:
+                missing[backend] = str(e) or e.__class__.__name__
+            await queues[backend].put(_END)
+
+        async def pull(index):
+            backend = backends[index]
+            try:
+                row = await asyncio.wait_for(queues[backend].get(), AGGREGATE_DEADLINE)
+            except asyncio.TimeoutError:
+                missing.setdefault(backend, 'deadline exceeded')
+                return
+            if row is not _END:
+                heapq.heappush(heap, (id_key(row), index, row))
+
+        tasks = [asyncio.ensure_future(read_pages(b)) for b in backends]
+        heap = []
+        group = Collapser(self._resolver)
+        try:
+            for index in range(len(backends)):
+                await pull(index)
+            while heap:
+                _, index, row = heapq.heappop(heap)
+                for done in group.push(row):
+                    yield done
+                await pull(index)
+            for done in group.flush():
+                yield done
+        finally:
+            for t in tasks:
+                t.cancel()
+
+    async def _stream_frames(self, cache_key, path_with_query, items, first, missing):
+        out = ChunkedArrayWriter(STREAM_CHUNK_BYTES, STREAM_CACHE_MAX_BYTES)
+        try:
+            item = first
+            while item is not _END:
+                frame = out.add(item)
+                if frame:
+                    yield frame
+                item = await anext(items, _END)
+            trailers = {'X-Missing-Backends': ','.join(sorted(missing))} if missing else {}
+            yield out.finish(trailers)
+        finally:
+            await items.aclose()
+
+        if out.body is not None:
+            resp_headers = {'Content-Type': 'application/json; charset=utf-8', 'X-Backend': 'aggregated'}
+            if missing:
+                resp_headers['X-Missing-Backends'] = ','.join(sorted(missing))
+                await self._cache_io(store_response, self.cache, cache_key, 200, resp_headers, out.body,
+                                     PARTIAL_CACHE_TTL)
+            else:
+                await self._cache_io(store_response, self.cache, cache_key, 200, resp_headers, out.body, CACHE_TTL,
+                                     CACHE_STALE_SECONDS)
+        logger.debug("Streamed aggregated GET %s -> total %s items (errors: %s)", path_with_query, out.count, missing)
+
+    async def _get_by_id(self, cache_key, resource_id, path, headers):
+        # every backend holds a full copy: ask the key's owner first, move on if it errors, and race the next
+        # backend against it if it is slower than usual (hedged read)
+        errors = []
+
+        def candidates():
+            for backend in self.lb.backends_for_key(resource_id):
+                if self._breakers.allow(backend):
+                    yield backend
+                else:
+                    errors.append((backend, 'circuit open'))
+
+        # backends that answered 404 while they may still be missing writes
+        unsure = []
+
+        async def get(backend):
+            answer = await self._pool(backend).request('GET', path + f"?id={resource_id}", headers, timeout=5)
+            if answer[0] == 404 and (self._behind_on_writes(backend) or self._breakers.get(backend).state != CLOSED):
+                # the write that created the id may not have reached it yet: ask the next replica
+                unsure.append(backend)
+                raise ValueError("404 while behind on writes")
+            if answer[0] not in (200, 404):
+                raise ValueError(f"status {answer[0]}")
+            return answer
+
+        pending = candidates()
+        backend = answer = None
+        if self._known_ids and self._known_ids.definitely_absent(resource_id):
+            # the filter never saw the id: one unhedged request to the first backend settles it, unless that fails
+            first = next(pending, None)
+            if first is not None:
+                try:
+                    backend, answer = first, await get(first)
+                except BACKEND_ERRORS as e:
+                    errors.append((first, str(e) or e.__class__.__name__))
+        if backend is None:
+            backend, answer, failed = await self._hedged.call(pending, get)
+            errors.extend(failed)
+        if backend is None and unsure:
+            logger.debug("GET with id %s not found on %s, which may be behind on writes", resource_id, unsure)
+            return 404, {'Content-Type': 'text/plain', 'X-Backend': unsure[0]}, b'Not Found'
+        if backend is None:
+            logger.warning("GET with id %s failed on every backend: %s", resource_id, errors)
+            return 502, {'Content-Type': 'text/plain'}, b'Bad Gateway'
+        status, resp_headers, body_bytes = answer
+        if status == 404:
+            resp_headers = {'Content-Type': 'text/plain', 'X-Backend': backend}
+            if any(self._behind_on_writes(b) for b in self.lb.backends_for_key(resource_id)):
+                # a write still on its way may create the id any moment: not negative-cached
+                return 404, resp_headers, b'Not Found'
+            envelope = await self._cache_io(store_response, self.cache, cache_key, 404, resp_headers, b'Not Found',
+                                            NEGATIVE_CACHE_TTL)
+            logger.debug("GET with id %s not found on %s", resource_id, backend)
+            return 404, {'X-Proxy-Cache': 'MISS'}, envelope
+        resp_headers = dict(resp_headers)
+        resp_headers['X-Backend'] = backend
+        envelope = await self._cache_io(store_response, self.cache, cache_key, 200, resp_headers, body_bytes,
+                                        CACHE_TTL, CACHE_STALE_SECONDS)
+        logger.debug("GET with id %s forwarded to %s", resource_id, backend)
+        return 200, {'X-Proxy-Cache': 'MISS'}, envelope
+
+    def _behind_on_writes(self, backend) -> bool:
+        """Writes to the backend are in flight or hinted, so a 404 from it may predate them."""
+        return self._pool(backend).writes_in_flight() > 0 or (self._hints is not None
+                                                               and self._hints.outstanding(backend))
+
+    async def _bulk(self, pieces):
+        # the upload is parsed as it is read; full chunks are replicated (quorum) while reading goes on,
+        # at most BULK_PARALLEL_CHUNKS at a time
+        batcher = BulkBatcher(BULK_CHUNK_ITEMS)
+        in_flight = deque()
+
+        async def replicate(chunks):
+            for chunk in chunks:
+                if len(in_flight) >= BULK_PARALLEL_CHUNKS:
+                    await self._settle_chunk(batcher, *in_flight.popleft())
+                in_flight.append((chunk, asyncio.ensure_future(self._replicate_chunk(batcher, chunk))))
+
+        bad_body = None
+        try:
+            async for data in pieces:
+                await replicate(batcher.feed(data))
+            await replicate(batcher.close())
+        except ValueError as e:
+            # chunks already replicated stay written; the rest of the body is not read
+            bad_body = e
+        finally:
+            while in_flight:
+                await self._settle_chunk(batcher, *in_flight.popleft())
+            if batcher.ids:
+                await self._cache_io(invalidate_after_write, self.cache, *batcher.ids)
+        if bad_body is not None:
+            return 400, {'Content-Type': 'text/plain'}, f'Bad bulk body: {bad_body}'.encode('utf-8')
+        status, body = batcher.summary()
+        logger.debug("Bulk write of %d item(s): %d applied", len(batcher.results), len(batcher.ids))
+        return status, {'Content-Type': 'application/json; charset=utf-8'}, body
+
+    @staticmethod
+    async def _settle_chunk(batcher, chunk, task):
+        """Wait for a chunk's replication; if it raised, its items fail instead of the whole upload."""
+        try:
+            await task
+        except Exception as e:
+            logger.exception("Bulk chunk of %d failed: %s", len(chunk), e)
+            batcher.failed(chunk, 'replication failed')
+
+    async def _replicate_chunk(self, batcher, chunk):
+        headers = {'Content-Type': 'application/json'}
+        body = batcher.body(chunk)
+        if self._known_ids:
+            self._known_ids.add(*(item['id'] for _, item in chunk))
+        backends = list(self.lb.backends)
+        quorum = max(1, min(WRITE_QUORUM, len(backends)))
+        targets, errors, tickets = self._write_targets('POST', BULK_PATH, body)
+        tasks = [asyncio.ensure_future(self._send_with_retries('POST', b, BULK_PATH, headers, body, True,
+                                                               tickets.get(b)))
+                 for b in targets]
+        for t in tasks:
+            self._background.add(t)
+            t.add_done_callback(self._background.discard)
+
+        answers = []
+        try:
+            for next_done in asyncio.as_completed(tasks, timeout=WRITE_TIMEOUT):
+                backend, ok, detail = await next_done
+                if ok:
+                    answers.append(detail)
+                else:
+                    errors.append((backend, detail))
+                if len(answers) >= quorum or len(errors) > len(backends) - quorum:
+                    break
+        except asyncio.TimeoutError:
+            pass
+        if len(answers) < quorum:
+            logger.warning("Bulk chunk of %d: quorum not reached (acknowledged: %d, errors: %s)",
+                           len(chunk), len(answers), errors)
+            batcher.failed(chunk)
+        else:
+            batcher.applied(chunk, answers, quorum)
+
+    async def _send_with_retries(self, method, backend, target, headers, body, parse=False, ticket=None):
+        """
+        (backend, ok, detail); the detail of a success is the reply body, parsed as JSON with parse=True.
+        With a hint ticket the write is not retried here but handed off at its first failure (see hinted_handoff).
+        """
+        detail = None
+        retries = 0 if ticket is not None else REPLICATION_RETRIES
+        for attempt in range(retries + 1):
+            try:
+                status, _, reply = await self._pool(backend).request(method, target, headers, body,
+                                                                     timeout=WRITE_TIMEOUT)
+                if status == 200:
+                    if ticket is not None:
+                        self._hints.answered(backend, ticket)
+                    return backend, True, json.loads(reply) if parse else reply
+                detail = status
+                if status < 500:
+                    break
+            except BACKEND_ERRORS as e:
+                detail = str(e) or e.__class__.__name__
+            if attempt < retries:
+                await asyncio.sleep(0.2 * (2 ** attempt))
+        logger.warning("Replication to %s failed after %d attempt(s): %s", backend, attempt + 1, detail)
+        if ticket is not None:
+            if isinstance(detail, int) and detail < 500:
+                self._hints.answered(backend, ticket)
+            else:
+                self._hints.hand_off(backend, ticket)
+        return backend, False, detail
+
+    async def _replicate(self, method, target, headers, body, written_id):
+        # POST/PUT -> replicate to all backends in parallel, answer once the write quorum is reached
+        backends = list(self.lb.backends)
+        quorum = max(1, min(WRITE_QUORUM, len(backends)))
+        token = self._write_through.begin(written_id)
+        if self._known_ids:
+            # known before any backend has it, so a read racing the write is never answered from the filter
+            self._known_ids.add(written_id)
+        targets, errors, tickets = self._write_targets(method, target, body)
+        tasks = [asyncio.ensure_future(self._send_with_retries(method, b, target, headers, body,
+                                                               ticket=tickets.get(b)))
+                 for b in targets]
+        for t in tasks:
+            self._background.add(t)
+            t.add_done_callback(self._background.discard)
+
+        success, ack = [], None
+        try:
+            for next_done in asyncio.as_completed(tasks, timeout=WRITE_TIMEOUT):
+                backend, ok, detail = await next_done
+                if ok:
+                    success.append(backend)
+                    ack = ack or detail
+                else:
+                    errors.append((backend, detail))
+                if len(success) >= quorum or len(errors) > len(backends) - quorum:
+                    break
+        except asyncio.TimeoutError:
+            pass
+        answered = set(success) | {b for b, _ in errors}
+        pending = [b for b in backends if b not in answered]
+
+        if len(success) < quorum:
+            logger.warning("%s quorum not reached (ok: %s, errors: %s, pending: %s)", method, success, errors, pending)
+            await self._cache_io(self._write_through.failed, token, written_id)
+            return 502, {'Content-Type': 'text/plain'}, b'Bad Gateway'
+
+        stored = stored_employee(ack)
+        if self._known_ids and isinstance(stored, dict):
+            # the id a backend assigned to a write that came without one
+            self._known_ids.add(stored.get('id'))
+        await self._cache_io(self._write_through.applied, token, written_id, stored)
+        resp_headers = {'Content-Type': 'application/json; charset=utf-8',
+                        'X-Proxy-Cache': 'MISS', 'X-Backend': ','.join(success)}
+        logger.debug("%s replicated to %s (errors: %s, pending: %s)", method, success, errors, pending)
+        return 200, resp_headers, body
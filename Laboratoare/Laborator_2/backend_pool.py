@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Per-backend pools of keep-alive HTTP sessions for the threaded proxy.
+Each pooled requests.Session owns one connection and is used by one thread at a time; a semaphore caps
+the requests in flight per backend. Pools can be pre-warmed at startup and report active/idle/wait counts.
+Every request's outcome (5xx and errors count as failures) and latency go to the backend metrics and, when
+one is attached, the backend's circuit breaker. Latency is time to the response headers: a large list body
+takes long to download without the backend being slow to answer. Writes are also counted until the backend
+answers them: while one is in flight, a 404 from that backend may predate it.
+"""
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from proxy_common import BACKEND_SECONDS, BACKEND_FAILURES
+
+logger = logging.getLogger("backend_pool")
+
+
+class PoolTimeout(requests.exceptions.Timeout):
+    """No pooled connection to the backend became free in time."""
+
+
+class BackendPool:
+    def __init__(self, base_url: str, size: int = 20, max_in_flight: int = 0, breaker=None):
+        self.base_url = base_url
+        self.breaker = breaker
+        self.size = size
+        self.max_in_flight = max_in_flight or size
+        self._idle: List[requests.Session] = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_in_flight)
+        self._active = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._created = 0
+        self._writes = 0
+
+    def _new_session(self) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        with self._lock:
+            self._created += 1
+        return session
+
+    @contextmanager
+    def session(self, timeout: float = 5.0):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._waits += 1
+            if not self._slots.acquire(timeout=timeout):
+                with self._lock:
+                    self._timeouts += 1
+                raise PoolTimeout(f"no free connection to {self.base_url} within {timeout}s")
+        with self._lock:
+            session = self._idle.pop() if self._idle else None
+            self._active += 1
+        try:
+            if session is None:
+                session = self._new_session()
+            yield session
+        finally:
+            with self._lock:
+                self._active -= 1
+                if session is not None and len(self._idle) < self.size:
+                    self._idle.append(session)
+                    session = None
+            if session is not None:
+                session.close()
+            self._slots.release()
+
+    def request(self, method: str, path: str, timeout: float = 5.0, **kwargs) -> requests.Response:
+        if method in ('GET', 'HEAD'):
+            return self._request(method, path, timeout, **kwargs)
+        with self._lock:
+            self._writes += 1
+        try:
+            return self._request(method, path, timeout, **kwargs)
+        finally:
+            with self._lock:
+                self._writes -= 1
+
+    def writes_in_flight(self) -> int:
+        """Writes sent to the backend (or waiting for a connection) and not answered yet."""
+        return self._writes
+
+    def _request(self, method, path, timeout, **kwargs) -> requests.Response:
+        start = time.monotonic()
+        with self.session(timeout) as session:
+            generation = self.generation()
+            remaining = max(timeout - (time.monotonic() - start), 0.001)
+            try:
+                resp = session.request(method, self.base_url + path, timeout=remaining, **kwargs)
+            except requests.RequestException:
+                self.record(False, generation=generation)
+                raise
+            # elapsed runs from sending the request to parsing the response headers, before the body is read
+            self.record(resp.status_code < 500, resp.elapsed.total_seconds(), generation)
+            return resp
+
+    def generation(self) -> Optional[int]:
+        """Breaker generation to tag a request with as it is sent (see circuit_breaker)."""
+        return self.breaker.generation if self.breaker is not None else None
+
+    def record(self, ok: bool, latency: float = None, generation: Optional[int] = None):
+        """Outcome of one request to this backend, with its time to headers if it got an answer."""
+        if latency is not None:
+            BACKEND_SECONDS.observe(latency, self.base_url)
+        if not ok:
+            BACKEND_FAILURES.inc(self.base_url)
+        if self.breaker is not None:
+            self.breaker.record(ok, latency, generation)
+
+    def prewarm(self, path: str = '/', timeout: float = 2.0) -> int:
+        """Open up to `size` connections ahead of traffic; any HTTP answer counts, errors are only logged."""
+        sessions = []
+        try:
+            for _ in range(self.size - len(self._idle)):
+                session = self._new_session()
+                sessions.append(session)
+                session.get(self.base_url + path, timeout=timeout)
+        except requests.RequestException as e:
+            logger.warning("Pre-warming %s stopped after %d connection(s): %s", self.base_url, len(sessions) - 1, e)
+            sessions.pop().close()
+        with self._lock:
+            room = max(self.size - len(self._idle), 0)
+            self._idle.extend(sessions[:room])
+        for extra in sessions[room:]:
+            extra.close()
+        return len(sessions)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'size': self.size, 'max_in_flight': self.max_in_flight, 'active': self._active,
+                    'writes': self._writes, 'idle': len(self._idle), 'waits': self._waits,
+                    'timeouts': self._timeouts, 'created': self._created}
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for session in idle:
+            session.close()
+
+
+class BackendPools:
+    """BackendPool per backend URL, created on first use so backends added to the LoadBalancer just work."""
+
+    def __init__(self, size: int = 20, max_in_flight: int = 0, breakers=None):
+        self.size = size
+        self.max_in_flight = max_in_flight
+        self.breakers = breakers
+        self._pools: Dict[str, BackendPool] = {}
+        self._lock = threading.Lock()
+
+    def pool(self, backend: str) -> BackendPool:
+        pool = self._pools.get(backend)
+        if pool is None:
+            with self._lock:
+                pool = self._pools.get(backend)
+                if pool is None:
+                    breaker = self.breakers.get(backend) if self.breakers is not None else None
+                    pool = self._pools[backend] = BackendPool(backend, self.size, self.max_in_flight, breaker)
+        return pool
+
+    def request(self, backend: str, method: str, path: str, timeout: float = 5.0, **kwargs) -> requests.Response:
+        return self.pool(backend).request(method, path, timeout=timeout, **kwargs)
+
+    def writes_in_flight(self, backend: str) -> int:
+        return self.pool(backend).writes_in_flight()
+
+    def prewarm(self, backends: List[str]):
+        threads = [threading.Thread(target=self.pool(b).prewarm, daemon=True) for b in backends]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        for b in backends:
+            logger.info("Pool for %s pre-warmed: %s", b, self.pool(b).stats())
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {backend: pool.stats() for backend, pool in list(self._pools.items())}
+
+    def close(self):
+        for pool in list(self._pools.values()):
+            pool.close()
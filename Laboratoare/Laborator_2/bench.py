@@ -0,0 +1,444 @@
+#!/usr/bin/env python3
+"""
+Load test / latency benchmark of the proxy, on one box, without Cassandra or Redis.
+Run: python -u bench.py [--engine threading|asyncio] [--rps 200] [--duration 10] [--mixes hit,miss,per-id,write]
+
+- starts --backends stub InfoNodes in this process (same endpoints and answers as info_node.py, canned data)
+  with injected latency (--latency, --jitter, a --slow-fraction of requests taking --slow-latency), 5xx errors
+  (--error-rate) and payload size (--items employees of --item-bytes each)
+- starts proxy_server.py as a child process pointed at them (PROXY_BACKENDS); extra settings with --proxy-env
+- drives each mix with an open-loop load generator: requests go out on a fixed schedule at --rps whether or
+  not earlier ones have answered, and latency is measured from the scheduled send time, so a slow proxy shows
+  up as latency instead of quietly lowering the offered load
+- reports per mix the throughput and p50/p95/p99/p99.9 latency (--json: one JSON object per mix)
+Mixes:
+  hit     GET of the list and of 100 hot ids, all cached before the run
+  miss    GET of the list with a query no request repeats: every request is a backend fan-out
+  per-id  GET ?id= of uniformly random employees (misses first, hits once the cache warms)
+  write   POST of random existing employees (replication, write-through)
+The generator shares this process with the stubs; 'late' in the report is how far behind schedule it fell,
+if that is not small compared to the latencies the box is saturated and the numbers measure the harness.
+"""
+import os
+import sys
+import json
+import bisect
+import math
+import time
+import random
+import socket
+import asyncio
+import argparse
+import threading
+import subprocess
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse, parse_qs
+
+from json_stream import BulkItemParser, InvalidItem
+from pagination import order_key, token
+
+MIXES = ('hit', 'miss', 'per-id', 'write')
+PERCENTILES = (0.5, 0.95, 0.99, 0.999)
+
+
+class StubInfoNode:
+    """InfoNode stand-in: in-memory employees, answers shaped like info_node.py, injected latency and errors."""
+
+    def __init__(self, items: int = 1000, item_bytes: int = 64, latency: float = 0.0, jitter: float = 0.0,
+                 slow_fraction: float = 0.0, slow_latency: float = 0.1, error_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.slow_fraction = slow_fraction
+        self.slow_latency = slow_latency
+        self.error_rate = error_rate
+        self.requests = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._store: Dict[str, Dict[str, Any]] = {}
+        for i in range(items):
+            emp_id = employee_id(i)
+            self._store[emp_id] = {'id': emp_id, 'name': f'employee {i}', 'title': 'x' * item_bytes}
+        # pages are cut in token order, like an InfoNode's
+        self._keys = sorted(order_key(i) for i in self._store)
+        self._list_body: Optional[bytes] = None
+        handler = type('StubHandler', (_StubHandler,), {'stub': self})
+        self.server = _StubServer(('127.0.0.1', 0), handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        self._thread = threading.Thread(target=self.server.serve_forever, name='stub-node', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def delay(self) -> Tuple[float, bool]:
+        """(seconds to wait before answering, whether to answer 500)."""
+        with self._lock:
+            self.requests += 1
+            slow = self._rng.random() < self.slow_fraction
+            seconds = self.slow_latency if slow else self.latency + self._rng.uniform(0, self.jitter)
+            return seconds, self._rng.random() < self.error_rate
+
+    def get(self, emp_id: str) -> Optional[bytes]:
+        with self._lock:
+            emp = self._store.get(emp_id)
+        return None if emp is None else json.dumps(emp).encode('utf-8')
+
+    def page(self, after: Optional[str], limit: int) -> bytes:
+        with self._lock:
+            start = bisect.bisect_left(self._keys, (token(after) + 1,)) if after is not None else 0
+            return json.dumps([self._store[i] for _, i in self._keys[start:start + limit]]).encode('utf-8')
+
+    def listing(self) -> bytes:
+        with self._lock:
+            if self._list_body is None:
+                self._list_body = json.dumps(list(self._store.values())).encode('utf-8')
+            return self._list_body
+
+    def put(self, emps: List[Dict[str, Any]]):
+        with self._lock:
+            for emp in emps:
+                if emp['id'] not in self._store:
+                    bisect.insort(self._keys, order_key(emp['id']))
+                self._store[emp['id']] = emp
+            self._list_body = None
+
+
+class _StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # the proxy dropping its pooled connections when it stops is not worth a traceback
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    stub: StubInfoNode
+
+    def setup(self):
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _reply(self, status: int, body: bytes, content_type: str = 'application/json; charset=utf-8'):
+        # status line, headers and body in one write: split writes would measure delayed ACKs, not the proxy
+        head = (f'HTTP/1.1 {status} {self.responses.get(status, ("",))[0]}\r\nContent-Type: {content_type}\r\n'
+                f'Content-Length: {len(body)}\r\n\r\n')
+        self.wfile.write(head.encode('latin-1') + body)
+
+    def _injected(self) -> bool:
+        """Sleep the injected latency; True if an injected error was sent."""
+        seconds, error = self.stub.delay()
+        if seconds > 0:
+            time.sleep(seconds)
+        if error:
+            self._reply(500, b'Internal Server Error', 'text/plain')
+        return error
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        if parsed.path != '/employees':
+            self._reply(404, b'Not Found', 'text/plain')
+            return
+        if self._injected():
+            return
+        params = parse_qs(parsed.query)
+        if 'id' in params:
+            body = self.stub.get(params['id'][0])
+            if body is None:
+                self._reply(404, b'Not Found', 'text/plain')
+            else:
+                self._reply(200, body)
+        elif 'limit' in params:
+            after = params['after'][0] if params.get('after') else None
+            self._reply(200, self.stub.page(after, max(1, int(params['limit'][0]))))
+        else:
+            self._reply(200, self.stub.listing())
+
+    def do_POST(self):
+        data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        path = urlparse(self.path).path
+        if path not in ('/employees', '/employees/_bulk'):
+            self._reply(404, b'Not Found', 'text/plain')
+            return
+        if self._injected():
+            return
+        if path == '/employees/_bulk':
+            parser = BulkItemParser()
+            items = parser.feed(data) + parser.close()
+            good = [i for i in items if isinstance(i, dict) and i.get('id')]
+            self.stub.put(good)
+            results = [{'id': i['id'], 'status': 200} if isinstance(i, dict) and i.get('id')
+                       else {'status': 400, 'error': i.error if isinstance(i, InvalidItem) else 'bad item'}
+                       for i in items]
+            self._reply(200, json.dumps({'results': results}).encode('utf-8'))
+            return
+        try:
+            emp = json.loads(data or b'{}')
+        except ValueError:
+            self._reply(400, b'Bad Request', 'text/plain')
+            return
+        emp['id'] = f'new-{time.monotonic_ns()}' if emp.get('id') in (None, '') else str(emp['id'])
+        self.stub.put([emp])
+        self._reply(200, json.dumps({'result': 'ok', 'id': emp['id'], 'employee': emp}).encode('utf-8'))
+
+    do_PUT = do_POST
+
+
+def employee_id(i: int) -> str:
+    return f'e{i:06d}'
+
+
+class Client:
+    """Minimal asyncio HTTP/1.1 client: keep-alive connections, at most max_connections open at once."""
+
+    def __init__(self, host: str, port: int, max_connections: int):
+        self.host = host
+        self.port = port
+        self._idle: List[Tuple[asyncio.StreamReader, asyncio.StreamWriter]] = []
+        self._slots = asyncio.Semaphore(max_connections)
+
+    async def request(self, method: str, path: str, body: bytes = b'') -> int:
+        async with self._slots:
+            if self._idle:
+                reader, writer = self._idle.pop()
+            else:
+                reader, writer = await asyncio.open_connection(self.host, self.port)
+                writer.get_extra_info('socket').setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            head = f'{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Length: {len(body)}\r\n'
+            if body:
+                head += 'Content-Type: application/json\r\n'
+            try:
+                writer.write(head.encode('latin-1') + b'\r\n' + body)
+                status, keep_alive = await _read_response(reader)
+            except BaseException:
+                writer.close()
+                raise
+            if keep_alive:
+                self._idle.append((reader, writer))
+            else:
+                writer.close()
+            return status
+
+    def close(self):
+        for _, writer in self._idle:
+            writer.close()
+        self._idle.clear()
+
+
+async def _read_response(reader: asyncio.StreamReader) -> Tuple[int, bool]:
+    """Read one response; (status, whether the connection can be reused). The body is discarded."""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('connection closed')
+    version, status = status_line.split(None, 2)[:2]
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    keep_alive = version == b'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+    if 'chunked' in headers.get('transfer-encoding', '').lower():
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    elif 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    else:
+        await reader.read()
+        keep_alive = False
+    return int(status), keep_alive
+
+
+def request_maker(mix: str, items: int, item_bytes: int, seed: int):
+    """(requests to send once before the run, i -> (method, path, body) for the i-th request of the run)."""
+    rng = random.Random(seed)
+    run = f'{os.getpid()}-{seed}'
+    if mix == 'hit':
+        hot = ['/employees'] + [f'/employees?id={employee_id(i)}' for i in range(min(100, items))]
+        return [('GET', p, b'') for p in hot], lambda i: ('GET', hot[i % len(hot)], b'')
+    if mix == 'miss':
+        return [], lambda i: ('GET', f'/employees?run={run}&n={i}', b'')
+    if mix == 'per-id':
+        return [], lambda i: ('GET', f'/employees?id={employee_id(rng.randrange(items))}', b'')
+    if mix == 'write':
+        def write(i):
+            emp = {'id': employee_id(rng.randrange(items)), 'name': f'written {i}', 'title': 'w' * item_bytes}
+            return 'POST', '/employees', json.dumps(emp).encode('utf-8')
+        return [], write
+    raise ValueError(f'unknown mix {mix!r}')
+
+
+async def drive(client: Client, make, rps: float, duration: float, timeout: float) -> Dict[str, Any]:
+    """Open loop: request i is scheduled at start + i / rps and its latency counted from that moment."""
+    loop = asyncio.get_running_loop()
+    total = max(1, int(rps * duration))
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    failures: Counter = Counter()
+    late = 0.0
+    finished = 0.0
+
+    async def one(scheduled, method, path, body):
+        nonlocal finished
+        try:
+            status = await asyncio.wait_for(client.request(method, path, body), timeout)
+        except Exception as e:
+            failures[e.__class__.__name__] += 1
+            return
+        finished = loop.time()
+        statuses[status] += 1
+        latencies.append(finished - scheduled)
+
+    start = loop.time() + 0.05
+    tasks = []
+    for i in range(total):
+        scheduled = start + i / rps
+        wait = scheduled - loop.time()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        late = max(late, loop.time() - scheduled)
+        tasks.append(asyncio.ensure_future(one(scheduled, *make(i))))
+    await asyncio.gather(*tasks)
+    errors = sum(n for s, n in statuses.items() if s >= 500) + sum(failures.values())
+    elapsed = max(finished - start, 1e-9)
+    latencies.sort()
+    report = {'sent': total, 'answered': len(latencies), 'errors': errors,
+              'statuses': {str(s): n for s, n in sorted(statuses.items())}, 'failures': dict(failures),
+              'throughput': round(len(latencies) / elapsed, 1), 'late_ms': round(late * 1000, 2)}
+    for q in PERCENTILES:
+        report[f'p{q * 100:g}_ms'] = round(percentile(latencies, q) * 1000, 2)
+    report['max_ms'] = round(latencies[-1] * 1000, 2) if latencies else 0.0
+    return report
+
+
+def percentile(ordered: List[float], q: float) -> float:
+    """Nearest-rank percentile of an ascending list."""
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+
+async def bench(port: int, args) -> List[Dict[str, Any]]:
+    reports = []
+    for n, mix in enumerate(args.mixes):
+        client = Client('127.0.0.1', port, args.connections)
+        warmup, make = request_maker(mix, args.items, args.item_bytes, args.seed + n)
+        for method, path, body in warmup:
+            await client.request(method, path, body)
+        report = {'mix': mix, 'engine': args.engine, 'rps': args.rps, 'duration': args.duration}
+        report.update(await drive(client, make, args.rps, args.duration, args.timeout))
+        client.close()
+        reports.append(report)
+    return reports
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_port(port: int, deadline: float, proc: subprocess.Popen):
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f'proxy exited with status {proc.returncode}')
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f'proxy did not listen on port {port}')
+
+
+def start_proxy(backends: List[StubInfoNode], args) -> Tuple[subprocess.Popen, int]:
+    port = free_port()
+    env = dict(os.environ, PROXY_BACKENDS=','.join(b.url for b in backends), PROXY_HINT_DIR='')
+    for setting in args.proxy_env:
+        name, _, value = setting.partition('=')
+        env[name] = value
+    here = os.path.dirname(os.path.abspath(__file__))
+    log = open(args.proxy_log, 'ab')
+    proc = subprocess.Popen([sys.executable, '-u', os.path.join(here, 'proxy_server.py'), str(port),
+                             '--engine', args.engine], cwd=here, env=env, stdout=log, stderr=subprocess.STDOUT)
+    log.close()
+    try:
+        wait_port(port, time.monotonic() + 15, proc)
+    except Exception:
+        proc.kill()
+        raise
+    return proc, port
+
+
+def print_table(reports: List[Dict[str, Any]]):
+    cols = ('mix', 'sent', 'answered', 'errors', 'throughput', 'p50_ms', 'p95_ms', 'p99_ms', 'p99.9_ms', 'max_ms',
+            'late_ms')
+    print(' '.join(f'{c:>10}' for c in cols))
+    for r in reports:
+        print(' '.join(f'{r[c]:>10}' for c in cols))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Open-loop load test of the proxy against stub InfoNodes')
+    parser.add_argument('--engine', choices=('threading', 'asyncio'), default='threading')
+    parser.add_argument('--mixes', default=','.join(MIXES), help=f'comma separated, of: {", ".join(MIXES)}')
+    parser.add_argument('--rps', type=float, default=200, help='target requests per second (default 200)')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per mix (default 10)')
+    parser.add_argument('--connections', type=int, default=64, help='client connections at most (default 64)')
+    parser.add_argument('--timeout', type=float, default=10, help='per-request timeout in seconds (default 10)')
+    parser.add_argument('--backends', type=int, default=2, help='stub InfoNodes (default 2)')
+    parser.add_argument('--items', type=int, default=1000, help='employees per stub (default 1000)')
+    parser.add_argument('--item-bytes', type=int, default=64, help='payload bytes per employee (default 64)')
+    parser.add_argument('--latency', type=float, default=0.001, help='stub service time, seconds (default 0.001)')
+    parser.add_argument('--jitter', type=float, default=0.0, help='extra uniform 0..jitter seconds per answer')
+    parser.add_argument('--slow-fraction', type=float, default=0.0, help='share of answers taking --slow-latency')
+    parser.add_argument('--slow-latency', type=float, default=0.1, help='seconds (default 0.1)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of stub answers that are 500')
+    parser.add_argument('--proxy-env', action='append', default=[], metavar='NAME=VALUE',
+                        help='extra environment for the proxy, e.g. PROXY_CACHE_TTL=0 (repeatable)')
+    parser.add_argument('--proxy-log', default=os.devnull, help='file for the proxy output (default discarded)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help='one JSON object per mix instead of a table')
+    args = parser.parse_args()
+    args.mixes = [m.strip() for m in args.mixes.split(',') if m.strip()]
+    for mix in args.mixes:
+        if mix not in MIXES:
+            parser.error(f'unknown mix {mix!r}')
+
+    stubs = [StubInfoNode(args.items, args.item_bytes, args.latency, args.jitter, args.slow_fraction,
+                          args.slow_latency, args.error_rate, args.seed + n).start() for n in range(args.backends)]
+    proc = None
+    try:
+        proc, port = start_proxy(stubs, args)
+        reports = asyncio.run(bench(port, args))
+    finally:
+        if proc is not None:
+            proc.terminate()
+            try:
+                proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        for stub in stubs:
+            stub.stop()
+    if args.json:
+        for r in reports:
+            print(json.dumps(r))
+    else:
+        print_table(reports)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Bulk writes (POST /employees/_bulk): the client sends a JSON array or NDJSON (one employee per line).
+BulkBatcher parses the body as it is read and cuts it into chunks of at most chunk_items employees; the proxy
+replicates each chunk to the backends as one request (a JSON array) and the InfoNodes answer per item.
+Every item ends up with one result, in the order of the upload:
+  200  applied by the write quorum
+  400  not a JSON object (never forwarded)
+  502  its chunk was not acknowledged by the write quorum, or the backends rejected the item
+"""
+import json
+import uuid
+from typing import Any, Dict, List, Tuple
+
+from json_stream import BulkItemParser, InvalidItem
+
+Chunk = List[Tuple[int, Dict[str, Any]]]
+
+
+class BulkBatcher:
+    def __init__(self, chunk_items: int = 500):
+        self.chunk_items = max(1, chunk_items)
+        self._parser = BulkItemParser()
+        self._chunk: Chunk = []
+        self._count = 0
+        self.results: List[Dict[str, Any]] = []
+        # ids applied by the quorum, for cache invalidation
+        self.ids: List[str] = []
+
+    def feed(self, data: bytes) -> List[Chunk]:
+        """Chunks completed by this piece of the body; raises ValueError if a JSON array is malformed."""
+        return self._add(self._parser.feed(data))
+
+    def close(self) -> List[Chunk]:
+        chunks = self._add(self._parser.close())
+        if self._chunk:
+            chunks.append(self._chunk)
+            self._chunk = []
+        return chunks
+
+    def _add(self, items) -> List[Chunk]:
+        ready = []
+        for item in items:
+            index = self._count
+            self._count += 1
+            if isinstance(item, InvalidItem):
+                self.results.append({'index': index, 'status': 400, 'error': item.error})
+                continue
+            if not isinstance(item, dict):
+                self.results.append({'index': index, 'status': 400, 'error': 'not a JSON object'})
+                continue
+            # the id is fixed here, so that every backend stores the employee under the same one
+            emp_id = item.get('id')
+            item['id'] = str(uuid.uuid4()) if emp_id is None or emp_id == '' else str(emp_id)
+            self._chunk.append((index, item))
+            if len(self._chunk) >= self.chunk_items:
+                ready.append(self._chunk)
+                self._chunk = []
+        return ready
+
+    @staticmethod
+    def body(chunk: Chunk) -> bytes:
+        return json.dumps([item for _, item in chunk]).encode('utf-8')
+
+    def applied(self, chunk: Chunk, answers: List[dict], quorum: int):
+        """answers: the parsed replies of the backends that acknowledged the chunk ({'results': [...]})."""
+        for pos, (index, item) in enumerate(chunk):
+            acks, error = 0, None
+            for answer in answers:
+                try:
+                    result = answer['results'][pos]
+                except (KeyError, IndexError, TypeError):
+                    result = None
+                if not isinstance(result, dict):
+                    error = 'malformed backend reply'
+                    continue
+                if result.get('status') == 200:
+                    acks += 1
+                else:
+                    error = result.get('error', f"status {result.get('status')}")
+            if acks >= quorum:
+                self.results.append({'index': index, 'id': item['id'], 'status': 200})
+                self.ids.append(item['id'])
+            else:
+                self.results.append({'index': index, 'id': item['id'], 'status': 502,
+                                     'error': error or 'write quorum not reached'})
+
+    def failed(self, chunk: Chunk, error: str = 'write quorum not reached'):
+        for index, item in chunk:
+            self.results.append({'index': index, 'id': item['id'], 'status': 502, 'error': error})
+
+    def summary(self) -> Tuple[int, bytes]:
+        """(HTTP status, JSON body): 200 unless items were sent and none of them was applied."""
+        results = sorted(self.results, key=lambda r: r['index'])
+        errors = sum(1 for r in results if r['status'] != 200)
+        sent = any(r['status'] != 400 for r in results)
+        status = 502 if sent and not self.ids else 200
+        body = {'items': len(results), 'ok': len(results) - errors, 'errors': errors, 'results': results}
+        return status, json.dumps(body).encode('utf-8')
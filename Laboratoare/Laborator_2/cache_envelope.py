@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Binary envelope for cached proxy responses.
+Layout: fixed prefix | identity header block | identity body | gzip header block | gzip body
+  prefix = magic b'PXE3', status (u16), the four section lengths (u32 each), body digest (16 bytes)
+The gzip sections are empty when no compressed variant was stored.
+Header blocks are stored pre-rendered ("Name: value\\r\\n" lines plus the blank line), so a cache hit
+writes one contiguous block + body region to the socket as is: no JSON parsing, no decode/re-encode,
+and for gzip clients no per-request compression.
+The digest (BLAKE2b-128 of the identity body) gives each variant its strong ETag, rendered into its block.
+"""
+import struct
+import hashlib
+from typing import Dict, Optional
+
+MAGIC = b'PXE3'
+_PREFIX = struct.Struct('!4sHIIII16s')
+
+
+class Envelope:
+    """One variant (identity or gzip) of a stored response, as a view over the stored bytes."""
+    __slots__ = ('status', 'raw', 'start', 'body_offset', 'end', 'digest', 'encoding', '_gzip')
+
+    def __init__(self, status: int, raw, start: int, body_offset: int, end: int, digest: bytes,
+                 encoding: str = '', gzip: Optional['Envelope'] = None):
+        self.status = status
+        self.raw = raw
+        self.start = start
+        self.body_offset = body_offset
+        self.end = end
+        self.digest = digest
+        self.encoding = encoding
+        self._gzip = gzip
+
+    @property
+    def etag(self) -> str:
+        return _etag(self.digest, self.encoding)
+
+    @property
+    def wire(self) -> memoryview:
+        """Header block, blank line and body, ready to follow the status line and per-request headers."""
+        return memoryview(self.raw)[self.start:self.end]
+
+    @property
+    def body(self) -> memoryview:
+        return memoryview(self.raw)[self.body_offset:self.end]
+
+    @property
+    def body_len(self) -> int:
+        return self.end - self.body_offset
+
+    def for_encoding(self, gzip_ok: bool) -> 'Envelope':
+        """The gzip variant when the client accepts it and one is stored, else this one."""
+        return self._gzip if gzip_ok and self._gzip is not None else self
+
+    def headers(self) -> Dict[str, str]:
+        block = bytes(memoryview(self.raw)[self.start:self.body_offset]).decode('latin-1')
+        headers = {}
+        for line in block.split('\r\n'):
+            if line:
+                name, _, value = line.partition(':')
+                headers[name.strip()] = value.strip()
+        return headers
+
+
+def _etag(digest: bytes, encoding: str) -> str:
+    return f'"{digest.hex()}-{encoding}"' if encoding else f'"{digest.hex()}"'
+
+
+def _block(headers: Dict[str, str], extra: Dict[str, str]) -> bytes:
+    lines = [f"{k}: {v}\r\n" for k, v in headers.items() if k.lower() not in ('etag', 'vary', 'content-encoding')]
+    lines.extend(f"{k}: {v}\r\n" for k, v in extra.items())
+    return ''.join(lines).encode('latin-1', errors='replace') + b'\r\n'
+
+
+def pack(status: int, headers: Dict[str, str], body: bytes, gzipped: Optional[bytes] = None) -> bytes:
+    """Serialize a response; gzipped is the gzip-compressed body to store as the second variant, if any."""
+    digest = hashlib.blake2b(body, digest_size=16).digest()
+    vary = {'Vary': 'Accept-Encoding'} if gzipped is not None else {}
+    block = _block(headers, dict(vary, ETag=_etag(digest, '')))
+    gz_block = b''
+    if gzipped is not None:
+        gz_block = _block(headers, dict(vary, ETag=_etag(digest, 'gzip'), **{'Content-Encoding': 'gzip'}))
+    gzipped = gzipped or b''
+    return b''.join((_PREFIX.pack(MAGIC, status, len(block), len(body), len(gz_block), len(gzipped), digest),
+                     block, bytes(body), gz_block, gzipped))
+
+
+def unpack(raw) -> Envelope:
+    """Wrap a stored envelope without copying it; ValueError if raw is not an envelope."""
+    if len(raw) < _PREFIX.size:
+        raise ValueError('truncated cache envelope')
+    magic, status, block_len, body_len, gz_block_len, gz_len, digest = _PREFIX.unpack_from(raw)
+    if magic != MAGIC or _PREFIX.size + block_len + body_len + gz_block_len + gz_len != len(raw):
+        raise ValueError('not a cache envelope')
+    start = _PREFIX.size
+    end = start + block_len + body_len
+    gzip = None
+    if gz_block_len:
+        gzip = Envelope(status, raw, end, end + gz_block_len, len(raw), digest, 'gzip')
+    return Envelope(status, raw, start, start + block_len, end, digest, '', gzip)
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """If-None-Match comparison (weak, as RFC 9110 prescribes for it): '*' or any listed tag."""
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag == '*' or (tag[2:] if tag.startswith('W/') else tag) == etag:
+            return True
+    return False
@@ -1,12 +1,20 @@
 #!/usr/bin/env python3
 """
 Cache layer with Redis (if available) else in-memory fallback with TTL.
+Values are bytes. Entries have a soft TTL (fresh) and are kept `stale_seconds` longer (hard TTL)
+so callers can still serve them stale via get_entry().
+Entries can carry tags; invalidate_tag() drops every entry stored with a tag (all variants of one resource).
+Without Redis, a shared_dir makes the fallback a SharedDirCache there instead of this process's memory, so the
+pre-fork workers of one host share entries.
 """
 import time
+import struct
 import threading
-from typing import Optional
+from typing import Dict, Iterable, Optional, Set, Tuple
 import logging
 
+from shared_cache import SharedDirCache
+
 logger = logging.getLogger("cache_layer")
 
 try:
@@ -14,62 +22,133 @@ try:
 except Exception:
     redis = None
 
+# soft expiry (epoch seconds, 0 = never) stored in front of each Redis value
+_FRESH_UNTIL = struct.Struct('!d')
+# Redis set holding the keys stored with a tag
+_TAG_PREFIX = 'tag:'
+
 class CacheLayer:
-    def __init__(self, host='localhost', port=6379):
+    def __init__(self, host='localhost', port=6379, shared_dir: str = ''):
         self._use_redis = False
         self._redis = None
         if redis is not None:
             try:
-                self._redis = redis.Redis(host=host, port=port, decode_responses=True)
+                self._redis = redis.Redis(host=host, port=port, decode_responses=False)
                 self._redis.ping()
                 self._use_redis = True
                 logger.info('CacheLayer: using Redis at %s:%d', host, port)
             except Exception:
-                logger.info('CacheLayer: Redis not available, using in-memory fallback')
+                logger.info('CacheLayer: Redis not available, using %s fallback',
+                            'shared directory ' + shared_dir if shared_dir else 'in-memory')
+        self._shared = SharedDirCache(shared_dir) if shared_dir else None
 
         self._store = {}
+        self._tags: Dict[str, Set[str]] = {}
+        self._key_tags: Dict[str, Tuple[str, ...]] = {}
         self._lock = threading.RLock()
         self._stop = False
         self._cleaner = threading.Thread(target=self._evict_loop, daemon=True)
         self._cleaner.start()
 
+    @property
+    def in_process(self) -> bool:
+        """Entries live in this process's memory: calls never wait on I/O."""
+        return not self._use_redis and self._shared is None
+
     def _evict_loop(self):
         while not self._stop:
             now = time.time()
             with self._lock:
                 keys = list(self._store.keys())
                 for k in keys:
-                    _, exp = self._store.get(k, (None, 0))
+                    _, _, exp = self._store.get(k, (None, 0, 0))
                     if exp and exp <= now:
-                        self._store.pop(k, None)
+                        self._drop(k)
             time.sleep(1)
 
-    def put(self, key: str, value: str, ttl_seconds: int = 30):
+    def _drop(self, key):
+        # caller holds self._lock
+        self._store.pop(key, None)
+        for tag in self._key_tags.pop(key, ()):
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def put(self, key: str, value: bytes, ttl_seconds: int = 30, stale_seconds: int = 0, tags: Iterable[str] = ()):
+        fresh_until = time.time() + ttl_seconds if ttl_seconds else 0
+        tags = tuple(tags)
         if self._use_redis:
             try:
-                self._redis.setex(key, ttl_seconds, value)
+                # Redis drops the key at the hard TTL; the soft expiry travels in front of the value
+                raw = _FRESH_UNTIL.pack(fresh_until) + value
+                pipe = self._redis.pipeline(transaction=False)
+                if ttl_seconds:
+                    pipe.setex(key, ttl_seconds + stale_seconds, raw)
+                else:
+                    pipe.set(key, raw)
+                for tag in tags:
+                    pipe.sadd(_TAG_PREFIX + tag, key)
+                    if ttl_seconds:
+                        # the tag set lives as long as its longest-lived key
+                        pipe.expire(_TAG_PREFIX + tag, ttl_seconds + stale_seconds, nx=True)
+                        pipe.expire(_TAG_PREFIX + tag, ttl_seconds + stale_seconds, gt=True)
+                    else:
+                        pipe.persist(_TAG_PREFIX + tag)
+                pipe.execute()
                 return
             except Exception:
                 self._use_redis = False
+        expiry = fresh_until + stale_seconds if ttl_seconds else 0
+        if self._shared is not None:
+            self._shared.put(key, value, fresh_until, expiry, tags)
+            return
         with self._lock:
-            expiry = time.time() + ttl_seconds if ttl_seconds else 0
-            self._store[key] = (value, expiry)
+            self._drop(key)
+            self._store[key] = (value, fresh_until, expiry)
+            if tags:
+                self._key_tags[key] = tags
+                for tag in tags:
+                    self._tags.setdefault(tag, set()).add(key)
 
-    def get(self, key: str) -> Optional[str]:
+    def get(self, key: str) -> Optional[bytes]:
+        entry = self.get_entry(key)
+        if entry is None or entry[1] > 0:
+            return None
+        return entry[0]
+
+    def get_entry(self, key: str) -> Optional[Tuple[bytes, float]]:
+        """
+        (value, stale_for) where stale_for is seconds since the soft TTL ran out (<= 0 while fresh).
+        Values read from Redis come back as a memoryview over the fetched buffer instead of a copy.
+        """
+        now = time.time()
         if self._use_redis:
             try:
-                return self._redis.get(key)
+                raw = self._redis.get(key)
+                if raw is None or len(raw) < _FRESH_UNTIL.size:
+                    return None
+                fresh_until, = _FRESH_UNTIL.unpack_from(raw)
+                value = memoryview(raw)[_FRESH_UNTIL.size:]
+                return value, (now - fresh_until if fresh_until else -1)
             except Exception:
                 self._use_redis = False
+        if self._shared is not None:
+            entry = self._shared.get(key)
+            if entry is None:
+                return None
+            value, fresh_until = entry
+            return value, (now - fresh_until if fresh_until else -1)
         with self._lock:
             entry = self._store.get(key)
             if not entry:
                 return None
-            value, expiry = entry
-            if expiry and expiry <= time.time():
-                self._store.pop(key, None)
+            value, fresh_until, expiry = entry
+            if expiry and expiry <= now:
+                self._drop(key)
                 return None
-            return value
+            return value, (now - fresh_until if fresh_until else -1)
 
     def invalidate(self, key: str):
         if self._use_redis:
@@ -78,8 +157,27 @@ class CacheLayer:
                 return
             except Exception:
                 self._use_redis = False
+        if self._shared is not None:
+            self._shared.invalidate(key)
+            return
+        with self._lock:
+            self._drop(key)
+
+    def invalidate_tag(self, tag: str):
+        """Drop every entry stored with this tag."""
+        if self._use_redis:
+            try:
+                keys = self._redis.smembers(_TAG_PREFIX + tag)
+                self._redis.delete(_TAG_PREFIX + tag, *keys)
+                return
+            except Exception:
+                self._use_redis = False
+        if self._shared is not None:
+            self._shared.invalidate_tag(tag)
+            return
         with self._lock:
-            self._store.pop(key, None)
+            for key in list(self._tags.get(tag, ())):
+                self._drop(key)
 
     def stop(self):
         self._stop = True
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Per-backend circuit breakers, so that a dead or drowning backend is skipped instead of costing every request
+a full timeout.
+- closed     requests flow; the breaker trips after `failures` consecutive failures, or when the recent window
+             holds at least `min_requests` outcomes with an error rate >= `error_rate` or a latency percentile
+             at or above `slow_seconds`
+- open       the backend is skipped for `open_seconds`
+- half_open  one trial request at a time is let through; `probes` successes in a row close the breaker again,
+             a failure opens it for another `open_seconds`
+A failure is a connection error, a timeout or a 5xx answer.
+Every change of state, and every trial slot handed out, starts a new generation. A request is tagged with the
+generation current when it was sent and its outcome only counts in that generation, so a request sent while
+the breaker was still closed cannot close (or reopen) it once it has tripped.
+"""
+import time
+import threading
+from collections import deque
+from typing import Dict, List, Optional
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failures: int = 5, error_rate: float = 0.5, slow_seconds: float = 0.0,
+                 percentile: float = 95, window: int = 50, min_requests: int = 20, open_seconds: float = 5.0,
+                 probes: int = 3):
+        self.name = name
+        self.failures = failures
+        self.error_rate = error_rate
+        self.slow_seconds = slow_seconds
+        self.percentile = percentile
+        self.min_requests = min_requests
+        self.open_seconds = open_seconds
+        self.probes = probes
+        self.state = CLOSED
+        self.generation = 1
+        self._lock = threading.Lock()
+        self._outcomes = deque(maxlen=window)    # True for a failure
+        self._latencies = deque(maxlen=window)
+        self._consecutive = 0
+        self._successes = 0
+        self._retry_at = 0.0
+        self._trips = 0
+        self._rejected = 0
+        self._reason = None
+        self._stale = 0
+
+    def allow(self) -> bool:
+        """Whether a request may go to the backend now; in half_open this hands out the single trial slot."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            now = time.monotonic()
+            if now < self._retry_at:
+                self._rejected += 1
+                return False
+            # the trial slot expires after open_seconds, in case its request never reported back
+            self.state = HALF_OPEN
+            self.generation += 1
+            self._retry_at = now + self.open_seconds
+            return True
+
+    def record(self, ok: bool, latency: Optional[float] = None, generation: Optional[int] = None):
+        """Outcome of a request sent in `generation` (None: the current one); ignored if that has ended."""
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                self._stale += 1
+                return
+            if self.state != CLOSED:
+                if not ok:
+                    self._open('trial request failed')
+                    return
+                self._successes += 1
+                if self._successes >= self.probes:
+                    self._close()
+                else:
+                    # next trial right away
+                    self._retry_at = 0.0
+                return
+            self._outcomes.append(not ok)
+            if latency is not None:
+                self._latencies.append(latency)
+            self._consecutive = 0 if ok else self._consecutive + 1
+            if self._consecutive >= self.failures:
+                self._open(f'{self._consecutive} consecutive failures')
+            elif len(self._outcomes) >= self.min_requests and \
+                    sum(self._outcomes) >= self.error_rate * len(self._outcomes):
+                self._open(f'error rate {sum(self._outcomes)}/{len(self._outcomes)}')
+            elif self.slow_seconds and len(self._latencies) >= self.min_requests:
+                slow = self._latency_percentile()
+                if slow >= self.slow_seconds:
+                    self._open(f'p{self.percentile:g} latency {slow:.3f}s')
+
+    def _latency_percentile(self) -> float:
+        ordered = sorted(self._latencies)
+        return ordered[min(int(len(ordered) * self.percentile / 100), len(ordered) - 1)]
+
+    def _open(self, reason):
+        if self.state == CLOSED:
+            self._trips += 1
+        self.state = OPEN
+        self.generation += 1
+        self._reason = reason
+        self._retry_at = time.monotonic() + self.open_seconds
+        self._successes = 0
+
+    def _close(self):
+        self.state = CLOSED
+        self.generation += 1
+        self._reason = None
+        self._outcomes.clear()
+        self._latencies.clear()
+        self._consecutive = 0
+        self._successes = 0
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {'state': self.state, 'reason': self._reason, 'consecutive_failures': self._consecutive,
+                    'window': len(self._outcomes), 'window_errors': sum(self._outcomes),
+                    'trips': self._trips, 'rejected': self._rejected, 'stale_outcomes': self._stale}
+
+
+class CircuitBreakers:
+    """CircuitBreaker per backend URL, created on first use with the same settings."""
+
+    def __init__(self, **settings):
+        self._settings = settings
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, backend: str) -> CircuitBreaker:
+        breaker = self._breakers.get(backend)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.get(backend)
+                if breaker is None:
+                    breaker = self._breakers[backend] = CircuitBreaker(backend, **self._settings)
+        return breaker
+
+    def allow(self, backend: str) -> bool:
+        return self.get(backend).allow()
+
+    def record(self, backend: str, ok: bool, latency: Optional[float] = None, generation: Optional[int] = None):
+        self.get(backend).record(ok, latency, generation)
+
+    def split(self, backends: List[str]):
+        """(backends to call, {backend: 'circuit open'} for the skipped ones), order preserved."""
+        allowed, skipped = [], {}
+        for b in backends:
+            if self.allow(b):
+                allowed.append(b)
+            else:
+                skipped[b] = 'circuit open'
+        return allowed, skipped
+
+    def stats(self) -> Dict[str, Dict[str, object]]:
+        return {backend: breaker.stats() for backend, breaker in list(self._breakers.items())}
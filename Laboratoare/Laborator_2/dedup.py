@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Merge-on-read de-duplication of employee rows by id.
+Every write is replicated to all backends, so an aggregated read sees each employee once per node.
+Resolver keeps one row per id according to a conflict rule:
+- 'lww'   last write wins: the row with the highest value in the version field (rows without one lose)
+- 'first' the first copy seen, in backend order
+- 'none'  no de-duplication
+"""
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+RULES = ('lww', 'first', 'none')
+
+
+class Resolver:
+    def __init__(self, rule: str = 'lww', version_field: str = 'version'):
+        if rule not in RULES:
+            raise ValueError(f"unknown merge rule {rule!r}, expected one of {RULES}")
+        self.rule = rule
+        self.version_field = version_field
+
+    @property
+    def enabled(self) -> bool:
+        return self.rule != 'none'
+
+    @staticmethod
+    def row_id(row) -> Optional[str]:
+        if isinstance(row, dict) and row.get('id') is not None:
+            return str(row['id'])
+        return None
+
+    def winner(self, current: Dict[str, Any], candidate: Dict[str, Any]) -> Dict[str, Any]:
+        if self.rule != 'lww':
+            return current
+        new = candidate.get(self.version_field)
+        old = current.get(self.version_field)
+        if new is None:
+            return current
+        if old is None:
+            return candidate
+        try:
+            return candidate if new > old else current
+        except TypeError:
+            return candidate if str(new) > str(old) else current
+
+    def dedupe(self, rows: Iterable[Any]) -> List[Any]:
+        """One row per id, at the position of the id's first copy; rows without an id are kept as they are."""
+        if not self.enabled:
+            return list(rows)
+        out = []
+        index: Dict[str, int] = {}
+        for row in rows:
+            row_id = self.row_id(row)
+            if row_id is None:
+                out.append(row)
+            elif row_id in index:
+                out[index[row_id]] = self.winner(out[index[row_id]], row)
+            else:
+                index[row_id] = len(out)
+                out.append(row)
+        return out
+
+    def collapse(self, ordered_rows: Iterable[Any]) -> Iterator[Any]:
+        """dedupe() for rows whose copies of an id are adjacent (e.g. token-ordered): holds back one row at a time."""
+        group = Collapser(self)
+        for row in ordered_rows:
+            yield from group.push(row)
+        yield from group.flush()
+
+
+_EMPTY = object()
+
+
+class Collapser:
+    """Incremental collapse of a row sequence with adjacent copies, usable from sync and async loops alike."""
+
+    def __init__(self, resolver: Resolver):
+        self.resolver = resolver
+        self._held = _EMPTY
+        self._held_id = None
+
+    def push(self, row) -> List[Any]:
+        """Add the next row; returns the winner of the previous id once a different id shows up."""
+        row_id = self.resolver.row_id(row)
+        if self._held is not _EMPTY and row_id is not None and row_id == self._held_id and self.resolver.enabled:
+            self._held = self.resolver.winner(self._held, row)
+            return []
+        done = self.flush()
+        self._held, self._held_id = row, row_id
+        return done
+
+    def flush(self) -> List[Any]:
+        done = [] if self._held is _EMPTY else [self._held]
+        self._held, self._held_id = _EMPTY, None
+        return done
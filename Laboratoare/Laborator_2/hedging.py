@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Hedged reads: every backend holds a full copy, so a per-id read that is slower than usual can be raced.
+The first backend gets the request; if it has not answered within the tracked latency percentile (p95 by
+default), a second request goes to the next backend and whichever answers first is used, the other cancelled.
+Only the slowest few percent of reads are hedged, and HedgePolicy caps the extra requests at max_fraction.
+In the threaded form a loser cannot be interrupted and keeps its worker and backend connection until it
+answers; such abandoned calls count against the hedge budget while they run.
+Backends that fail outright are still tried one after the other, as before.
+"""
+import time
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+
+class HedgePolicy:
+    """Latency percentile of recent reads (the hedge delay) and the budget of hedged requests."""
+
+    def __init__(self, enabled: bool = True, percentile: float = 95, window: int = 200, min_samples: int = 20,
+                 min_delay: float = 0.005, max_fraction: float = 0.1):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.max_fraction = max_fraction
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._hedged = 0
+        self._hedge_wins = 0
+        self._abandoned = 0
+
+    def record(self, latency: float):
+        with self._lock:
+            self._latencies.append(latency)
+
+    def delay(self) -> Optional[float]:
+        """Seconds to wait for the first backend before hedging; None while disabled or still warming up."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            ordered = sorted(self._latencies)
+        slow = ordered[min(int(len(ordered) * self.percentile / 100), len(ordered) - 1)]
+        return max(slow, self.min_delay)
+
+    def started(self):
+        with self._lock:
+            self._requests += 1
+
+    def try_hedge(self) -> bool:
+        with self._lock:
+            if self._hedged + self._abandoned + 1 > self.max_fraction * self._requests:
+                return False
+            self._hedged += 1
+            return True
+
+    def hedge_won(self):
+        with self._lock:
+            self._hedge_wins += 1
+
+    def abandoned(self):
+        """A losing call was left running; it takes up hedge budget until settled() is called."""
+        with self._lock:
+            self._abandoned += 1
+
+    def settled(self):
+        with self._lock:
+            self._abandoned -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        delay = self.delay()
+        with self._lock:
+            return {'requests': self._requests, 'hedged': self._hedged, 'hedge_wins': self._hedge_wins,
+                    'abandoned': self._abandoned, 'delay': round(delay, 6) if delay is not None else None}
+
+
+class HedgedReads:
+    """
+    Threaded form. A read that cannot be hedged (hedging disabled or still warming up, or no worker free) runs
+    on the calling thread, backends one after the other. Otherwise the calls run on a pool of max_workers while
+    the caller waits for the first good answer; a call never queues behind that pool.
+    A blocking requests call cannot be interrupted, so a loser that already started is abandoned: its answer
+    is dropped when it arrives (within its own timeout). Until then it holds its worker and its BackendPool
+    connection, and the policy counts it against the hedge budget.
+    """
+
+    def __init__(self, policy: HedgePolicy, max_workers: int = 32):
+        self.policy = policy
+        self.max_workers = max_workers
+        self._busy = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='hedge')
+
+    def _timed(self, fn, backend):
+        start = time.monotonic()
+        result = fn(backend)
+        self.policy.record(time.monotonic() - start)
+        return result
+
+    def _claim(self) -> bool:
+        """Reserve a pool worker for one call."""
+        with self._lock:
+            if self._busy >= self.max_workers:
+                return False
+            self._busy += 1
+            return True
+
+    def _release(self):
+        with self._lock:
+            self._busy -= 1
+
+    def _pooled(self, fn, backend):
+        try:
+            return self._timed(fn, backend)
+        finally:
+            self._release()
+
+    def _one_by_one(self, candidates, fn, errors):
+        for backend in candidates:
+            try:
+                return backend, self._timed(fn, backend), errors
+            except Exception as e:
+                errors.append((backend, str(e) or e.__class__.__name__))
+        return None, None, errors
+
+    def call(self, backends: Iterable[str], fn: Callable[[str], Any]) -> Tuple[Optional[str], Any, List[tuple]]:
+        """
+        fn(backend) returns a usable answer or raises. Backends are tried in order, at most two at a time.
+        Returns (backend, answer, errors), backend None if every backend failed.
+        """
+        self.policy.started()
+        candidates = iter(backends)
+        errors = []
+        if self.policy.delay() is None or not self._claim():
+            return self._one_by_one(candidates, fn, errors)
+        first = next(candidates, None)
+        if first is None:
+            self._release()
+            return None, None, errors
+        in_flight = {self._executor.submit(self._pooled, fn, first): first}
+        hedge = None
+
+        def launch_hedge():
+            # the backend raced against the first one, '' if none is (no budget, worker or backend left)
+            if not self._claim():
+                return ''
+            backend = next(candidates, None) if self.policy.try_hedge() else None
+            if backend is None:
+                self._release()
+                return ''
+            in_flight[self._executor.submit(self._pooled, fn, backend)] = backend
+            return backend
+
+        try:
+            while in_flight:
+                delay = self.policy.delay() if hedge is None and len(in_flight) == 1 else None
+                done, _ = wait(in_flight, timeout=delay, return_when=FIRST_COMPLETED)
+                if not done:
+                    # slower than the tracked percentile: race it against the next backend
+                    hedge = launch_hedge()
+                    continue
+                for fut in done:
+                    backend = in_flight.pop(fut)
+                    try:
+                        result = fut.result()
+                    except Exception as e:
+                        errors.append((backend, str(e) or e.__class__.__name__))
+                        continue
+                    if backend == hedge:
+                        self.policy.hedge_won()
+                    return backend, result, errors
+        finally:
+            for loser in in_flight:
+                self.policy.abandoned()
+                loser.add_done_callback(lambda _: self.policy.settled())
+        # every raced backend failed: the rest are tried here, one after the other
+        return self._one_by_one(candidates, fn, errors)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class AsyncHedgedReads:
+    """asyncio form of HedgedReads; the losing request is cancelled, which closes its backend connection."""
+
+    def __init__(self, policy: HedgePolicy):
+        self.policy = policy
+
+    async def _timed(self, fn, backend):
+        start = time.monotonic()
+        result = await fn(backend)
+        self.policy.record(time.monotonic() - start)
+        return result
+
+    async def call(self, backends: Iterable[str], fn) -> Tuple[Optional[str], Any, List[tuple]]:
+        self.policy.started()
+        candidates = iter(backends)
+        in_flight = {}
+        errors = []
+        hedge = None
+
+        def launch():
+            backend = next(candidates, None)
+            if backend is not None:
+                in_flight[asyncio.ensure_future(self._timed(fn, backend))] = backend
+            return backend
+
+        launch()
+        try:
+            while in_flight:
+                delay = self.policy.delay() if hedge is None and len(in_flight) == 1 else None
+                done, _ = await asyncio.wait(in_flight, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedge = (launch() if self.policy.try_hedge() else None) or ''
+                    continue
+                for task in done:
+                    backend = in_flight.pop(task)
+                    if task.exception() is not None:
+                        errors.append((backend, str(task.exception()) or task.exception().__class__.__name__))
+                        continue
+                    if backend == hedge:
+                        self.policy.hedge_won()
+                    return backend, task.result(), errors
+                if not in_flight:
+                    launch()
+            return None, None, errors
+        finally:
+            for loser in in_flight:
+                loser.cancel()
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+Hinted handoff: a write that could not be delivered to a backend (breaker open, connection error or 5xx) is
+appended to that backend's hint log instead of being dropped, and a background thread replays it once the
+backend answers again, so the replicas converge instead of drifting apart. Replay is the retry: the replicator
+does not retry a write itself then, as a write retried inline could land after a newer one.
+- one append-only file per backend, one JSON line per write, and a small .offset file with how far replay
+  got; both survive a proxy restart
+- while a backend has hints pending, new writes for it are appended as well (write-behind), so they are
+  applied after the older ones; the file is truncated once replay has caught up
+- a write sent straight to a backend holds a ticket (its place in that backend's order) until the backend
+  answers. When one fails it is handed off: appended together with every write sent to the backend since the
+  oldest one still unanswered, answered or not, in ticket order. A newer write that got through while an older
+  one was failing is thus replayed after it again, and the older one never overwrites it (writes store the
+  whole employee, so applying one twice is harmless)
+- replay sends one hint at a time per backend, at most replay_rate per second, so catching up does not
+  starve live traffic; after a failure the backend is left alone for retry_seconds
+"""
+import os
+import re
+import json
+import time
+import base64
+import logging
+import itertools
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("hints")
+
+
+class HintLog:
+    """Hint file of one backend and its replay offset (bytes)."""
+
+    def __init__(self, directory: str, backend: str, fsync: bool = False):
+        self.backend = backend
+        self.path = os.path.join(directory, re.sub(r'[^A-Za-z0-9_.-]+', '_', backend) + '.log')
+        self.fsync = fsync
+        self.appended = 0
+        self.replayed = 0
+        self.dropped = 0
+        self.retry_at = 0.0
+        self.last_error = None
+        self._lock = threading.Lock()
+        # writes sent straight to the backend, by ticket, from the oldest one not answered yet on:
+        # [method, path, body, answered]
+        self._sent: Dict[int, list] = {}
+        self._tickets = itertools.count(1)
+        self._file = open(self.path, 'ab')
+        self._end = self._file.tell()
+        if self._end:
+            with open(self.path, 'rb') as f:
+                f.seek(self._end - 1)
+                if f.read(1) != b'\n':
+                    # a write cut short by a crash: end it, so the torn record is dropped on its own
+                    self._file.write(b'\n')
+                    self._file.flush()
+                    self._end += 1
+        self._offset = self._read_offset()
+        self._reader = open(self.path, 'rb')
+
+    def _read_offset(self) -> int:
+        try:
+            with open(self.path + '.offset') as f:
+                return min(int(f.read().strip() or 0), self._end)
+        except (OSError, ValueError):
+            return 0
+
+    def _write_offset(self):
+        tmp = self.path + '.offset.tmp'
+        with open(tmp, 'w') as f:
+            f.write(str(self._offset))
+        os.replace(tmp, self.path + '.offset')
+
+    def pending(self) -> int:
+        """Bytes of hints not replayed yet."""
+        with self._lock:
+            return self._end - self._offset
+
+    def outstanding(self) -> bool:
+        """Whether writes to the backend are still pending here: hints not replayed, or sends not answered."""
+        with self._lock:
+            return self._offset < self._end or bool(self._sent)
+
+    def _append(self, method: str, path: str, body: bytes):
+        # with self._lock held
+        line = json.dumps({'ts': round(time.time(), 3), 'method': method, 'path': path,
+                           'body': base64.b64encode(body).decode('ascii')}).encode('utf-8') + b'\n'
+        self._file.write(line)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self._end += len(line)
+        self.appended += 1
+
+    def reserve(self, method: str, path: str, body: bytes) -> Optional[int]:
+        """Ticket for a write to send straight to the backend; None, and the write appended, if hints are pending."""
+        with self._lock:
+            if self._offset < self._end:
+                self._append(method, path, body)
+                return None
+            ticket = next(self._tickets)
+            self._sent[ticket] = [method, path, body, False]
+            return ticket
+
+    def answered(self, ticket: int):
+        """The backend answered the write (applied or rejected it): it no longer holds back the ones after it."""
+        with self._lock:
+            sent = self._sent.get(ticket)
+            if sent is None:
+                return
+            sent[3] = True
+            while self._sent:
+                oldest = next(iter(self._sent))
+                if not self._sent[oldest][3]:
+                    break
+                del self._sent[oldest]
+
+    def hand_off(self, ticket: int) -> bool:
+        """The write failed: append it with the writes sent around it; False if that already happened."""
+        with self._lock:
+            if ticket not in self._sent:
+                return False
+            for method, path, body, _ in self._sent.values():
+                self._append(method, path, body)
+            self._sent.clear()
+            return True
+
+    def next(self) -> Optional[Tuple[Optional[dict], int]]:
+        """(hint, offset just past it) for the oldest pending hint, hint None if unreadable; None if caught up."""
+        with self._lock:
+            if self._offset >= self._end:
+                return None
+            offset = self._offset
+        self._reader.seek(offset)
+        line = self._reader.readline()
+        try:
+            hint = json.loads(line)
+            hint['body'] = base64.b64decode(hint['body'])
+        except (ValueError, KeyError, TypeError):
+            hint = None
+        return hint, offset + len(line)
+
+    def done(self, offset: int, applied: bool = True):
+        """The hint ending at offset was replayed (or dropped)."""
+        with self._lock:
+            self._offset = offset
+            if applied:
+                self.replayed += 1
+            else:
+                self.dropped += 1
+            if self._offset >= self._end:
+                # caught up: start the file over
+                self._file.truncate(0)
+                self._offset = self._end = 0
+            self._write_offset()
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {'pending_bytes': self._end - self._offset, 'appended': self.appended, 'replayed': self.replayed,
+                    'dropped': self.dropped, 'last_error': self.last_error}
+
+    def close(self):
+        self._file.close()
+        self._reader.close()
+
+
+class HintedHandoff:
+    """
+    HintLog per backend plus the replay thread.
+    send(backend, method, path, body, timeout) -> HTTP status; healthy(backend) says whether replay may try
+    the backend now (its circuit breaker: in half-open the replayed hint is the trial request).
+    """
+
+    def __init__(self, directory: str, send: Callable[[str, str, str, bytes, float], int],
+                 healthy: Callable[[str], bool], replay_rate: float = 50.0, retry_seconds: float = 1.0,
+                 timeout: float = 10.0, fsync: bool = False):
+        self.directory = directory
+        self.send = send
+        self.healthy = healthy
+        self.interval = 1.0 / replay_rate if replay_rate > 0 else 0.0
+        self.retry_seconds = retry_seconds
+        self.timeout = timeout
+        self.fsync = fsync
+        os.makedirs(directory, exist_ok=True)
+        self._logs: Dict[str, HintLog] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def log(self, backend: str) -> HintLog:
+        log = self._logs.get(backend)
+        if log is None:
+            with self._lock:
+                log = self._logs.get(backend)
+                if log is None:
+                    log = self._logs[backend] = HintLog(self.directory, backend, self.fsync)
+        return log
+
+    def split(self, backends: List[str], method: str, path: str, body: bytes) -> Tuple[Dict[str, int], List[str]]:
+        """
+        ({backend: ticket} to send the write to, backends it was appended for because they still have hints
+        pending). Every ticket must end in answered() or hand_off().
+        """
+        direct, deferred = {}, []
+        for b in backends:
+            ticket = self.log(b).reserve(method, path, body)
+            if ticket is None:
+                deferred.append(b)
+            else:
+                direct[b] = ticket
+        return direct, deferred
+
+    def answered(self, backend: str, ticket: int):
+        self.log(backend).answered(ticket)
+
+    def hand_off(self, backend: str, ticket: int):
+        """The write holding this ticket was not applied by the backend (or not sent): replay will apply it."""
+        if self.log(backend).hand_off(ticket):
+            logger.info("Hinted writes for %s", backend)
+        self._wake.set()
+
+    def outstanding(self, backend: str) -> bool:
+        """Writes the backend may not have applied yet: until they are, a 404 from it is not final."""
+        return self.log(backend).outstanding()
+
+    def start(self, backends: List[str]):
+        """Open the logs of the configured backends (hints left by an earlier run included) and start replay."""
+        for b in backends:
+            self.log(b)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='hint-replay', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            now = time.monotonic()
+            wait = 1.0
+            for log in list(self._logs.values()):
+                if not log.pending():
+                    continue
+                if now < log.retry_at:
+                    wait = min(wait, log.retry_at - now)
+                    continue
+                if not self.healthy(log.backend):
+                    log.retry_at = now + self.retry_seconds
+                    continue
+                self._replay_one(log)
+                log.retry_at = max(log.retry_at, now + self.interval)
+                wait = min(wait, self.interval)
+            self._wake.wait(wait)
+            self._wake.clear()
+
+    def _replay_one(self, log: HintLog):
+        entry = log.next()
+        if entry is None:
+            return
+        hint, offset = entry
+        if hint is None:
+            logger.warning("Dropping unreadable hint for %s", log.backend)
+            log.done(offset, applied=False)
+            return
+        try:
+            status = self.send(log.backend, hint['method'], hint['path'], hint['body'], self.timeout)
+        except Exception as e:
+            status, detail = None, str(e) or e.__class__.__name__
+        else:
+            detail = f'status {status}'
+        if status == 200:
+            log.last_error = None
+            log.done(offset)
+        elif status is not None and status < 500:
+            # the backend rejected the write itself; replaying it again will not help
+            logger.warning("Hinted %s %s rejected by %s (%s), dropped", hint['method'], hint['path'], log.backend,
+                           status)
+            log.done(offset, applied=False)
+        else:
+            log.last_error = detail
+            log.retry_at = time.monotonic() + self.retry_seconds
+
+    def stats(self) -> Dict[str, Dict[str, object]]:
+        return {backend: log.stats() for backend, log in list(self._logs.items())}
+
+    def shutdown(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+        for log in list(self._logs.values()):
+            log.close()
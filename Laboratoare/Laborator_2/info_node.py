@@ -6,46 +6,68 @@ Run: python -u info_node.py [port]
 Behavior:
 - Attempts to connect to Cassandra on startup.
 - Creates keyspace/table if they do not exist.
-- On POST/PUT: writes to Cassandra if available, else writes to in-memory store.
+- On POST/PUT: writes to Cassandra if available, else writes to in-memory store; the answer carries the employee
+  as stored (what a GET ?id= will return), which the proxy caches write-through.
 - On GET: reads from Cassandra if available, else from in-memory store.
+- GET /employees?limit=N[&after=ID] returns at most N employees past ID in token order (Cassandra's partition
+  order: Murmur3 token of the id, see pagination.py), one bounded query per page.
+- POST /employees/_bulk takes a JSON array or NDJSON of employees, written concurrently (Cassandra) or under
+  one lock (memory), and answers {"results": [{"id": ..., "status": 200}, ...]} in the order of the upload.
+- Logging goes through a background writer; one JSON access record per request (sampled per route).
 Configuration via environment variables:
 - CASS_CONTACT_POINTS (comma separated, default "127.0.0.1")
 - CASS_KEYSPACE (default "warehouse")
+- ACCESS_LOG_SAMPLE (per-route sampling rates, e.g. "/employees?id=0.01,*=1"; default "*=1")
+- BULK_CONCURRENCY (Cassandra writes in flight per bulk request, default 64)
+- LOG_QUEUE (records buffered for the log writer before new ones are dropped, default 10000)
 """
 import os
 import sys
 import json
+import bisect
+import time
+import uuid
 import logging
 import threading
 from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs
 from dicttoxml import dicttoxml
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Tuple
+from access_log import AccessLog, parse_rates, setup_logging
+from json_stream import BulkItemParser, InvalidItem
+from pagination import order_key, token
 
 # Cassandra driver
 try:
     from cassandra.cluster import Cluster
     from cassandra.query import SimpleStatement
+    from cassandra.concurrent import execute_concurrent_with_args
 except Exception:
     Cluster = None
 
-# configure logging to stdout
-logging.basicConfig(level=logging.INFO, stream=sys.stdout, format='[InfoNode] %(message)s')
+# configure logging to stdout, written by a background thread
+setup_logging('[InfoNode] ', int(os.environ.get('LOG_QUEUE', '10000')))
 logger = logging.getLogger("info_node")
+access_log = AccessLog('info_node', parse_rates(os.environ.get('ACCESS_LOG_SAMPLE', '*=1')))
 
 # in-memory fallback store
 _store: Dict[str, Dict[str, Any]] = {}
 _store_lock = threading.RLock()
+# order_key() of every id in _store, sorted: paginated reads walk the store in token order, like Cassandra
+_store_keys: List[Tuple[int, str]] = []
 
 # Cassandra configuration
 CASS_CONTACT_POINTS = os.environ.get('CASS_CONTACT_POINTS', '127.0.0.1').split(',')
 CASS_KEYSPACE = os.environ.get('CASS_KEYSPACE', 'warehouse')
+BULK_PATH = '/employees/_bulk'
+BULK_CONCURRENCY = int(os.environ.get('BULK_CONCURRENCY', '64'))
 
 class CassandraClient:
     def __init__(self, contact_points, keyspace):
         self.cluster = None
         self.session = None
         self.keyspace = keyspace
+        self._insert = None
         if Cluster is None:
             logger.warning("cassandra-driver not installed; Cassandra disabled")
             return
@@ -67,7 +89,8 @@ class CassandraClient:
                     title text
                 )
             """)
-            # prepare basic statements (we'll use simple execute for brevity)
+            # prepare basic statements (we'll use simple execute for brevity; bulk writes use a prepared one)
+            self._insert = self.session.prepare("INSERT INTO employees (id, name, title) VALUES (?, ?, ?)")
             logger.info("Connected to Cassandra and ensured schema exists")
         except Exception as e:
             logger.warning("Cassandra connection/setup failed: %s", e)
@@ -86,6 +109,15 @@ class CassandraClient:
         except Exception as e:
             raise
 
+    def insert_employees(self, emps: List[Dict[str, Any]], concurrency: int = 64) -> List[Optional[Exception]]:
+        """Write many employees with up to `concurrency` requests in flight; None or the error, per employee."""
+        if not self.session:
+            raise RuntimeError("No Cassandra session")
+        params = [(str(emp.get('id')), emp.get('name'), emp.get('title')) for emp in emps]
+        results = execute_concurrent_with_args(self.session, self._insert, params, concurrency=concurrency,
+                                               raise_on_first_error=False)
+        return [None if ok else outcome for ok, outcome in results]
+
     def get_employee(self, emp_id: str) -> Optional[Dict[str, Any]]:
         if not self.session:
             raise RuntimeError("No Cassandra session")
@@ -104,6 +136,18 @@ class CassandraClient:
             result.append({'id': r.id, 'name': r.name, 'title': r.title})
         return result
 
+    def list_employees_page(self, after: Optional[str], limit: int):
+        # id is the partition key: rows come back in token order, which is also the order pages are cut in,
+        # so a page is one bounded read
+        if not self.session:
+            raise RuntimeError("No Cassandra session")
+        if after is None:
+            rows = self.session.execute("SELECT id, name, title FROM employees LIMIT %s", (limit,))
+        else:
+            rows = self.session.execute("SELECT id, name, title FROM employees WHERE token(id) > token(%s) LIMIT %s",
+                                        (after, limit))
+        return [{'id': r.id, 'name': r.name, 'title': r.title} for r in rows]
+
     def close(self):
         try:
             if self.cluster:
@@ -114,6 +158,28 @@ class CassandraClient:
 # instantiate Cassandra client
 cass_client = CassandraClient(contact_points=CASS_CONTACT_POINTS, keyspace=CASS_KEYSPACE)
 
+def _store_put(emp_id: str, emp: Dict[str, Any]):
+    with _store_lock:
+        if emp_id not in _store:
+            bisect.insort(_store_keys, order_key(emp_id))
+        _store[emp_id] = emp
+
+def _store_put_many(emps: List[Dict[str, Any]]):
+    with _store_lock:
+        new_ids = [emp['id'] for emp in emps if emp['id'] not in _store]
+        for emp in emps:
+            _store[emp['id']] = emp
+        if new_ids:
+            # one sort of the merged list instead of an insort per id
+            _store_keys.extend(order_key(i) for i in set(new_ids))
+            _store_keys.sort()
+
+def _store_page(after: Optional[str], limit: int):
+    with _store_lock:
+        # past every id with the token of `after`, as token(id) > token(after) in Cassandra
+        start = bisect.bisect_left(_store_keys, (token(after) + 1,)) if after is not None else 0
+        return [_store[i] for _, i in _store_keys[start:start + limit]]
+
 def to_json(obj):
     return json.dumps(obj, ensure_ascii=False)
 
@@ -121,8 +187,30 @@ def to_xml(obj):
     b = dicttoxml(obj, custom_root='response', attr_type=False)
     return b.decode('utf-8')
 
+def _route(path: str) -> str:
+    """Bounded route name for access records (ids and cursors stay out of it)."""
+    parsed = urlparse(path)
+    if parsed.path == BULK_PATH:
+        return BULK_PATH
+    if parsed.path.rstrip('/') != '/employees':
+        return 'other'
+    params = parse_qs(parsed.query)
+    if 'id' in params:
+        return '/employees?id'
+    if 'limit' in params:
+        return '/employees?page'
+    return '/employees'
+
+
 class InfoHandler(BaseHTTPRequestHandler):
     protocol_version = 'HTTP/1.1'
+    # headers and body go out in separate writes: without TCP_NODELAY every keep-alive answer waits ~40 ms
+    # for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def parse_request(self):
+        self._started = time.monotonic()
+        return super().parse_request()
 
     def _parse_format(self, query, headers):
         q = parse_qs(query)
@@ -140,6 +228,9 @@ class InfoHandler(BaseHTTPRequestHandler):
         self.send_header('Content-Length', str(len(body_bytes)))
         self.end_headers()
         self.wfile.write(body_bytes)
+        access_log.record(_route(self.path), status, method=self.command, path=self.path,
+                          client=self.client_address[0], ms=round((time.monotonic() - self._started) * 1000, 3),
+                          bytes_out=len(body_bytes))
 
     def do_GET(self):
         parsed = urlparse(self.path)
@@ -153,6 +244,16 @@ class InfoHandler(BaseHTTPRequestHandler):
 
         params = parse_qs(query)
         id_list = params.get('id')
+        limit = None
+        if not id_list and 'limit' in params:
+            try:
+                limit = int(params['limit'][0])
+                if limit < 1:
+                    raise ValueError(limit)
+            except ValueError:
+                self._send(400, 'Bad Request', 'text/plain')
+                return
+        after = params['after'][0] if params.get('after') else None
         try:
             if id_list:
                 emp_id = id_list[0]
@@ -169,6 +270,11 @@ class InfoHandler(BaseHTTPRequestHandler):
                         self._send(404, 'Not Found', 'text/plain')
                         return
                     out = item
+            elif limit is not None:
+                if cass_client.session:
+                    out = cass_client.list_employees_page(after, limit)
+                else:
+                    out = _store_page(after, limit)
             else:
                 if cass_client.session:
                     out = cass_client.list_employees()
@@ -180,7 +286,7 @@ class InfoHandler(BaseHTTPRequestHandler):
             self._send(500, 'Internal Server Error', 'text/plain')
             return
 
-        logger.info("Served GET %s (items returned: %s)", self.path, (len(out) if isinstance(out, list) else 1))
+        logger.debug("Served GET %s (items returned: %s)", self.path, (len(out) if isinstance(out, list) else 1))
         if fmt == 'xml':
             self._send(200, to_xml(out), 'application/xml; charset=utf-8')
         else:
@@ -206,6 +312,9 @@ class InfoHandler(BaseHTTPRequestHandler):
         if path != '/employees' and not path.startswith('/employees/'):
             self._send(404, 'Not Found', 'text/plain')
             return
+        if path == BULK_PATH and self.command == 'POST':
+            self._handle_bulk()
+            return
 
         try:
             payload = self._read_body_json()
@@ -216,26 +325,70 @@ class InfoHandler(BaseHTTPRequestHandler):
 
         id_val = str(payload.get('id', ''))
         if not id_val:
-            import uuid
             id_val = str(uuid.uuid4())
             payload['id'] = id_val
 
         # write to Cassandra if available, else in-memory
+        stored = payload
         try:
             if cass_client.session:
                 cass_client.insert_employee(payload)
+                stored = {'id': id_val, 'name': payload.get('name'), 'title': payload.get('title')}
             else:
-                with _store_lock:
-                    _store[id_val] = payload
+                _store_put(id_val, payload)
         except Exception as e:
             logger.error("Write error (Cassandra): %s. Falling back to memory.", e)
-            with _store_lock:
-                _store[id_val] = payload
+            _store_put(id_val, payload)
 
-        logger.info("Received %s %s id=%s", self.command, self.path, id_val)
-        resp = {'result': 'ok', 'id': id_val}
+        logger.debug("Received %s %s id=%s", self.command, self.path, id_val)
+        resp = {'result': 'ok', 'id': id_val, 'employee': stored}
         self._send(200, to_json(resp), 'application/json; charset=utf-8')
 
+    def _handle_bulk(self):
+        length = int(self.headers.get('Content-Length', 0))
+        parser = BulkItemParser()
+        try:
+            items = parser.feed(self.rfile.read(length) if length else b'') + parser.close()
+        except ValueError as e:
+            logger.warning("Bulk body parse error: %s", e)
+            self._send(400, 'Bad Request', 'text/plain')
+            return
+
+        results: List[Dict[str, Any]] = []
+        emps = []
+        for item in items:
+            if isinstance(item, InvalidItem):
+                results.append({'status': 400, 'error': item.error})
+            elif not isinstance(item, dict):
+                results.append({'status': 400, 'error': 'not a JSON object'})
+            else:
+                emp_id = item.get('id')
+                # like single writes, a falsy id such as 0 is kept
+                item['id'] = str(uuid.uuid4()) if emp_id is None or emp_id == '' else str(emp_id)
+                emps.append(item)
+                results.append({'id': item['id'], 'status': 200})
+
+        # same fallback as single writes: what Cassandra did not take goes to memory
+        failed = emps
+        if cass_client.session and emps:
+            try:
+                errors = cass_client.insert_employees(emps, BULK_CONCURRENCY)
+                failed = [emp for emp, error in zip(emps, errors) if error is not None]
+                if failed:
+                    logger.error("Bulk write error (Cassandra) on %d of %d item(s): %s. Falling back to memory.",
+                                 len(failed), len(emps), next(e for e in errors if e is not None))
+            except Exception as e:
+                logger.error("Bulk write error (Cassandra): %s. Falling back to memory.", e)
+        if failed:
+            _store_put_many(failed)
+
+        logger.debug("Received bulk write of %d item(s), %d valid", len(items), len(emps))
+        self._send(200, to_json({'results': results}), 'application/json; charset=utf-8')
+
+    def log_request(self, code='-', size='-'):
+        # replaced by the access record written in _send()
+        pass
+
     def log_message(self, format, *args):
         logger.info("%s - - [%s] %s", self.client_address[0], self.log_date_time_string(), format % args)
 
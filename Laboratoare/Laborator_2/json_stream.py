@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Incremental JSON array handling for streamed aggregation.
+ArrayItemParser turns a backend's list body, fed in arbitrary pieces, into its items one at a time;
+ChunkedArrayWriter renders items back out as one JSON array in HTTP/1.1 chunked frames.
+Neither holds more than one partial item / one output chunk, whatever the size of the list.
+NdjsonParser and BulkItemParser do the same for bulk uploads (a JSON array or one JSON document per line).
+"""
+import json
+import codecs
+from typing import Any, Dict, List, Optional
+
+_decoder = json.JSONDecoder()
+_WS = ' \t\r\n'
+
+
+class ArrayItemParser:
+    """Feed bytes, get back the complete items of a top-level JSON array (a lone object counts as one item)."""
+
+    def __init__(self):
+        self._text = codecs.getincrementaldecoder('utf-8')()
+        self._buf = ''
+        self._state = 'start'   # start -> items -> end, or start -> object
+
+    def feed(self, data: bytes) -> List[Any]:
+        self._buf += self._text.decode(data)
+        return self._drain()
+
+    def close(self) -> List[Any]:
+        self._buf += self._text.decode(b'', final=True)
+        if self._state == 'object':
+            item, _ = _decoder.raw_decode(self._buf.strip(_WS))
+            self._state, self._buf = 'end', ''
+            return [item]
+        items = self._drain(final=True)
+        if self._state != 'end' or self._buf.strip(_WS):
+            raise ValueError('truncated or malformed JSON array')
+        return items
+
+    def _drain(self, final=False) -> List[Any]:
+        items = []
+        buf = self._buf
+        pos = 0
+        while True:
+            while pos < len(buf) and buf[pos] in _WS:
+                pos += 1
+            if pos == len(buf):
+                break
+            if self._state == 'start':
+                if buf[pos] == '{':
+                    self._state = 'object'
+                    break
+                if buf[pos] != '[':
+                    raise ValueError('expected a JSON array')
+                self._state = 'items'
+                pos += 1
+                continue
+            if self._state != 'items':
+                break
+            if buf[pos] == ']':
+                self._state = 'end'
+                pos += 1
+                continue
+            if buf[pos] == ',':
+                pos += 1
+                continue
+            try:
+                item, end = _decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if final:
+                    raise ValueError('truncated JSON array item')
+                break
+            # a number at the very end of the buffer may still be missing digits: wait for what follows it
+            if end == len(buf) and not final:
+                break
+            items.append(item)
+            pos = end
+        self._buf = buf[pos:]
+        return items
+
+
+class InvalidItem:
+    """Stands in for an NDJSON line that is not valid JSON, so one bad line does not void the whole upload."""
+    __slots__ = ('error',)
+
+    def __init__(self, error: str):
+        self.error = error
+
+
+class NdjsonParser:
+    """Feed bytes, get back one item per non-empty line (InvalidItem for lines that do not parse)."""
+
+    def __init__(self):
+        self._text = codecs.getincrementaldecoder('utf-8')('replace')
+        self._buf = ''
+
+    def feed(self, data: bytes) -> List[Any]:
+        self._buf += self._text.decode(data)
+        *lines, self._buf = self._buf.split('\n')
+        return [self._parse(line) for line in lines if line.strip(_WS)]
+
+    def close(self) -> List[Any]:
+        rest = self._buf + self._text.decode(b'', final=True)
+        self._buf = ''
+        return [self._parse(rest)] if rest.strip(_WS) else []
+
+    @staticmethod
+    def _parse(line):
+        try:
+            return json.loads(line)
+        except ValueError as e:
+            return InvalidItem(f'invalid JSON: {e}')
+
+
+class BulkItemParser:
+    """A JSON array or NDJSON, told apart by the first non-blank byte ('[' starts an array)."""
+
+    def __init__(self):
+        self._parser = None
+        self._head = b''
+
+    def feed(self, data: bytes) -> List[Any]:
+        if self._parser is None:
+            self._head += data
+            stripped = self._head.lstrip(_WS.encode('ascii'))
+            if not stripped:
+                return []
+            self._parser = ArrayItemParser() if stripped[:1] == b'[' else NdjsonParser()
+            data, self._head = self._head, b''
+        return self._parser.feed(data)
+
+    def close(self) -> List[Any]:
+        return self._parser.close() if self._parser is not None else []
+
+
+def chunk_frame(data: bytes) -> bytes:
+    return b'%x\r\n%s\r\n' % (len(data), data) if data else b''
+
+
+def last_chunk(trailers: Optional[Dict[str, str]] = None) -> bytes:
+    lines = ''.join(f"{k}: {v}\r\n" for k, v in (trailers or {}).items())
+    return b'0\r\n' + lines.encode('latin-1') + b'\r\n'
+
+
+class ChunkedArrayWriter:
+    """
+    Renders items as one JSON array, handed out as chunk frames of about chunk_size bytes.
+    A copy of the whole body is kept (for the cache) while it stays under keep_max bytes, then dropped.
+    """
+
+    def __init__(self, chunk_size: int = 16384, keep_max: int = 0):
+        self.chunk_size = chunk_size
+        self.keep_max = keep_max
+        self.count = 0
+        self._pending = bytearray(b'[')
+        self._kept = bytearray() if keep_max > 0 else None
+
+    def add(self, item) -> bytes:
+        """Append one item; returns a chunk frame to write once enough output has built up, else b''."""
+        if self.count:
+            self._pending += b', '
+        self._pending += json.dumps(item, ensure_ascii=False).encode('utf-8')
+        self.count += 1
+        if len(self._pending) < self.chunk_size:
+            return b''
+        return self._flush()
+
+    def finish(self, trailers: Optional[Dict[str, str]] = None) -> bytes:
+        """Closing bracket, the terminating zero-length chunk and any trailers."""
+        self._pending += b']'
+        return self._flush() + last_chunk(trailers)
+
+    @property
+    def body(self) -> Optional[bytes]:
+        """The complete body if it stayed under keep_max (only meaningful after finish())."""
+        return bytes(self._kept) if self._kept is not None else None
+
+    def _flush(self) -> bytes:
+        data = bytes(self._pending)
+        self._pending.clear()
+        if self._kept is not None:
+            if len(self._kept) + len(data) > self.keep_max:
+                self._kept = None
+            else:
+                self._kept += data
+        return chunk_frame(data)
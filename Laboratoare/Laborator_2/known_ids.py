@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Bloom filter of the employee ids that exist, for per-id lookups: a GET ?id= that misses the cache for an id the
+filter never saw is sent to the first backend only, with no hedge and no other replica behind it, unless that
+backend fails. The owner's answer (usually a 404, negative-cached as any other) still decides.
+- filled by paging every backend in token order at startup (GET /employees?limit=N&after=ID), then by the write
+  path: single writes and bulk items add their id before they are sent, ids assigned by a backend when it acks
+- only consulted once every backend was paged to the end; until then lookups go to the backends as before
+- the API never deletes employees, so the filter only grows. Ids written to the InfoNodes behind the proxy's
+  back are picked up by the next reload (every reload_seconds, 0: never); until then their lookups are unhedged
+- a false positive (an absent id the filter thinks it has) costs the usual hedged lookup, nothing more
+- one byte per bit: setting one is a single store, so threads and processes share the array without a lock;
+  with a path the array is a shared file mapping (the pre-fork workers' tmpfs) and every worker sees every write
+"""
+import os
+import math
+import mmap
+import time
+import struct
+import hashlib
+import logging
+import threading
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger("known_ids")
+
+# magic, bits, hashes: processes mapping one file check they agree on its layout
+_HEADER = struct.Struct('!8sQI')
+_MAGIC = b'KNOWNIDS'
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float, path: str = ''):
+        capacity = max(1, capacity)
+        self.bits = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        size = _HEADER.size + self.bits
+        header = _HEADER.pack(_MAGIC, self.bits, self.hashes)
+        if path:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                if os.fstat(fd).st_size == 0:
+                    os.ftruncate(fd, size)
+                buf = mmap.mmap(fd, 0)
+            finally:
+                os.close(fd)
+            if buf[:_HEADER.size] == bytes(_HEADER.size):
+                buf[:_HEADER.size] = header
+            if len(buf) != size or buf[:_HEADER.size] != header:
+                buf.close()
+                raise ValueError(f'{path} holds a filter of another size')
+        else:
+            buf = bytearray(size)
+            buf[:_HEADER.size] = header
+        self._buf = buf
+        self._bits = memoryview(buf)[_HEADER.size:]
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, key: str):
+        bits = self._bits
+        for pos in self._positions(key):
+            bits[pos] = 1
+
+    def __contains__(self, key: str) -> bool:
+        bits = self._bits
+        return all(bits[pos] for pos in self._positions(key))
+
+    def fill(self) -> float:
+        """Share of bits set; the false positive rate is about fill ** hashes."""
+        return bytes(self._bits).count(1) / self.bits
+
+
+class KnownIds:
+    """
+    BloomFilter plus its loader thread.
+    page(backend, after, limit) -> the ids of one page of that backend, in token order, starting after the id
+    `after` (None: from the start); raises on failure.
+    """
+
+    def __init__(self, backends: List[str], page: Callable[[str, Optional[str], int], List[str]],
+                 capacity: int = 1000000, error_rate: float = 0.01, path: str = '', page_rows: int = 1000,
+                 reload_seconds: float = 60.0, retry_seconds: float = 5.0):
+        try:
+            self.filter = BloomFilter(capacity, error_rate, path)
+        except (OSError, ValueError) as e:
+            logger.warning("Known-ids filter at %s unusable (%s), keeping a private one", path, e)
+            self.filter = BloomFilter(capacity, error_rate)
+        self.backends = list(backends)
+        self.page = page
+        self.page_rows = page_rows
+        self.reload_seconds = reload_seconds
+        self.retry_seconds = retry_seconds
+        self.ready = False
+        self.loaded_at = None
+        self.last_error = None
+        self.absent = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add(self, *ids):
+        for employee_id in ids:
+            if employee_id:
+                self.filter.add(str(employee_id))
+
+    def definitely_absent(self, employee_id) -> bool:
+        """True only if the filter is loaded and has never seen the id (counted in the stats as absent_lookups)."""
+        if not self.ready or str(employee_id) in self.filter:
+            return False
+        self.absent += 1
+        return True
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='known-ids', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            pending = list(self.backends)
+            started = time.monotonic()
+            while pending and not self._stop.is_set():
+                for backend in list(pending):
+                    try:
+                        self._load(backend)
+                        pending.remove(backend)
+                    except Exception as e:
+                        self.last_error = f'{backend}: {e}'
+                        logger.warning("Loading known ids from %s failed: %s", backend, e)
+                if pending:
+                    self._stop.wait(self.retry_seconds)
+            if pending:
+                return
+            self.last_error = None
+            self.loaded_at = time.time()
+            if not self.ready:
+                self.ready = True
+                logger.info("Known-ids filter loaded from %d backend(s) in %.1fs (%.1f%% of bits set)",
+                            len(self.backends), time.monotonic() - started, self.filter.fill() * 100)
+            if not self.reload_seconds or self._stop.wait(self.reload_seconds):
+                return
+
+    def _load(self, backend: str):
+        after = None
+        while not self._stop.is_set():
+            ids = self.page(backend, after, self.page_rows)
+            self.add(*ids)
+            if len(ids) < self.page_rows:
+                return
+            after = ids[-1]
+
+    def stats(self) -> Dict[str, object]:
+        return {'ready': self.ready, 'bits': self.filter.bits, 'hashes': self.filter.hashes,
+                'fill': round(self.filter.fill(), 4), 'absent_lookups': self.absent, 'loaded_at': self.loaded_at,
+                'last_error': self.last_error}
+
+    def shutdown(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
@@ -27,6 +27,15 @@ class LoadBalancer:
         idx = int(h, 16) % len(self.backends)
         return self.backends[idx]
 
+    def backends_for_key(self, key: str) -> List[str]:
+        """Preference list for key: its owner first, then the remaining backends in ring order."""
+        backends = list(self.backends)
+        if not key:
+            return backends
+        h = hashlib.md5(key.encode('utf-8')).hexdigest()
+        idx = int(h, 16) % len(backends)
+        return backends[idx:] + backends[:idx]
+
     def add(self, backend: str):
         with self._lock:
             self.backends.append(backend)
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Metrics registry rendered in the Prometheus text format (GET /metrics).
+Recording takes no lock: every thread adds to its own shard (a plain dict only that thread writes), and a
+scrape sums the shards. Shards of finished threads are folded into one retired shard, so a thread per
+connection does not grow the registry. Values that already live elsewhere (pool sizes, breaker states) are
+reported by collectors called at scrape time.
+"""
+import bisect
+import threading
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# fold the shards of finished threads once this many have piled up between scrapes
+_COMPACT_AT = 256
+
+
+def _format_value(v) -> str:
+    if isinstance(v, float):
+        if v == float('inf'):
+            return '+Inf'
+        return repr(v)
+    return str(v)
+
+
+def _escape(v) -> str:
+    return str(v).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + [f'{n}="{v}"' for n, v in extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, registry, name: str, help: str, labels: Sequence[str]):
+        self._registry = registry
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, *label_values, amount=1):
+        shard = self._registry._shard()
+        key = (self.name, label_values)
+        shard[key] = shard.get(key, 0) + amount
+
+
+class Gauge(Counter):
+    """Additive gauge (inc/dec from any thread, e.g. requests in flight)."""
+    kind = 'gauge'
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, registry, name, help, labels, buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *label_values):
+        shard = self._registry._shard()
+        key = (self.name, label_values)
+        cells = shard.get(key)
+        if cells is None:
+            # one count per bucket (not cumulative), then +Inf, sum, count
+            cells = shard[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        cells[bisect.bisect_left(self.buckets, value)] += 1
+        cells[-2] += value
+        cells[-1] += 1
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], Iterable[Tuple[str, str, str, Sequence[str], list]]]] = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards: List[Tuple[threading.Thread, dict]] = []
+        self._retired: dict = {}
+
+    def counter(self, name, help, labels=()) -> Counter:
+        return self._add(Counter(self, name, help, labels))
+
+    def gauge(self, name, help, labels=()) -> Gauge:
+        return self._add(Gauge(self, name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(self, name, help, labels, buckets))
+
+    def collector(self, fn):
+        """fn() yields (name, kind, help, label_names, [(label_values, value), ...]) at every scrape."""
+        self._collectors.append(fn)
+        return fn
+
+    def _add(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def _shard(self) -> dict:
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+                if len(self._shards) >= _COMPACT_AT:
+                    self._compact()
+        return shard
+
+    @staticmethod
+    def _merge(into, shard):
+        for key, value in list(shard.items()):
+            if isinstance(value, list):
+                cells = into.get(key)
+                if cells is None:
+                    into[key] = list(value)
+                else:
+                    for i, v in enumerate(value):
+                        cells[i] += v
+            else:
+                into[key] = into.get(key, 0) + value
+
+    def _compact(self):
+        # caller holds self._lock; a finished thread no longer writes its shard
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                self._merge(self._retired, shard)
+        self._shards = live
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            self._compact()
+            total = {}
+            self._merge(total, self._retired)
+            for _, shard in self._shards:
+                self._merge(total, shard)
+        return total
+
+    def render(self) -> str:
+        total = self.snapshot()
+        by_metric: Dict[str, list] = {}
+        for (name, label_values), value in total.items():
+            by_metric.setdefault(name, []).append((label_values, value))
+        out = []
+        for name, metric in self._metrics.items():
+            out.append(f'# HELP {name} {metric.help}')
+            out.append(f'# TYPE {name} {metric.kind}')
+            for label_values, value in sorted(by_metric.get(name, ()), key=lambda lv: lv[0]):
+                if isinstance(metric, Histogram):
+                    cumulative = 0
+                    for bound, count in zip(metric.buckets + (float('inf'),), value):
+                        cumulative += count
+                        le = (('le', _format_value(float(bound))),)
+                        out.append(f'{name}_bucket{_labels(metric.labels, label_values, le)} {cumulative}')
+                    out.append(f'{name}_sum{_labels(metric.labels, label_values)} {_format_value(value[-2])}')
+                    out.append(f'{name}_count{_labels(metric.labels, label_values)} {value[-1]}')
+                else:
+                    out.append(f'{name}{_labels(metric.labels, label_values)} {_format_value(value)}')
+        for collect in self._collectors:
+            for name, kind, help, label_names, samples in collect():
+                out.append(f'# HELP {name} {help}')
+                out.append(f'# TYPE {name} {kind}')
+                for label_values, value in samples:
+                    out.append(f'{name}{_labels(label_names, label_values)} {_format_value(value)}')
+        return '\n'.join(out) + '\n'
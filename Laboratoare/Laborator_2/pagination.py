@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Cursor pagination for the aggregated GET /employees?limit=N[&cursor=TOKEN].
+Every InfoNode returns its rows after a given id in token order (GET /employees?limit=N&after=ID), so one page
+is a k-way merge of one such page per backend. The cursor handed to clients is an opaque token that only
+carries the last id served, which keeps the cost of a page independent of how deep the client has walked.
+Token order is Cassandra's own order for the employees table (id is the partition key): the Murmur3 token of
+the id, then the id. Cassandra pages it natively with WHERE token(id) > token(?) LIMIT n, so a page costs
+O(n) there as well; the in-memory stores keep the same order.
+"""
+import json
+import heapq
+import base64
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlencode
+
+from dedup import Collapser, Resolver
+
+_MASK = (1 << 64) - 1
+_C1 = 0x87c37b91114253d5
+_C2 = 0x4cf5ad432745937f
+
+
+def _rotl(v: int, n: int) -> int:
+    return ((v << n) | (v >> (64 - n))) & _MASK
+
+
+def _fmix(k: int) -> int:
+    k ^= k >> 33
+    k = (k * 0xff51afd7ed558ccd) & _MASK
+    k ^= k >> 33
+    k = (k * 0xc4ceb9fe1a85ec53) & _MASK
+    return k ^ (k >> 33)
+
+
+def token(emp_id: str) -> int:
+    """Cassandra's Murmur3Partitioner token of an id."""
+    return murmur3_token(str(emp_id).encode('utf-8'))
+
+
+def murmur3_token(data: bytes) -> int:
+    """Murmur3Partitioner token of a partition key: MurmurHash3 x64_128 as Cassandra computes it."""
+    length = len(data)
+    h1 = h2 = 0
+    end = length - length % 16
+    for i in range(0, end, 16):
+        k1 = int.from_bytes(data[i:i + 8], 'little')
+        k2 = int.from_bytes(data[i + 8:i + 16], 'little')
+        k1 = (_rotl((k1 * _C1) & _MASK, 31) * _C2) & _MASK
+        h1 = ((_rotl(h1 ^ k1, 27) + h2) * 5 + 0x52dce729) & _MASK
+        k2 = (_rotl((k2 * _C2) & _MASK, 33) * _C1) & _MASK
+        h2 = ((_rotl(h2 ^ k2, 31) + h1) * 5 + 0x38495ab5) & _MASK
+    # Java reads the tail as signed bytes, so bytes >= 0x80 are sign-extended
+    tail = [b - 256 if b > 127 else b for b in data[end:]]
+    k1 = k2 = 0
+    for i in range(len(tail) - 1, 7, -1):
+        k2 ^= (tail[i] << ((i - 8) * 8)) & _MASK
+    if len(tail) > 8:
+        h2 ^= (_rotl((k2 * _C2) & _MASK, 33) * _C1) & _MASK
+    for i in range(min(len(tail), 8) - 1, -1, -1):
+        k1 ^= (tail[i] << (i * 8)) & _MASK
+    if tail:
+        h1 ^= (_rotl((k1 * _C1) & _MASK, 31) * _C2) & _MASK
+    h1 ^= length
+    h2 ^= length
+    h1 = (h1 + h2) & _MASK
+    h2 = (h2 + h1) & _MASK
+    h1 = (_fmix(h1) + _fmix(h2)) & _MASK
+    value = h1 - (1 << 64) if h1 >> 63 else h1
+    # Long.MIN_VALUE is reserved as the partitioner's minimum token
+    return (1 << 63) - 1 if value == -(1 << 63) else value
+
+
+def order_key(emp_id: str) -> Tuple[int, str]:
+    """Position of an id in token order."""
+    return token(emp_id), str(emp_id)
+
+
+def encode_cursor(last_id: str) -> str:
+    raw = json.dumps({'v': 1, 'after': last_id}, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def decode_cursor(token: str) -> str:
+    """The last id of the previous page; ValueError if the token was not made by encode_cursor()."""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        obj = json.loads(raw.decode('utf-8'))
+        if obj.get('v') == 1 and isinstance(obj.get('after'), str):
+            return obj['after']
+    except Exception:
+        pass
+    raise ValueError('invalid cursor')
+
+
+def page_params(query: str, max_limit: int) -> Optional[Tuple[int, Optional[str]]]:
+    """(limit, after_id) for a paginated request, None if the query asks for the whole list."""
+    params = parse_qs(query)
+    if 'limit' not in params and 'cursor' not in params:
+        return None
+    try:
+        limit = int(params.get('limit', [max_limit])[0])
+    except ValueError:
+        raise ValueError('limit must be an integer')
+    if limit < 1:
+        raise ValueError('limit must be positive')
+    after = decode_cursor(params['cursor'][0]) if params.get('cursor') else None
+    return min(limit, max_limit), after
+
+
+def id_key(row) -> Tuple[int, str]:
+    """Order of rows in backend pages: token order of their ids."""
+    return order_key(row.get('id', '')) if isinstance(row, dict) else order_key('')
+
+
+def row_after(row) -> str:
+    """The after= value that resumes a backend's pages past this row."""
+    return id_key(row)[1]
+
+
+def backend_page_path(path: str, limit: int, after: Optional[str]) -> str:
+    params = {'limit': limit}
+    if after is not None:
+        params['after'] = after
+    return path + '?' + urlencode(params)
+
+
+def merge_pages(pages: List[List[Dict[str, Any]]], limit: int,
+                resolver: Optional[Resolver] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    K-way merge of token-ordered backend pages into the first `limit` distinct ids.
+    Copies of the same id from several backends collapse into one row (the resolver's winner, else the first
+    copy): the cursor only records an id, so a page cannot end between two copies of it.
+    Returns (rows, next_cursor); next_cursor is None once no backend has anything left after this page.
+    """
+    if resolver is None or not resolver.enabled:
+        resolver = Resolver('first')
+    pages = [[r for r in page if isinstance(r, dict)] for page in pages]
+    # a backend that filled its page may hold more copies past its last id: nothing beyond the smallest such
+    # id is complete yet (that backend alone still gives `limit` distinct ids up to it)
+    full = [page for page in pages if len(page) >= limit]
+    bound = min(id_key(page[-1]) for page in full) if full else None
+    group = Collapser(resolver)
+    rows = []
+    for row in heapq.merge(*pages, key=id_key):
+        if bound is not None and id_key(row) > bound:
+            break
+        rows.extend(group.push(row))
+        if len(rows) == limit:
+            # the row just pushed starts the next page
+            break
+    else:
+        rows.extend(group.flush())
+        if bound is None:
+            return rows, None
+    if bound is not None and len(rows) < limit:
+        rows.extend(group.flush())
+    last_id = next((Resolver.row_id(r) for r in reversed(rows) if Resolver.row_id(r) is not None), None)
+    return rows, encode_cursor(last_id) if last_id is not None else None
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Pre-fork mode (PROXY_WORKERS > 1): a master process keeps that many proxy workers listening on one port.
+Every worker binds it with SO_REUSEPORT and the kernel spreads new connections over them, so each engine stays
+single-process code and the proxy still uses all cores.
+- workers are fresh interpreters (proxy_server.py with PROXY_WORKER_SLOT set) that report back once listening
+- SIGHUP on the master: graceful restart. A new generation is started, with the code and settings as they are
+  now; once all of it listens the old workers are sent SIGTERM. If a new worker does not come up the restart
+  is abandoned and the old generation keeps serving.
+- SIGTERM or SIGINT on the master: graceful stop of every worker
+- a worker that exits on its own is started again after RESPAWN_DELAY seconds
+- SIGTERM on a worker: it stops accepting, answers its requests in flight with Connection: close and exits when
+  they are done, after drain seconds at most; idle keep-alive connections are closed
+Workers share no memory, so:
+- cache: they share the Redis tier; without Redis, a SharedDirCache directory on tmpfs, swept by the master
+- hints: every worker slot has its own hint directory under PROXY_HINT_DIR, picked up by the next worker in it
+- the cached list is dropped on writes rather than patched (two workers patching it at once could lose a row),
+  unless PROXY_WRITE_THROUGH_LIST_MAX_BYTES is set explicitly
+- admission budgets, pools, breakers and the admin endpoints (/metrics too) are per worker
+"""
+import os
+import time
+import select
+import shutil
+import signal
+import logging
+import tempfile
+import threading
+import subprocess
+from typing import Callable, Dict, List, Optional, Tuple
+
+from shared_cache import SharedDirCache
+
+logger = logging.getLogger("prefork")
+
+RESPAWN_DELAY = 1.0
+# seconds a new worker gets to start listening
+READY_TIMEOUT = 30.0
+SWEEP_SECONDS = 5.0
+
+
+class Drain:
+    """Requests in flight in this process, so that a stopping worker can let them finish."""
+
+    def __init__(self):
+        self.draining = False
+        self.active = 0
+        self._lock = threading.Lock()
+
+    def begin(self):
+        with self._lock:
+            self.active += 1
+
+    def end(self):
+        with self._lock:
+            self.active -= 1
+
+    def wait(self, seconds: float) -> bool:
+        """Block until no request is in flight or `seconds` passed; True if none is."""
+        deadline = time.monotonic() + seconds
+        while self.active and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return not self.active
+
+
+def notify_ready():
+    """Tell the master this worker listens (no-op outside pre-fork mode)."""
+    fd = os.environ.pop('PROXY_READY_FD', None)
+    if fd:
+        os.write(int(fd), b'1')
+        os.close(int(fd))
+
+
+def watch_master(stop: Callable[[], None]):
+    """Call stop() once if the master goes away, so that workers do not outlive it."""
+    master = int(os.environ.get('PROXY_MASTER_PID', '0'))
+    if not master:
+        return
+
+    def watch():
+        while os.getppid() == master:
+            time.sleep(1)
+        logger.warning('Master %d is gone, stopping', master)
+        stop()
+    threading.Thread(target=watch, name='watch-master', daemon=True).start()
+
+
+class Master:
+    def __init__(self, command: List[str], workers: int, drain_seconds: float, hint_dir: str = '',
+                 shared_dir: str = ''):
+        self.command = command
+        self.workers = workers
+        self.drain_seconds = drain_seconds
+        self.hint_dir = hint_dir
+        self._own_shared_dir = not shared_dir
+        if not shared_dir:
+            shared_dir = tempfile.mkdtemp(prefix='proxy-cache-', dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
+        self.shared = SharedDirCache(shared_dir)
+        self._env = dict(os.environ, PROXY_SHARED_CACHE_DIR=shared_dir, PROXY_MASTER_PID=str(os.getpid()))
+        self._env.setdefault('PROXY_WRITE_THROUGH_LIST_MAX_BYTES', '0')
+        self._generation = 0
+        self._current: Dict[int, subprocess.Popen] = {}
+        self._retiring: List[Tuple[subprocess.Popen, float]] = []
+        self._respawn: Dict[int, float] = {}
+        self._restart = False
+        self._stop = False
+
+    def _slots(self) -> List[int]:
+        # generations alternate between two sets of slots, so a new worker never shares a hint directory with
+        # the draining worker it replaces
+        first = (self._generation % 2) * self.workers
+        return list(range(first, first + self.workers))
+
+    def _start(self, slots: List[int]) -> Optional[Dict[int, subprocess.Popen]]:
+        """Start one worker per slot and wait until all listen; None (and none left running) if one did not."""
+        started = {}
+        for slot in slots:
+            read_fd, write_fd = os.pipe()
+            env = dict(self._env, PROXY_WORKER_SLOT=str(slot), PROXY_READY_FD=str(write_fd))
+            if self.hint_dir:
+                env['PROXY_HINT_DIR'] = os.path.join(self.hint_dir, f'worker-{slot}')
+            try:
+                proc = subprocess.Popen(self.command, env=env, pass_fds=(write_fd,), start_new_session=True)
+            finally:
+                os.close(write_fd)
+            started[slot] = (proc, read_fd)
+        deadline = time.monotonic() + READY_TIMEOUT
+        ready = {}
+        for slot, (proc, read_fd) in started.items():
+            try:
+                readable, _, _ = select.select([read_fd], [], [], max(0.0, deadline - time.monotonic()))
+                if readable and os.read(read_fd, 1):
+                    ready[slot] = proc
+            finally:
+                os.close(read_fd)
+        if len(ready) < len(started):
+            for slot, (proc, _) in started.items():
+                if proc.poll() is None:
+                    proc.kill()
+                proc.wait()
+            logger.error('Worker(s) %s did not start', sorted(set(started) - set(ready)))
+            return None
+        for slot, proc in ready.items():
+            logger.info('Worker %d (pid %d) listening', slot, proc.pid)
+        return ready
+
+    def _retire(self, proc: subprocess.Popen):
+        if proc.poll() is None:
+            proc.send_signal(signal.SIGTERM)
+            self._retiring.append((proc, time.monotonic() + self.drain_seconds + 5))
+
+    def _restart_generation(self):
+        self._generation += 1
+        started = self._start(self._slots())
+        if started is None:
+            self._generation -= 1
+            logger.error('Restart abandoned, the running workers keep serving')
+            return
+        old, self._current = list(self._current.values()), started
+        self._respawn.clear()
+        for proc in old:
+            self._retire(proc)
+        logger.info('Restarted: generation %d serving, %d worker(s) draining', self._generation, len(old))
+
+    def _reap(self):
+        now = time.monotonic()
+        for slot, proc in list(self._current.items()):
+            if proc.poll() is not None:
+                logger.warning('Worker %d (pid %d) exited with status %s', slot, proc.pid, proc.returncode)
+                del self._current[slot]
+                self._respawn[slot] = now + RESPAWN_DELAY
+        for slot, at in list(self._respawn.items()):
+            if at <= now:
+                del self._respawn[slot]
+                started = self._start([slot])
+                if started:
+                    self._current.update(started)
+                else:
+                    self._respawn[slot] = time.monotonic() + RESPAWN_DELAY
+        retiring = []
+        for proc, deadline in self._retiring:
+            if proc.poll() is None:
+                if now >= deadline:
+                    logger.warning('Worker pid %d did not drain in time, killing it', proc.pid)
+                    proc.kill()
+                retiring.append((proc, deadline))
+        self._retiring = retiring
+
+    def run(self) -> int:
+        signal.signal(signal.SIGHUP, lambda *_: setattr(self, '_restart', True))
+        signal.signal(signal.SIGTERM, lambda *_: setattr(self, '_stop', True))
+        signal.signal(signal.SIGINT, lambda *_: setattr(self, '_stop', True))
+        try:
+            started = self._start(self._slots())
+            if started is None:
+                return 1
+            self._current = started
+            logger.info('Master pid %d running %d worker(s)', os.getpid(), self.workers)
+            next_sweep = time.monotonic() + SWEEP_SECONDS
+            while not self._stop:
+                # a restart waits for the previous generation to finish draining
+                if self._restart and not self._retiring:
+                    self._restart = False
+                    self._restart_generation()
+                self._reap()
+                if time.monotonic() >= next_sweep:
+                    self.shared.sweep()
+                    next_sweep = time.monotonic() + SWEEP_SECONDS
+                time.sleep(0.2)
+            logger.info('Stopping %d worker(s)...', len(self._current))
+            for proc in self._current.values():
+                self._retire(proc)
+            self._current = {}
+            while self._retiring:
+                self._reap()
+                time.sleep(0.1)
+            return 0
+        finally:
+            for proc in list(self._current.values()) + [p for p, _ in self._retiring]:
+                proc.kill()
+            if self._own_shared_dir:
+                shutil.rmtree(self.shared.directory, ignore_errors=True)
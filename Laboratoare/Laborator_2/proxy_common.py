@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+"""
+Settings and helpers shared by the proxy engines (threaded ProxyHandler and the asyncio engine).
+Tunables can be overridden with PROXY_* environment variables.
+"""
+import os
+import gzip
+import json
+import hashlib
+import logging
+from urllib.parse import urlparse, parse_qs, parse_qsl, urlencode
+
+import cache_envelope
+from cache_envelope import Envelope, etag_matches
+from metrics import Registry
+
+logger = logging.getLogger("proxy")
+
+# configure backends (PROXY_BACKENDS: comma separated base URLs)
+BACKENDS = [b.strip().rstrip('/') for b in
+            os.environ.get('PROXY_BACKENDS', 'http://localhost:8001,http://localhost:8002').split(',') if b.strip()]
+
+# cached GET responses are fresh for CACHE_TTL seconds; after that they may still be served stale:
+# immediately while one background refresh runs (STALE_WHILE_REVALIDATE seconds), or in place of a
+# backend error (STALE_IF_ERROR seconds)
+CACHE_TTL = int(os.environ.get('PROXY_CACHE_TTL', '30'))
+STALE_WHILE_REVALIDATE = int(os.environ.get('PROXY_STALE_WHILE_REVALIDATE', '30'))
+STALE_IF_ERROR = int(os.environ.get('PROXY_STALE_IF_ERROR', '300'))
+CACHE_STALE_SECONDS = max(STALE_WHILE_REVALIDATE, STALE_IF_ERROR)
+
+# overall deadline (seconds) for the parallel fan-out of aggregated GET /employees
+AGGREGATE_DEADLINE = float(os.environ.get('PROXY_AGGREGATE_DEADLINE', '5'))
+# partial aggregates (some backends missing) are cached only briefly
+PARTIAL_CACHE_TTL = int(os.environ.get('PROXY_PARTIAL_CACHE_TTL', '5'))
+# POST/PUT are acknowledged once WRITE_QUORUM backends accepted them; the rest replicate in the background
+WRITE_QUORUM = int(os.environ.get('PROXY_WRITE_QUORUM', '1'))
+WRITE_TIMEOUT = float(os.environ.get('PROXY_WRITE_TIMEOUT', '10'))
+REPLICATION_RETRIES = int(os.environ.get('PROXY_REPLICATION_RETRIES', '2'))
+# aggregated GET /employees misses can be streamed to HTTP/1.1 clients (chunked) as backend rows arrive
+# instead of being buffered whole; proxy memory is then bounded by the buffer sizes below
+STREAM_AGGREGATES = os.environ.get('PROXY_STREAM_AGGREGATES', '0') == '1'
+STREAM_BUFFER_ITEMS = int(os.environ.get('PROXY_STREAM_BUFFER_ITEMS', '1000'))
+STREAM_CHUNK_BYTES = int(os.environ.get('PROXY_STREAM_CHUNK_BYTES', '16384'))
+STREAM_READ_BYTES = int(os.environ.get('PROXY_STREAM_READ_BYTES', '65536'))
+# a streamed list is still cached if its body stays under this size (0 disables)
+STREAM_CACHE_MAX_BYTES = int(os.environ.get('PROXY_STREAM_CACHE_MAX_BYTES', str(1024 * 1024)))
+# aggregated lists hold one row per employee id even though every backend returns its own copy;
+# PROXY_MERGE_RULE picks the copy kept: lww (highest PROXY_MERGE_VERSION_FIELD), first, or none
+MERGE_RULE = os.environ.get('PROXY_MERGE_RULE', 'lww')
+MERGE_VERSION_FIELD = os.environ.get('PROXY_MERGE_VERSION_FIELD', 'version')
+# de-duplicated streaming walks each backend in token order (pagination.py), STREAM_PAGE_ROWS rows per request;
+# every request is one bounded page read on the node
+STREAM_PAGE_ROWS = int(os.environ.get('PROXY_STREAM_PAGE_ROWS', '500'))
+# GET /employees?limit=N&cursor=TOKEN returns one page of at most PAGE_MAX_LIMIT rows
+PAGE_MAX_LIMIT = int(os.environ.get('PROXY_PAGE_MAX_LIMIT', '1000'))
+# cached bodies of at least GZIP_MIN_BYTES are also stored gzip-compressed, once, for clients that accept it
+GZIP_MIN_BYTES = int(os.environ.get('PROXY_GZIP_MIN_BYTES', '1024'))
+GZIP_LEVEL = int(os.environ.get('PROXY_GZIP_LEVEL', '6'))
+# after an acknowledged write the per-id entry is refilled from the stored employee the backend returned and the
+# cached JSON list is patched in place if under WRITE_THROUGH_LIST_MAX_BYTES (0: always dropped); every other
+# cached variant of the list and of the written id is dropped. PROXY_WRITE_THROUGH=0 only drops.
+WRITE_THROUGH = os.environ.get('PROXY_WRITE_THROUGH', '1') == '1'
+WRITE_THROUGH_LIST_MAX_BYTES = int(os.environ.get('PROXY_WRITE_THROUGH_LIST_MAX_BYTES', str(1024 * 1024)))
+# confirmed 404s for GET ?id= are cached this long so repeated misses skip the backends
+NEGATIVE_CACHE_TTL = int(os.environ.get('PROXY_NEGATIVE_CACHE_TTL', '5'))
+# per-backend connection pool: pooled keep-alive connections and cap on concurrent requests
+POOL_SIZE = int(os.environ.get('PROXY_POOL_SIZE', '20'))
+POOL_MAX_IN_FLIGHT = int(os.environ.get('PROXY_POOL_MAX_IN_FLIGHT', str(POOL_SIZE)))
+# admission control for requests that need the backends (cache hits are always served): at most
+# MAX_READS GETs / MAX_WRITES POST/PUTs in progress, up to *_QUEUE more waiting ADMIT_MAX_WAIT seconds;
+# the rest get 503 with Retry-After (or a stale copy of a GET, if one is still in the cache)
+MAX_READS = int(os.environ.get('PROXY_MAX_READS', '64'))
+READ_QUEUE = int(os.environ.get('PROXY_READ_QUEUE', '32'))
+MAX_WRITES = int(os.environ.get('PROXY_MAX_WRITES', '16'))
+WRITE_QUEUE = int(os.environ.get('PROXY_WRITE_QUEUE', '16'))
+ADMIT_MAX_WAIT = float(os.environ.get('PROXY_ADMIT_MAX_WAIT', '1'))
+RETRY_AFTER = int(os.environ.get('PROXY_RETRY_AFTER', '1'))
+# per-backend circuit breakers: a backend is skipped for BREAKER_OPEN_SECONDS after BREAKER_FAILURES
+# consecutive failures, or once at least BREAKER_MIN_REQUESTS of its last BREAKER_WINDOW requests show an
+# error rate >= BREAKER_ERROR_RATE or a BREAKER_PERCENTILE latency >= BREAKER_SLOW_SECONDS (0 disables);
+# then trial requests probe it, and BREAKER_PROBES successes in a row bring it back
+BREAKER_FAILURES = int(os.environ.get('PROXY_BREAKER_FAILURES', '5'))
+BREAKER_ERROR_RATE = float(os.environ.get('PROXY_BREAKER_ERROR_RATE', '0.5'))
+BREAKER_SLOW_SECONDS = float(os.environ.get('PROXY_BREAKER_SLOW_SECONDS', '2'))
+BREAKER_PERCENTILE = float(os.environ.get('PROXY_BREAKER_PERCENTILE', '95'))
+BREAKER_WINDOW = int(os.environ.get('PROXY_BREAKER_WINDOW', '50'))
+BREAKER_MIN_REQUESTS = int(os.environ.get('PROXY_BREAKER_MIN_REQUESTS', '20'))
+BREAKER_OPEN_SECONDS = float(os.environ.get('PROXY_BREAKER_OPEN_SECONDS', '5'))
+BREAKER_PROBES = int(os.environ.get('PROXY_BREAKER_PROBES', '3'))
+BREAKER_SETTINGS = dict(failures=BREAKER_FAILURES, error_rate=BREAKER_ERROR_RATE, slow_seconds=BREAKER_SLOW_SECONDS,
+                        percentile=BREAKER_PERCENTILE, window=BREAKER_WINDOW, min_requests=BREAKER_MIN_REQUESTS,
+                        open_seconds=BREAKER_OPEN_SECONDS, probes=BREAKER_PROBES)
+# hedged per-id reads: when the first backend has not answered within the HEDGE_PERCENTILE latency of recent
+# per-id reads (at least HEDGE_MIN_DELAY seconds), the next backend is asked too and the first answer wins;
+# at most HEDGE_MAX_FRACTION of per-id reads send the extra request, counting losers still running (threaded engine)
+HEDGE_READS = os.environ.get('PROXY_HEDGE_READS', '1') == '1'
+HEDGE_PERCENTILE = float(os.environ.get('PROXY_HEDGE_PERCENTILE', '95'))
+HEDGE_MIN_DELAY = float(os.environ.get('PROXY_HEDGE_MIN_DELAY', '0.005'))
+HEDGE_MAX_FRACTION = float(os.environ.get('PROXY_HEDGE_MAX_FRACTION', '0.1'))
+HEDGE_SETTINGS = dict(enabled=HEDGE_READS, percentile=HEDGE_PERCENTILE, min_delay=HEDGE_MIN_DELAY,
+                      max_fraction=HEDGE_MAX_FRACTION)
+# threaded engine: worker threads for hedged reads (the first request and its hedge); a per-id read finding
+# none free, or made while hedging is off or warming up, runs on its own handler thread without a hedge
+HEDGE_WORKERS = int(os.environ.get('PROXY_HEDGE_WORKERS', '64'))
+# logging goes through a queue of LOG_QUEUE records to a background writer (full queue = records dropped);
+# one access record per request, sampled per route: PROXY_ACCESS_LOG_SAMPLE="/employees?id=0.01,*=1"
+LOG_QUEUE = int(os.environ.get('PROXY_LOG_QUEUE', '10000'))
+ACCESS_LOG_SAMPLE = os.environ.get('PROXY_ACCESS_LOG_SAMPLE', '*=1')
+# POST BULK_PATH takes a JSON array or NDJSON of employees, replicated to the backends BULK_CHUNK_ITEMS at a time
+# with up to BULK_PARALLEL_CHUNKS chunks in flight while the rest of the upload is read
+BULK_PATH = '/employees/_bulk'
+BULK_CHUNK_ITEMS = int(os.environ.get('PROXY_BULK_CHUNK_ITEMS', '500'))
+BULK_PARALLEL_CHUNKS = int(os.environ.get('PROXY_BULK_PARALLEL_CHUNKS', '4'))
+# hinted handoff, off unless PROXY_HINT_DIR names a directory (resolved at startup, created if missing): writes a
+# backend missed (breaker open, failed) are appended to a per-backend file there and replayed in order once it
+# is healthy, at most HINT_REPLAY_RATE per second. Replay replaces the REPLICATION_RETRIES inline retries.
+# HINT_FSYNC=1 also fsyncs every hint (survives an OS crash, not just a proxy crash)
+HINT_DIR = os.path.abspath(os.environ['PROXY_HINT_DIR']) if os.environ.get('PROXY_HINT_DIR') else ''
+HINT_REPLAY_RATE = float(os.environ.get('PROXY_HINT_REPLAY_RATE', '50'))
+HINT_RETRY_SECONDS = float(os.environ.get('PROXY_HINT_RETRY_SECONDS', '1'))
+HINT_FSYNC = os.environ.get('PROXY_HINT_FSYNC', '0') == '1'
+HINT_SETTINGS = dict(replay_rate=HINT_REPLAY_RATE, retry_seconds=HINT_RETRY_SECONDS, timeout=WRITE_TIMEOUT,
+                     fsync=HINT_FSYNC)
+# pre-fork: WORKERS > 1 runs that many worker processes on the port (SO_REUSEPORT) under a master process that
+# restarts them gracefully on SIGHUP; a stopping process lets its requests in flight finish for DRAIN_SECONDS
+WORKERS = int(os.environ.get('PROXY_WORKERS', '1'))
+DRAIN_SECONDS = float(os.environ.get('PROXY_DRAIN_SECONDS', '10'))
+# set by the master in each worker's environment
+WORKER_SLOT = os.environ.get('PROXY_WORKER_SLOT', '')
+# without Redis, cache entries are shared through files in this directory (tmpfs) instead of kept in process
+# memory; the master points its workers at one it creates under /dev/shm unless this is set
+SHARED_CACHE_DIR = os.environ.get('PROXY_SHARED_CACHE_DIR', '')
+# the asyncio engine makes blocking cache calls (Redis round trips, shared directory files) on this many threads
+# instead of on its event loop; the in-process cache is called directly
+CACHE_IO_WORKERS = int(os.environ.get('PROXY_CACHE_IO_WORKERS', '8'))
+# PROXY_KNOWN_IDS=1 keeps a bloom filter of the employee ids that exist (loaded from the backends, then fed by
+# the write path): a per-id miss for an id it never saw asks the first backend only, without a hedge. Sized for
+# KNOWN_IDS_CAPACITY ids at KNOWN_IDS_ERROR_RATE false positives; reloaded every KNOWN_IDS_RELOAD_SECONDS
+# (0: only at startup) to pick up ids written to the InfoNodes directly. Pre-fork workers share one filter.
+KNOWN_IDS = os.environ.get('PROXY_KNOWN_IDS', '0') == '1'
+KNOWN_IDS_SETTINGS = dict(capacity=int(os.environ.get('PROXY_KNOWN_IDS_CAPACITY', '1000000')),
+                          error_rate=float(os.environ.get('PROXY_KNOWN_IDS_ERROR_RATE', '0.01')),
+                          reload_seconds=float(os.environ.get('PROXY_KNOWN_IDS_RELOAD_SECONDS', '60')),
+                          path=os.path.join(SHARED_CACHE_DIR, 'known-ids') if SHARED_CACHE_DIR else '',
+                          page_rows=STREAM_PAGE_ROWS)
+# admin endpoint reporting pool usage (active, idle, waits) as JSON
+POOL_STATS_PATH = '/_proxy/pools'
+# admin endpoint reporting the read/write admission budgets
+ADMISSION_STATS_PATH = '/_proxy/admission'
+# admin endpoint reporting the circuit breaker state of every backend
+BREAKER_STATS_PATH = '/_proxy/breakers'
+# admin endpoint reporting the hint backlog of every backend
+HINT_STATS_PATH = '/_proxy/hints'
+# admin endpoint reporting the known-ids filter
+KNOWN_IDS_STATS_PATH = '/_proxy/known-ids'
+# Prometheus scrape endpoint
+METRICS_PATH = '/metrics'
+
+HOP_BY_HOP = ('transfer-encoding', 'connection', 'keep-alive', 'proxy-authenticate',
+              'proxy-authorization', 'te', 'trailers', 'upgrade', 'content-length')
+# cache key components longer than this are replaced by a fixed-width digest
+CACHE_KEY_MAX_COMPONENT = int(os.environ.get('PROXY_CACHE_KEY_MAX_COMPONENT', '64'))
+# representations an InfoNode can produce (?format= or the Accept header): the only request header the
+# cached response varies on (Accept-Encoding variants live inside one cache entry)
+RESPONSE_FORMATS = ('json', 'xml')
+
+# set per response when it is sent, so never part of a cache entry
+NOT_CACHED_HEADERS = HOP_BY_HOP + ('server', 'date', 'x-proxy-cache')
+
+# metrics shared by both engines (one engine runs per process)
+METRICS = Registry()
+REQUESTS = METRICS.counter('proxy_requests_total', 'Client requests by route, method and status code.',
+                           ('route', 'method', 'code'))
+REQUEST_SECONDS = METRICS.histogram('proxy_request_duration_seconds',
+                                    'Time from request received to response written, by route and method.',
+                                    ('route', 'method'))
+IN_FLIGHT = METRICS.gauge('proxy_requests_in_flight', 'Client requests being handled, by method.', ('method',))
+REQUEST_BYTES = METRICS.counter('proxy_request_body_bytes_total', 'Request body bytes received from clients.',
+                                ('route',))
+RESPONSE_BYTES = METRICS.counter('proxy_response_bytes_total', 'Response bytes (headers and body) written to clients.',
+                                 ('route',))
+CACHE_RESULTS = METRICS.counter('proxy_cache_results_total',
+                                'Responses by cache outcome (hit, miss, stale, stale-if-error, coalesced).',
+                                ('result',))
+BACKEND_SECONDS = METRICS.histogram('proxy_backend_request_duration_seconds',
+                                    'Backend request latency up to the response body, by backend.', ('backend',))
+BACKEND_FAILURES = METRICS.counter('proxy_backend_errors_total',
+                                   'Backend requests that failed (connection error, timeout or 5xx).', ('backend',))
+ADMIN_PATHS = (POOL_STATS_PATH, ADMISSION_STATS_PATH, BREAKER_STATS_PATH, HINT_STATS_PATH, KNOWN_IDS_STATS_PATH,
+               METRICS_PATH)
+
+
+def route_label(path) -> str:
+    """Bounded route name for metrics: the employee id and cursor never become label values."""
+    parsed = urlparse(path)
+    if parsed.path in ADMIN_PATHS:
+        return parsed.path
+    if parsed.path == BULK_PATH:
+        return BULK_PATH
+    if parsed.path.rstrip('/') != '/employees':
+        return 'other'
+    params = parse_qs(parsed.query)
+    if 'id' in params:
+        return '/employees?id'
+    if 'limit' in params or 'cursor' in params:
+        return '/employees?page'
+    return '/employees'
+
+
+def stats_collector(pools, breakers, admission, hedging, hints=None):
+    """Metrics collector over an engine's own stats() callables: pool, breaker, admission, hedging, hint state."""
+    states = {'closed': 0, 'half_open': 1, 'open': 2}
+
+    def collect():
+        pool_stats = pools()
+        yield ('proxy_backend_connections_active', 'gauge', 'Backend requests in flight, by backend.', ('backend',),
+               [((b,), st['active']) for b, st in pool_stats.items()])
+        yield ('proxy_backend_connections_idle', 'gauge', 'Idle pooled backend connections, by backend.',
+               ('backend',), [((b,), st['idle']) for b, st in pool_stats.items()])
+        breaker_stats = breakers()
+        yield ('proxy_circuit_state', 'gauge', 'Circuit breaker state: 0 closed, 1 half-open, 2 open.', ('backend',),
+               [((b,), states[st['state']]) for b, st in breaker_stats.items()])
+        yield ('proxy_circuit_trips_total', 'counter', 'Times the circuit breaker opened.', ('backend',),
+               [((b,), st['trips']) for b, st in breaker_stats.items()])
+        budgets = admission()
+        yield ('proxy_admission_running', 'gauge', 'Admitted requests in progress, by budget.', ('budget',),
+               [((name,), st['running']) for name, st in budgets.items()])
+        yield ('proxy_admission_waiting', 'gauge', 'Requests queued for admission, by budget.', ('budget',),
+               [((name,), st['waiting']) for name, st in budgets.items()])
+        yield ('proxy_admission_rejected_total', 'counter', 'Requests shed by admission control, by budget.',
+               ('budget',), [((name,), st['rejected']) for name, st in budgets.items()])
+        hedge = hedging()
+        yield ('proxy_hedged_reads_total', 'counter', 'Per-id reads that sent a hedge request.', (),
+               [((), hedge['hedged'])])
+        yield ('proxy_hedge_wins_total', 'counter', 'Hedged reads answered first by the hedge request.', (),
+               [((), hedge['hedge_wins'])])
+        yield ('proxy_hedge_abandoned', 'gauge', 'Losing hedged-read calls still running (threaded engine).', (),
+               [((), hedge['abandoned'])])
+        if hints is not None:
+            hint_stats = hints()
+            yield ('proxy_hints_pending_bytes', 'gauge', 'Hinted writes not replayed yet, by backend.', ('backend',),
+                   [((b,), st['pending_bytes']) for b, st in hint_stats.items()])
+            yield ('proxy_hints_replayed_total', 'counter', 'Hinted writes replayed to their backend.', ('backend',),
+                   [((b,), st['replayed']) for b, st in hint_stats.items()])
+
+    return collect
+
+
+def _digest_if_long(component: str) -> str:
+    if len(component) <= CACHE_KEY_MAX_COMPONENT:
+        return component
+    return '#' + hashlib.blake2b(component.encode('utf-8', 'surrogateescape'), digest_size=16).hexdigest()
+
+
+def response_format(query_params, accept) -> str:
+    """The representation an InfoNode answers with: ?format= wins over Accept, JSON by default."""
+    for name, value in query_params:
+        if name == 'format':
+            return value.lower()
+    return 'xml' if 'xml' in (accept or '') else 'json'
+
+
+def cache_key_for(method, path, query_params, fmt, body=b'') -> str:
+    """
+    Normalized key: trailing slash dropped, query parameters sorted (format folded into the variant),
+    long components and any request body replaced by a digest. E.g. "GET:/employees?id=7|json".
+    """
+    path = path.rstrip('/') or '/'
+    query = urlencode(sorted((k, v) for k, v in query_params if k != 'format'))
+    key = f"{method}:{_digest_if_long(path)}"
+    if query:
+        key += '?' + _digest_if_long(query)
+    key += '|' + fmt
+    if body:
+        key += '|#' + hashlib.blake2b(body, digest_size=16).hexdigest()
+    return key
+
+
+def make_cache_key(method, path, body=b'', accept=''):
+    """Cache key for a request plus the employee id it targets (?id= for GET, 'id' of a JSON body for POST/PUT)."""
+    parsed = urlparse(path)
+    query_params = parse_qsl(parsed.query, keep_blank_values=True)
+    resource_id = None
+
+    if method in ('POST', 'PUT'):
+        if body:
+            try:
+                j = json.loads(body.decode('utf-8'))
+                if isinstance(j, dict) and 'id' in j:
+                    resource_id = str(j['id'])
+            except Exception:
+                pass
+    else:
+        parsed_qs = parse_qs(parsed.query)
+        if 'id' in parsed_qs:
+            resource_id = parsed_qs['id'][0]
+
+    key = cache_key_for(method, parsed.path, query_params, response_format(query_params, accept), body)
+    return key, resource_id
+
+
+def content_length(value) -> int:
+    """A Content-Length header value; ValueError unless it is a plain non-negative integer."""
+    value = str(value).strip()
+    if not (value.isascii() and value.isdigit()):
+        raise ValueError(f'invalid Content-Length {value!r}')
+    return int(value)
+
+
+def _compressible(headers) -> bool:
+    ctype = next((v for k, v in headers.items() if k.lower() == 'content-type'), '').lower()
+    return ctype.startswith('text/') or 'json' in ctype or 'xml' in ctype
+
+
+def encode_cache_entry(status, headers, body_bytes) -> bytes:
+    stored = {k: v for k, v in headers.items() if k.lower() not in NOT_CACHED_HEADERS}
+    gzipped = None
+    if GZIP_MIN_BYTES and len(body_bytes) >= GZIP_MIN_BYTES and _compressible(stored):
+        gzipped = gzip.compress(body_bytes, GZIP_LEVEL, mtime=0)
+        if len(gzipped) >= len(body_bytes):
+            gzipped = None
+    return cache_envelope.pack(status, stored, body_bytes, gzipped)
+
+
+def accepts_gzip(accept_encoding) -> bool:
+    """Whether an Accept-Encoding header value allows gzip (explicitly or via '*', with q > 0)."""
+    allowed = {}
+    for part in (accept_encoding or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if coding:
+            allowed[coding.strip().lower()] = q
+    return allowed.get('gzip', allowed.get('x-gzip', allowed.get('*', 0.0))) > 0
+
+
+def decode_cache_entry(cached) -> Envelope:
+    """Raises ValueError for anything that is not a cache envelope (e.g. written by an older proxy)."""
+    return cache_envelope.unpack(cached)
+
+
+LIST_TAG = 'employees:list'
+
+
+def id_tag(employee_id) -> str:
+    return f'employees:id:{employee_id}'
+
+
+def cache_tags(key: str):
+    """
+    Tags of a cached GET, so a write can drop every variant of what it changed (any format or query):
+    id_tag(id) for per-id reads, LIST_TAG for the rest of /employees (lists, pages, queries kept as a digest).
+    """
+    if not key.startswith('GET:'):
+        return ()
+    path, _, query = key[4:].partition('|')[0].partition('?')
+    if not path.startswith(('/employees', '#')):
+        return ()
+    ids = parse_qs(query).get('id') if query and not query.startswith('#') else None
+    return (id_tag(ids[0]),) if ids else (LIST_TAG,)
+
+
+def store_response(cache, key, status, headers, body_bytes, ttl_seconds, stale_seconds=0) -> Envelope:
+    """Cache a backend response and return it as the envelope a hit would get (with its ETag)."""
+    encoded = encode_cache_entry(status, headers, body_bytes)
+    cache.put(key, encoded, ttl_seconds=ttl_seconds, stale_seconds=stale_seconds, tags=cache_tags(key))
+    return decode_cache_entry(encoded)
+
+
+def not_modified(if_none_match, body) -> bool:
+    """True when a GET can be answered 304: the client already holds this cached 200 response."""
+    return bool(if_none_match) and isinstance(body, Envelope) and body.status == 200 \
+        and etag_matches(if_none_match, body.etag)
+
+
+def invalidate_after_write(cache, *written_ids):
+    # Invalidate every cached variant (format, query, page) of:
+    # - the aggregated GET list: "GET:/employees", "GET:/employees?limit=..&cursor=..", ...
+    # - per-id GET for each id just written: "GET:/employees?id=<id>" (also drops a cached 404)
+    try:
+        cache.invalidate_tag(LIST_TAG)
+        for written_id in written_ids:
+            if written_id:
+                cache.invalidate_tag(id_tag(written_id))
+    except Exception:
+        logger.warning("Cache invalidation failed (continuing)")
@@ -1,211 +1,806 @@
 #!/usr/bin/env python3
 """
-Reverse proxy (clean) with caching + deterministic routing by id + aggregation for GET /employees.
+Reverse proxy (clean) with caching + deterministic routing by id + parallel aggregation for GET /employees.
+Writes are replicated to all backends in parallel and acknowledged once the write quorum is reached.
 Additional behavior: invalidate cache for aggregated and per-id GET keys after successful write.
-Run: python -u proxy_server.py
+GET /employees?limit=N&cursor=TOKEN is served page by page (k-way merge of per-backend pages in token order).
+With PROXY_STREAM_AGGREGATES=1 aggregated list misses are streamed to the client as the rows arrive.
+POST /employees/_bulk (JSON array or NDJSON) is replicated to the backends in chunks, with per-item results.
+With PROXY_KNOWN_IDS=1 per-id lookups of ids a bloom filter never saw ask only their owner, without a hedge.
+With --workers K (PROXY_WORKERS) K worker processes share the port under a pre-fork master (see prefork.py).
+Run: python -u proxy_server.py [port] [--engine threading|asyncio] [--workers K]
 """
+import os
 import sys
+import time
+import signal
+import asyncio
 import logging
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
-from urllib.parse import urlparse, parse_qs
+from urllib.parse import urlparse
 import requests
 from cache_layer import CacheLayer
 from load_balancer import LoadBalancer
+from scatter_gather import ScatterGather
+from replicator import QuorumReplicator
+from bulk import BulkBatcher
+from hinted_handoff import HintedHandoff
+from write_through import WriteThrough, stored_employee
+from backend_pool import BackendPools
+from admission import Admission
+from circuit_breaker import CircuitBreakers, CLOSED
+from hedging import HedgePolicy, HedgedReads
+from singleflight import SingleFlight
+from json_stream import ArrayItemParser, ChunkedArrayWriter
+from pagination import page_params, backend_page_path, merge_pages, id_key, row_after
+from dedup import Resolver
+from prefork import Drain, Master, notify_ready, watch_master
+from known_ids import KnownIds
+from proxy_common import (BACKENDS, CACHE_TTL, STALE_WHILE_REVALIDATE, STALE_IF_ERROR, CACHE_STALE_SECONDS,
+                          AGGREGATE_DEADLINE, PARTIAL_CACHE_TTL, WRITE_QUORUM, WRITE_TIMEOUT,
+                          REPLICATION_RETRIES, NEGATIVE_CACHE_TTL, POOL_SIZE, POOL_MAX_IN_FLIGHT,
+                          STREAM_AGGREGATES, STREAM_BUFFER_ITEMS, STREAM_CHUNK_BYTES, STREAM_READ_BYTES,
+                          STREAM_CACHE_MAX_BYTES, STREAM_PAGE_ROWS, MERGE_RULE, MERGE_VERSION_FIELD,
+                          PAGE_MAX_LIMIT, MAX_READS, READ_QUEUE, MAX_WRITES, WRITE_QUEUE, ADMIT_MAX_WAIT,
+                          RETRY_AFTER, BULK_PATH, BULK_CHUNK_ITEMS, BULK_PARALLEL_CHUNKS, HINT_DIR, HINT_SETTINGS,
+                          HINT_STATS_PATH, WRITE_THROUGH, WRITE_THROUGH_LIST_MAX_BYTES, BREAKER_SETTINGS, WORKERS,
+                          DRAIN_SECONDS, WORKER_SLOT, SHARED_CACHE_DIR, KNOWN_IDS, KNOWN_IDS_SETTINGS,
+                          KNOWN_IDS_STATS_PATH,
+                          HEDGE_SETTINGS, HEDGE_WORKERS, ADMISSION_STATS_PATH, BREAKER_STATS_PATH,
+                          POOL_STATS_PATH, METRICS_PATH, LOG_QUEUE, ACCESS_LOG_SAMPLE, HOP_BY_HOP, METRICS,
+                          REQUESTS, REQUEST_SECONDS, IN_FLIGHT, REQUEST_BYTES, RESPONSE_BYTES, CACHE_RESULTS,
+                          route_label, stats_collector, make_cache_key, content_length, Envelope, decode_cache_entry,
+                          store_response, not_modified, accepts_gzip, invalidate_after_write)
+from async_proxy import AsyncProxy
+from access_log import AccessLog, parse_rates, setup_logging
 import json
 
-logging.basicConfig(level=logging.INFO, stream=sys.stdout, format='[Proxy] %(message)s')
+setup_logging('[Proxy] ', LOG_QUEUE)
 logger = logging.getLogger("proxy")
+_NOTHING = object()
+
+
+class _CountingWriter:
+    """wfile wrapper that counts the bytes written to the client."""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.written = 0
+
+    def write(self, data):
+        self.written += len(data)
+        return self.raw.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+
+def _replay_via(pools):
+    """send() for HintedHandoff: replays go through the backend pools like any other request."""
+    def send(backend, method, path, body, timeout):
+        return pools.request(backend, method, path, headers={'Content-Type': 'application/json'}, data=body,
+                             timeout=timeout).status_code
+    return send
+
+
+def _page_ids_via(pools):
+    """page() for KnownIds: one page of a backend's ids, through the backend pools."""
+    def page(backend, after, limit):
+        resp = pools.request(backend, 'GET', backend_page_path('/employees', limit, after),
+                             timeout=AGGREGATE_DEADLINE)
+        resp.raise_for_status()
+        return [str(row['id']) for row in resp.json()]
+    return page
 
-# configure backends
-BACKENDS = ['http://localhost:8001', 'http://localhost:8002']
 
 class ProxyHandler(BaseHTTPRequestHandler):
     protocol_version = 'HTTP/1.1'
-    session = requests.Session()
-    cache = CacheLayer()
+    # headers and body go out in separate writes: without TCP_NODELAY every keep-alive answer waits ~40 ms
+    # for the client's delayed ACK
+    disable_nagle_algorithm = True
+    # shared with the asyncio engine
+    cache = CacheLayer(shared_dir=SHARED_CACHE_DIR)
     lb = LoadBalancer(BACKENDS)
+    # backend resources (threads, executors, connections, hint files) are built by build(), for this engine only:
+    # the asyncio engine has its own
+    breakers = pools = write_through = scatter = replicator = bulk_chunks = hints = known_ids = hedged = None
+    flights = SingleFlight()
+    resolver = Resolver(MERGE_RULE, MERGE_VERSION_FIELD)
+    # separate budgets so a burst of reads cannot starve replicated writes, and the other way round
+    reads = Admission('reads', MAX_READS, READ_QUEUE, ADMIT_MAX_WAIT)
+    writes = Admission('writes', MAX_WRITES, WRITE_QUEUE, ADMIT_MAX_WAIT)
+    access = AccessLog('proxy', parse_rates(ACCESS_LOG_SAMPLE))
+    drain = Drain()
+
+    @classmethod
+    def build(cls):
+        """Create the threaded engine's backend resources; run() calls it before serving."""
+        # backends whose breaker is open are skipped by reads and replication instead of timing out every request
+        cls.breakers = CircuitBreakers(**BREAKER_SETTINGS)
+        cls.pools = BackendPools(size=POOL_SIZE, max_in_flight=POOL_MAX_IN_FLIGHT, breakers=cls.breakers)
+        cls.write_through = WriteThrough(cls.cache, WRITE_THROUGH, WRITE_THROUGH_LIST_MAX_BYTES, CACHE_TTL,
+                                         CACHE_STALE_SECONDS)
+        cls.scatter = ScatterGather()
+        cls.replicator = QuorumReplicator(retries=REPLICATION_RETRIES)
+        cls.bulk_chunks = ThreadPoolExecutor(max_workers=16, thread_name_prefix='bulk')
+        # writes a backend missed are kept and replayed to it later instead of being dropped
+        if HINT_DIR:
+            cls.hints = HintedHandoff(HINT_DIR, _replay_via(cls.pools), cls.breakers.allow, **HINT_SETTINGS)
+        # per-id misses for ids never stored are answered without the backends
+        if KNOWN_IDS:
+            cls.known_ids = KnownIds(BACKENDS, _page_ids_via(cls.pools), **KNOWN_IDS_SETTINGS)
+        cls.hedged = HedgedReads(HedgePolicy(**HEDGE_SETTINGS), HEDGE_WORKERS)
 
     def _make_cache_key(self):
-        parsed = urlparse(self.path)
-        key = f"{self.command}:{parsed.geturl()}"
         self._saved_body = b''
-        self._saved_id = None
-
         if self.command in ('POST', 'PUT'):
-            length = int(self.headers.get('Content-Length', 0))
-            if length:
-                body = self.rfile.read(length)
-                self._saved_body = body
-                try:
-                    j = json.loads(body.decode('utf-8'))
-                    if isinstance(j, dict) and 'id' in j:
-                        self._saved_id = str(j['id'])
-                except Exception:
-                    pass
-                key += f":{self._saved_body.decode('utf-8', errors='ignore')}"
-        else:
-            parsed_qs = parse_qs(parsed.query)
-            if 'id' in parsed_qs:
-                self._saved_id = parsed_qs['id'][0]
-
+            if self._length:
+                self._saved_body = self.rfile.read(self._length)
+                REQUEST_BYTES.inc(self._route, amount=len(self._saved_body))
+                self._bytes_in = len(self._saved_body)
+        key, self._saved_id = make_cache_key(self.command, self.path, self._saved_body,
+                                             self.headers.get('Accept', ''))
         return key
 
+    def setup(self):
+        super().setup()
+        self.wfile = _CountingWriter(self.wfile)
+
+    def parse_request(self):
+        # counted from the request line on, so a stopping server waits for requests it has started reading
+        self.drain.begin()
+        self._counted = True
+        return super().parse_request()
+
+    def handle_one_request(self):
+        self._counted = False
+        try:
+            super().handle_one_request()
+        finally:
+            if self._counted:
+                self.drain.end()
+            if self.drain.draining:
+                self.close_connection = True
+
+    def send_response(self, code, message=None):
+        self._status = code
+        super().send_response(code, message)
+        if self.drain.draining:
+            self.send_header('Connection', 'close')
+
     def _send_raw(self, status, headers, body_bytes):
+        if 'X-Proxy-Cache' in headers:
+            self._cache_result = headers['X-Proxy-Cache']
+            CACHE_RESULTS.inc(self._cache_result.lower())
+        if isinstance(body_bytes, Envelope):
+            body_bytes = body_bytes.for_encoding(accepts_gzip(self.headers.get('Accept-Encoding')))
+        if self.command == 'GET' and not_modified(self.headers.get('If-None-Match'), body_bytes):
+            # the client's copy is current: no body, and nothing was asked of the backends for a cached entry
+            status, headers, body_bytes = 304, dict(headers, ETag=body_bytes.etag), b''
         self.send_response(status)
         for k, v in headers.items():
-            if k.lower() in ('transfer-encoding', 'connection', 'keep-alive', 'proxy-authenticate',
-                             'proxy-authorization', 'te', 'trailers', 'upgrade'):
+            if k.lower() in HOP_BY_HOP or k.lower() in ('server', 'date'):
                 continue
             self.send_header(k, str(v))
-        self.send_header('Content-Length', str(len(body_bytes)))
+        if isinstance(body_bytes, Envelope):
+            # cache hit: the stored header block, blank line and body go out in one write as they are
+            self.send_header('Content-Length', str(body_bytes.body_len))
+            self.flush_headers()
+            self.wfile.write(body_bytes.wire)
+            return
+        if status != 304:
+            self.send_header('Content-Length', str(len(body_bytes)))
         self.end_headers()
         if body_bytes:
             self.wfile.write(body_bytes)
 
     def do_GET(self):
-        return self._handle_forward()
+        return self._observed()
 
     def do_POST(self):
-        return self._handle_forward()
+        return self._observed()
 
     def do_PUT(self):
-        return self._handle_forward()
+        return self._observed()
+
+    def _observed(self):
+        method = self.command
+        self._route = route_label(self.path)
+        self._status, self._bytes_in, self._cache_result = 0, 0, None
+        start, sent = time.monotonic(), self.wfile.written
+        IN_FLIGHT.inc(method)
+        try:
+            self._handle_forward()
+        finally:
+            IN_FLIGHT.dec(method)
+            elapsed, sent = time.monotonic() - start, self.wfile.written - sent
+            REQUESTS.inc(self._route, method, str(self._status))
+            REQUEST_SECONDS.observe(elapsed, self._route, method)
+            RESPONSE_BYTES.inc(self._route, amount=sent)
+            self.access.record(self._route, self._status, method=method, path=self.path,
+                               client=self.client_address[0], ms=round(elapsed * 1000, 3), bytes_in=self._bytes_in,
+                               bytes_out=sent, cache=self._cache_result)
 
     def _aggregate_get_from_backends(self, path_with_query, headers):
+        def fetch(backend, timeout):
+            resp = self.pools.request(backend, 'GET', path_with_query, headers=headers, timeout=timeout)
+            if resp.status_code != 200:
+                raise requests.RequestException(f"status {resp.status_code}")
+            return resp.json()
+
+        backends = list(self.lb.backends)
+        targets, skipped = self.breakers.split(backends)
+        results, missing = self.scatter.gather(targets, fetch, AGGREGATE_DEADLINE)
+        missing.update(skipped)
         aggregated = []
-        errors = []
-        for backend in self.lb.backends:
-            target = backend + path_with_query
+        for backend in backends:
+            j = results.get(backend)
+            if isinstance(j, list):
+                aggregated.extend(j)
+            elif isinstance(j, dict):
+                aggregated.append(j)
+        errors = [(backend, missing[backend]) for backend in backends if backend in missing]
+        # every write is replicated, so each employee arrives once per backend
+        return self.resolver.dedupe(aggregated), errors
+
+    def _fetch_aggregate(self, cache_key, path_with_query, headers):
+        aggregated, errors = self._aggregate_get_from_backends(path_with_query, headers)
+        if len(errors) == len(self.lb.backends):
+            logger.warning("Aggregated GET %s failed on every backend: %s", path_with_query, errors)
+            return 502, {'Content-Type': 'text/plain'}, b'Bad Gateway'
+        body_bytes = json.dumps(aggregated, ensure_ascii=False).encode('utf-8')
+        resp_headers = {'Content-Type': 'application/json; charset=utf-8', 'X-Backend': 'aggregated'}
+        if errors:
+            resp_headers['X-Missing-Backends'] = ','.join(backend for backend, _ in errors)
+            envelope = store_response(self.cache, cache_key, 200, resp_headers, body_bytes, PARTIAL_CACHE_TTL)
+        else:
+            envelope = store_response(self.cache, cache_key, 200, resp_headers, body_bytes, CACHE_TTL,
+                                      CACHE_STALE_SECONDS)
+        logger.debug("Aggregated GET %s -> total %s items (errors: %s)", path_with_query, len(aggregated), errors)
+        return 200, {'X-Proxy-Cache': 'MISS'}, envelope
+
+    def _fetch_page(self, cache_key, path, page, headers):
+        limit, after = page
+        backend_path = backend_page_path(path, limit, after)
+
+        def fetch(backend, timeout):
+            resp = self.pools.request(backend, 'GET', backend_path, headers=headers, timeout=timeout)
+            if resp.status_code != 200:
+                raise requests.RequestException(f"status {resp.status_code}")
+            return resp.json()
+
+        backends = list(self.lb.backends)
+        targets, skipped = self.breakers.split(backends)
+        results, missing = self.scatter.gather(targets, fetch, AGGREGATE_DEADLINE)
+        missing.update(skipped)
+        if len(missing) == len(backends):
+            logger.warning("Paged GET %s failed on every backend: %s", backend_path, missing)
+            return 502, {'Content-Type': 'text/plain'}, b'Bad Gateway'
+        rows, next_cursor = merge_pages([results[b] for b in backends if isinstance(results.get(b), list)], limit,
+                                        self.resolver)
+        body_bytes = json.dumps(rows, ensure_ascii=False).encode('utf-8')
+        resp_headers = {'Content-Type': 'application/json; charset=utf-8', 'X-Backend': 'aggregated'}
+        if next_cursor:
+            resp_headers['X-Next-Cursor'] = next_cursor
+            resp_headers['Link'] = f'<{path}?limit={limit}&cursor={next_cursor}>; rel="next"'
+        if missing:
+            resp_headers['X-Missing-Backends'] = ','.join(b for b in backends if b in missing)
+            envelope = store_response(self.cache, cache_key, 200, resp_headers, body_bytes, PARTIAL_CACHE_TTL)
+        else:
+            envelope = store_response(self.cache, cache_key, 200, resp_headers, body_bytes, CACHE_TTL,
+                                      CACHE_STALE_SECONDS)
+        logger.debug("Paged GET %s -> %s items (errors: %s)", backend_path, len(rows), missing)
+        return 200, {'X-Proxy-Cache': 'MISS'}, envelope
+
+    def _stream_aggregate(self, cache_key, path_with_query, headers):
+        """
+        Aggregated GET written to the client (chunked) while the backends' lists are still arriving.
+        Returns None once the response is sent, or an error response if no backend could answer.
+        """
+        def read(backend, emit):
+            pool = self.pools.pool(backend)
+            generation = pool.generation()
             try:
-                resp = self.session.get(target, headers=headers, timeout=5)
+                with pool.session(AGGREGATE_DEADLINE) as session:
+                    generation = pool.generation()
+                    with session.get(backend + path_with_query, headers=headers, stream=True,
+                                     timeout=AGGREGATE_DEADLINE) as resp:
+                        latency = resp.elapsed.total_seconds()
+                        if resp.status_code != 200:
+                            raise requests.RequestException(f"status {resp.status_code}")
+                        parser = ArrayItemParser()
+                        for data in resp.iter_content(STREAM_READ_BYTES):
+                            for item in parser.feed(data):
+                                emit(item)
+                        for item in parser.close():
+                            emit(item)
+            except (requests.RequestException, ValueError):
+                pool.record(False, generation=generation)
+                raise
+            pool.record(True, latency, generation)
+
+        def read_pages(backend, emit):
+            # walk the backend in token order, one bounded page per request, so that copies of an id meet in the merge
+            path, after = path_with_query.split('?', 1)[0], None
+            while True:
+                resp = self.pools.request(backend, 'GET', backend_page_path(path, STREAM_PAGE_ROWS, after),
+                                          headers=headers, timeout=AGGREGATE_DEADLINE)
                 if resp.status_code != 200:
-                    errors.append((backend, resp.status_code))
-                    continue
+                    raise requests.RequestException(f"status {resp.status_code}")
+                rows = resp.json()
+                for row in rows:
+                    emit(row)
+                if len(rows) < STREAM_PAGE_ROWS:
+                    return
+                after = row_after(rows[-1])
+
+        backends = list(self.lb.backends)
+        targets, skipped = self.breakers.split(backends)
+        if self.resolver.enabled:
+            stream = self.scatter.stream(targets, read_pages, STREAM_BUFFER_ITEMS, AGGREGATE_DEADLINE, key=id_key)
+            items = self.resolver.collapse(item for _, item in stream)
+        else:
+            stream = self.scatter.stream(targets, read, STREAM_BUFFER_ITEMS, AGGREGATE_DEADLINE)
+            items = (item for _, item in stream)
+        stream.missing.update(skipped)
+        # hold the status line back until something arrived, so a total failure can still be a 502
+        first = next(items, _NOTHING)
+        if first is _NOTHING and len(stream.missing) == len(backends):
+            logger.warning("Aggregated GET %s failed on every backend: %s", path_with_query, stream.missing)
+            return 502, {'Content-Type': 'text/plain'}, b'Bad Gateway'
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('X-Proxy-Cache', 'MISS')
+        self._cache_result = 'MISS'
+        CACHE_RESULTS.inc('miss')
+        self.send_header('X-Backend', 'aggregated')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('Trailer', 'X-Missing-Backends')
+        self.end_headers()
+        out = ChunkedArrayWriter(STREAM_CHUNK_BYTES, STREAM_CACHE_MAX_BYTES)
+        try:
+            if first is not _NOTHING:
+                self.wfile.write(out.add(first))
+            for item in items:
+                frame = out.add(item)
+                if frame:
+                    self.wfile.write(frame)
+            trailers = {'X-Missing-Backends': ','.join(sorted(stream.missing))} if stream.missing else {}
+            self.wfile.write(out.finish(trailers))
+        except (ConnectionError, TimeoutError) as e:
+            logger.info("Client went away during streamed GET %s: %s", path_with_query, e)
+            self.close_connection = True
+            return None
+        finally:
+            stream.close()
+
+        if out.body is not None:
+            resp_headers = {'Content-Type': 'application/json; charset=utf-8', 'X-Backend': 'aggregated'}
+            if stream.missing:
+                resp_headers['X-Missing-Backends'] = ','.join(sorted(stream.missing))
+                store_response(self.cache, cache_key, 200, resp_headers, out.body, PARTIAL_CACHE_TTL)
+            else:
+                store_response(self.cache, cache_key, 200, resp_headers, out.body, CACHE_TTL, CACHE_STALE_SECONDS)
+        logger.debug("Streamed aggregated GET %s -> total %s items (errors: %s)",
+                    path_with_query, out.count, stream.missing)
+        return None
+
+    def _fetch_by_id(self, cache_key, resource_id, path, headers):
+        # every backend holds a full copy: ask the key's owner first, move on if it errors, and race the next
+        # backend against it if it is slower than usual (hedged read)
+        errors = []
+
+        def candidates():
+            for backend in self.lb.backends_for_key(resource_id):
+                if self.breakers.allow(backend):
+                    yield backend
+                else:
+                    errors.append((backend, 'circuit open'))
+
+        # backends that answered 404 while they may still be missing writes
+        unsure = []
+
+        def get(backend):
+            resp = self.pools.request(backend, 'GET', path + f"?id={resource_id}", headers=headers, timeout=5)
+            if resp.status_code == 404 and (self._behind_on_writes(backend)
+                                            or self.breakers.get(backend).state != CLOSED):
+                # the write that created the id may not have reached it yet: ask the next replica
+                unsure.append(backend)
+                raise requests.RequestException("404 while behind on writes")
+            if resp.status_code not in (200, 404):
+                raise requests.RequestException(f"status {resp.status_code}")
+            return resp
+
+        pending = candidates()
+        backend = resp = None
+        if self.known_ids and self.known_ids.definitely_absent(resource_id):
+            # the filter never saw the id: one unhedged request to the first backend settles it, unless that fails
+            first = next(pending, None)
+            if first is not None:
                 try:
-                    j = resp.json()
-                except Exception:
-                    continue
-                if isinstance(j, list):
-                    aggregated.extend(j)
-                elif isinstance(j, dict):
-                    aggregated.append(j)
-            except requests.RequestException as e:
-                errors.append((backend, str(e)))
-        return aggregated, errors
+                    backend, resp = first, get(first)
+                except requests.RequestException as e:
+                    errors.append((first, str(e) or e.__class__.__name__))
+        if backend is None:
+            backend, resp, failed = self.hedged.call(pending, get)
+            errors.extend(failed)
+        if backend is None and unsure:
+            logger.debug("GET with id %s not found on %s, which may be behind on writes", resource_id, unsure)
+            return 404, {'Content-Type': 'text/plain', 'X-Backend': unsure[0]}, b'Not Found'
+        if backend is None:
+            logger.warning("GET with id %s failed on every backend: %s", resource_id, errors)
+            return 502, {'Content-Type': 'text/plain'}, b'Bad Gateway'
+        if resp.status_code == 404:
+            resp_headers = {'Content-Type': 'text/plain', 'X-Backend': backend}
+            if any(self._behind_on_writes(b) for b in self.lb.backends_for_key(resource_id)):
+                # a write still on its way may create the id any moment: not negative-cached
+                return 404, resp_headers, b'Not Found'
+            envelope = store_response(self.cache, cache_key, 404, resp_headers, b'Not Found', NEGATIVE_CACHE_TTL)
+            logger.debug("GET with id %s not found on %s", resource_id, backend)
+            return 404, {'X-Proxy-Cache': 'MISS'}, envelope
+        resp_headers = {k: v for k, v in resp.headers.items()}
+        resp_headers['X-Backend'] = backend
+        envelope = store_response(self.cache, cache_key, 200, resp_headers, resp.content, CACHE_TTL,
+                                  CACHE_STALE_SECONDS)
+        logger.debug("GET with id %s forwarded to %s", resource_id, backend)
+        return 200, {'X-Proxy-Cache': 'MISS'}, envelope
+
+    def _behind_on_writes(self, backend) -> bool:
+        """Writes to the backend are in flight or hinted, so a 404 from it may predate them."""
+        return self.pools.writes_in_flight(backend) > 0 or (self.hints is not None and self.hints.outstanding(backend))
+
+    def _fetcher(self, cache_key, resource_id, parsed, headers, page=None):
+        if resource_id:
+            return lambda: self._fetch_by_id(cache_key, resource_id, parsed.path, headers)
+        if page:
+            return lambda: self._fetch_page(cache_key, parsed.path, page, headers)
+        path_with_query = parsed.path
+        if parsed.query:
+            path_with_query += '?' + parsed.query
+        return lambda: self._fetch_aggregate(cache_key, path_with_query, headers)
 
     def _handle_forward(self):
-        cache_key = self._make_cache_key()
-        cached = self.cache.get(cache_key)
-        if cached:
-            try:
-                obj = json.loads(cached)
-                status = obj.get('status', 200)
-                headers = obj.get('headers', {})
-                body = obj.get('body', '').encode('utf-8')
-                headers.setdefault('X-Proxy-Cache', 'HIT')
-                headers.setdefault('X-Backend', 'cached')
-                self._send_raw(status, headers, body)
-                logger.info("Cache HIT for %s", cache_key)
+        try:
+            self._length = content_length(self.headers.get('Content-Length', 0))
+        except ValueError:
+            # the body cannot be delimited, so the connection cannot be reused either
+            self.close_connection = True
+            self._send_raw(400, {'Content-Type': 'text/plain'}, b'Bad Request')
+            return
+        if self.command == 'GET' and self.path == METRICS_PATH:
+            body = METRICS.render().encode('utf-8')
+            self._send_raw(200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}, body)
+            return
+        if self.command == 'GET' and self.path == POOL_STATS_PATH:
+            body = json.dumps(self.pools.stats()).encode('utf-8')
+            self._send_raw(200, {'Content-Type': 'application/json; charset=utf-8'}, body)
+            return
+        if self.command == 'GET' and self.path == ADMISSION_STATS_PATH:
+            body = json.dumps({'reads': self.reads.stats(), 'writes': self.writes.stats()}).encode('utf-8')
+            self._send_raw(200, {'Content-Type': 'application/json; charset=utf-8'}, body)
+            return
+        if self.command == 'GET' and self.path == BREAKER_STATS_PATH:
+            body = json.dumps(self.breakers.stats()).encode('utf-8')
+            self._send_raw(200, {'Content-Type': 'application/json; charset=utf-8'}, body)
+            return
+        if self.command == 'GET' and self.path == HINT_STATS_PATH:
+            body = json.dumps(self.hints.stats() if self.hints else {}).encode('utf-8')
+            self._send_raw(200, {'Content-Type': 'application/json; charset=utf-8'}, body)
+            return
+        if self.command == 'GET' and self.path == KNOWN_IDS_STATS_PATH:
+            body = json.dumps(self.known_ids.stats() if self.known_ids else {}).encode('utf-8')
+            self._send_raw(200, {'Content-Type': 'application/json; charset=utf-8'}, body)
+            return
+        if self.command == 'POST' and urlparse(self.path).path == BULK_PATH:
+            if not self.writes.acquire():
+                logger.warning("Shedding bulk write: %s budget exhausted", self.writes.name)
+                # the body was not read
+                self.close_connection = True
+                self._send_raw(503, {'Content-Type': 'text/plain', 'Retry-After': str(RETRY_AFTER)},
+                               b'Service Unavailable')
                 return
-            except Exception:
-                pass
+            try:
+                self._bulk()
+            finally:
+                self.writes.release()
+            return
 
+        cache_key = self._make_cache_key()
         method = self.command
         resource_id = getattr(self, '_saved_id', None)
         parsed = urlparse(self.path)
         headers = {k: v for k, v in self.headers.items() if k.lower() != 'host'}
 
+        page = None
         if method == 'GET' and not resource_id:
-            path_with_query = parsed.path
-            if parsed.query:
-                path_with_query += '?' + parsed.query
-            aggregated, errors = self._aggregate_get_from_backends(path_with_query, headers)
-            body_text = json.dumps(aggregated, ensure_ascii=False)
-            resp_headers = {'Content-Type': 'application/json; charset=utf-8',
-                            'X-Proxy-Cache': 'MISS', 'X-Backend': 'aggregated'}
-            self.cache.put(cache_key, json.dumps({'status': 200, 'headers': resp_headers, 'body': body_text}), ttl_seconds=30)
-            logger.info("Aggregated GET %s -> total %s items (errors: %s)", self.path, len(aggregated), errors)
-            self._send_raw(200, resp_headers, body_text.encode('utf-8'))
-            return
-
-        if method == 'GET' and resource_id:
-            for backend in self.lb.backends:
-                target = backend + parsed.path + f"?id={resource_id}"
-                try:
-                    resp = self.session.get(target, headers=headers, timeout=5)
-                    if resp.status_code == 200:
-                        resp_headers = {k: v for k, v in resp.headers.items()}
-                        resp_headers['X-Proxy-Cache'] = 'MISS'
-                        resp_headers['X-Backend'] = backend
-                        body_bytes = resp.content
-                        self.cache.put(cache_key, json.dumps({'status': 200, 'headers': resp_headers,
-                                                              'body': body_bytes.decode('utf-8')}), ttl_seconds=30)
-                        self._send_raw(resp.status_code, resp_headers, body_bytes)
-                        logger.info("GET with id %s forwarded to %s", resource_id, backend)
-                        return
-                except requests.RequestException:
-                    continue
-            self.send_response(404)
-            self.send_header('Content-Type', 'text/plain')
-            self.end_headers()
-            self.wfile.write(b'Not Found')
-            return
-
-        # POST/PUT -> replicate to all backends
+            try:
+                page = page_params(parsed.query, PAGE_MAX_LIMIT)
+            except ValueError as e:
+                self._send_raw(400, {'Content-Type': 'text/plain'}, str(e).encode('utf-8'))
+                return
+
+        stale = None
+        entry = self.cache.get_entry(cache_key)
+        if entry:
+            cached, stale_for = entry
+            try:
+                envelope = decode_cache_entry(cached)
+            except ValueError:
+                entry = None
+        if entry and stale_for <= 0:
+            self._send_raw(envelope.status, {'X-Proxy-Cache': 'HIT'}, envelope)
+            logger.debug("Cache HIT for %s", cache_key)
+            return
+        if entry and method == 'GET' and stale_for <= STALE_WHILE_REVALIDATE:
+            # serve the stale copy now and let a single background fetch refresh the entry
+            self.flights.do_background(cache_key, self._fetcher(cache_key, resource_id, parsed, headers, page))
+            self._send_raw(envelope.status, {'X-Proxy-Cache': 'STALE'}, envelope)
+            logger.debug("Cache STALE for %s (%.1fs past TTL), refreshing", cache_key, stale_for)
+            return
+        if entry and stale_for <= STALE_IF_ERROR:
+            stale = (envelope.status, {'X-Proxy-Cache': 'STALE-IF-ERROR'}, envelope)
+        budget = self.reads if method == 'GET' else self.writes
+        if not budget.acquire():
+            logger.warning("Shedding %s %s: %s budget exhausted", method, self.path, budget.name)
+            if stale is not None and method == 'GET':
+                self._send_raw(*stale)
+            else:
+                self._send_raw(503, {'Content-Type': 'text/plain', 'Retry-After': str(RETRY_AFTER)},
+                               b'Service Unavailable')
+            return
+        try:
+            self._forward(method, cache_key, resource_id, parsed, headers, page, stale)
+        finally:
+            budget.release()
+
+    def _forward(self, method, cache_key, resource_id, parsed, headers, page, stale):
+        if method == 'GET' and STREAM_AGGREGATES and not resource_id and not page \
+                and self.request_version == 'HTTP/1.1':
+            # streamed misses are not coalesced: sharing one would mean buffering it for the followers
+            path_with_query = parsed.path + ('?' + parsed.query if parsed.query else '')
+            failed = self._stream_aggregate(cache_key, path_with_query, headers)
+            if failed is None:
+                return
+            status, resp_headers, body_bytes = stale or failed
+            self._send_raw(status, resp_headers, body_bytes)
+            return
+
+        if method == 'GET':
+            # concurrent misses on the same key wait for one backend fetch and share its response
+            fetch = self._fetcher(cache_key, resource_id, parsed, headers, page)
+            (status, resp_headers, body_bytes), shared = self.flights.do(cache_key, fetch)
+            if status >= 500 and stale is not None:
+                status, resp_headers, body_bytes = stale
+                logger.info("Backends failed for %s, serving stale copy", cache_key)
+            elif shared:
+                resp_headers = dict(resp_headers, **{'X-Proxy-Cache': 'COALESCED'})
+            self._send_raw(status, resp_headers, body_bytes)
+            return
+
+        # POST/PUT -> replicate to all backends in parallel, answer once the write quorum is reached
         if method in ('POST', 'PUT'):
             body = getattr(self, '_saved_body', b'')
-            success = []
-            errors = []
-            for backend in self.lb.backends:
-                target = backend + self.path
-                try:
-                    resp = self.session.request(method, target, headers=headers, data=body, timeout=10)
-                    if resp.status_code == 200:
-                        success.append(backend)
-                    else:
-                        errors.append((backend, resp.status_code))
-                except requests.RequestException as e:
-                    errors.append((backend, str(e)))
+            path = self.path
+            resource_id = getattr(self, '_saved_id', None)
+            acks = {}
+
+            def send(backend, timeout):
+                resp = self.pools.request(backend, method, path, headers=headers, data=body, timeout=timeout)
+                if resp.status_code == 200:
+                    acks[backend] = resp.content
+                return resp.status_code
+
+            token = self.write_through.begin(resource_id)
+            if self.known_ids:
+                # known before any backend has it, so a read racing the write is never answered from the filter
+                self.known_ids.add(resource_id)
+
+            targets, not_sent, tickets = self._write_targets(method, path, body)
+            success, errors, pending = self.replicator.replicate(targets, send, WRITE_QUORUM, WRITE_TIMEOUT,
+                                                                 *self._hinter(tickets))
+            errors.extend(not_sent)
+            if len(success) < min(WRITE_QUORUM, len(self.lb.backends)):
+                logger.warning("%s quorum not reached (ok: %s, errors: %s, pending: %s)",
+                               method, success, errors, pending)
+                success = []
 
             if success:
-                # Invalidate relevant cache keys:
-                # - aggregated GET list: "GET:/employees" (without query)
-                # - per-id GET for the id just written: "GET:/employees/?id=<id>"
-                # Determine id if available
-                written_id = getattr(self, '_saved_id', None)
-                try:
-                    # aggregated key (no query)
-                    self.cache.invalidate("GET:/employees")
-                    if written_id:
-                        self.cache.invalidate(f"GET:/employees/?id={written_id}")
-                except Exception:
-                    logger.warning("Cache invalidation failed (continuing)")
+                stored = stored_employee(acks.get(success[0]))
+                if self.known_ids and isinstance(stored, dict):
+                    # the id a backend assigned to a write that came without one
+                    self.known_ids.add(stored.get('id'))
+                self.write_through.applied(token, resource_id, stored)
 
                 resp_headers = {'Content-Type': 'application/json; charset=utf-8',
                                 'X-Proxy-Cache': 'MISS', 'X-Backend': ','.join(success)}
                 # echo last successful body as response body (or you could request read-back)
                 self._send_raw(200, resp_headers, body)
-                logger.info("%s replicated to %s (errors: %s)", method, success, errors)
+                logger.debug("%s replicated to %s (errors: %s, pending: %s)", method, success, errors, pending)
             else:
-                self.send_response(502)
-                self.send_header('Content-Type', 'text/plain')
-                self.end_headers()
-                self.wfile.write(b'Bad Gateway')
+                self.write_through.failed(token, resource_id)
+                self._send_raw(502, {'Content-Type': 'text/plain'}, b'Bad Gateway')
+            return
+
+    def _write_targets(self, method, path, body):
+        """
+        Backends to send a write to now, (backend, reason) for the others, which count against the quorum, and
+        the hint tickets of the targets: a backend with hints pending gets the write appended behind them, one with
+        an open breaker is hinted.
+        """
+        backends, deferred, tickets = list(self.lb.backends), [], {}
+        if self.hints:
+            tickets, deferred = self.hints.split(backends, method, path, body)
+            backends = list(tickets)
+        targets, skipped = self.breakers.split(backends)
+        for backend in skipped:
+            if self.hints:
+                self.hints.hand_off(backend, tickets[backend])
+        return targets, list(skipped.items()) + [(b, 'hints pending') for b in deferred], tickets
+
+    def _hinter(self, tickets):
+        """(hand_off, answered) for the replicator, or none without hinted handoff."""
+        if not self.hints:
+            return None, None
+        return (lambda backend: self.hints.hand_off(backend, tickets[backend]),
+                lambda backend: self.hints.answered(backend, tickets[backend]))
+
+    def _bulk(self):
+        # the upload is parsed as it is read; full chunks are replicated (quorum) while reading goes on,
+        # at most BULK_PARALLEL_CHUNKS at a time
+        batcher = BulkBatcher(BULK_CHUNK_ITEMS)
+        headers = {'Content-Type': 'application/json'}
+        quorum = max(1, min(WRITE_QUORUM, len(self.lb.backends)))
+        in_flight = deque()
+
+        def replicate(chunks):
+            for chunk in chunks:
+                if len(in_flight) >= BULK_PARALLEL_CHUNKS:
+                    self._settle_chunk(batcher, *in_flight.popleft())
+                in_flight.append((chunk, self.bulk_chunks.submit(self._replicate_chunk, batcher, chunk, headers,
+                                                                 quorum)))
+
+        left = self._length
+        bad_body = None
+        try:
+            while left:
+                data = self.rfile.read(min(left, STREAM_READ_BYTES))
+                if not data:
+                    raise ValueError('request body ended early')
+                left -= len(data)
+                self._bytes_in += len(data)
+                replicate(batcher.feed(data))
+            replicate(batcher.close())
+        except ValueError as e:
+            # chunks already replicated stay written; the rest of the body is not read
+            bad_body = e
+        finally:
+            while in_flight:
+                self._settle_chunk(batcher, *in_flight.popleft())
+            REQUEST_BYTES.inc(self._route, amount=self._bytes_in)
+            if batcher.ids:
+                invalidate_after_write(self.cache, *batcher.ids)
+        if bad_body is not None:
+            self.close_connection = True
+            self._send_raw(400, {'Content-Type': 'text/plain'}, f'Bad bulk body: {bad_body}'.encode('utf-8'))
             return
+        status, body = batcher.summary()
+        self._send_raw(status, {'Content-Type': 'application/json; charset=utf-8'}, body)
+        logger.debug("Bulk write of %d item(s): %d applied", len(batcher.results), len(batcher.ids))
+
+    @staticmethod
+    def _settle_chunk(batcher, chunk, fut):
+        """Wait for a chunk's replication; if it raised, its items fail instead of the whole upload."""
+        try:
+            fut.result()
+        except Exception as e:
+            logger.exception("Bulk chunk of %d failed: %s", len(chunk), e)
+            batcher.failed(chunk, 'replication failed')
+
+    def _replicate_chunk(self, batcher, chunk, headers, quorum):
+        body = batcher.body(chunk)
+        if self.known_ids:
+            self.known_ids.add(*(item['id'] for _, item in chunk))
+        answers = {}
+
+        def send(backend, timeout):
+            resp = self.pools.request(backend, 'POST', BULK_PATH, headers=headers, data=body, timeout=timeout)
+            if resp.status_code == 200:
+                answers[backend] = resp.json()
+            return resp.status_code
+
+        targets, not_sent, tickets = self._write_targets('POST', BULK_PATH, body)
+        success, errors, pending = self.replicator.replicate(targets, send, WRITE_QUORUM, WRITE_TIMEOUT,
+                                                             *self._hinter(tickets))
+        if len(success) < quorum:
+            logger.warning("Bulk chunk of %d: quorum not reached (ok: %s, errors: %s, pending: %s)",
+                           len(chunk), success, errors + not_sent, pending)
+            batcher.failed(chunk)
+        else:
+            batcher.applied(chunk, [answers[b] for b in success], quorum)
+
+    def log_request(self, code='-', size='-'):
+        # replaced by the access record written in _observed()
+        pass
 
     def log_message(self, format, *args):
         logger.info("%s - - [%s] %s", self.client_address[0], self.log_date_time_string(), format % args)
 
-def run(port=8080):
-    server = ThreadingHTTPServer(('0.0.0.0', port), ProxyHandler)
-    logger.info('ProxyServer running on 0.0.0.0:%s', port)
+class ProxyServer(ThreadingHTTPServer):
+    def __init__(self, address, handler, reuse_port=False):
+        # pre-fork workers all bind the same port; the kernel spreads new connections over them
+        self.allow_reuse_port = reuse_port
+        super().__init__(address, handler)
+
+
+def run(port=8080, engine='threading', reuse_port=False):
     try:
-        server.serve_forever()
-    except KeyboardInterrupt:
-        logger.info('Shutting down proxy...')
+        if engine == 'asyncio':
+            logger.info('ProxyServer (asyncio engine) running on 0.0.0.0:%s', port)
+            try:
+                asyncio.run(AsyncProxy(ProxyHandler.cache, ProxyHandler.lb).serve('0.0.0.0', port, reuse_port))
+            except KeyboardInterrupt:
+                logger.info('Shutting down proxy...')
+            return
+
+        ProxyHandler.build()
+        hints = ProxyHandler.hints
+        METRICS.collector(stats_collector(
+            ProxyHandler.pools.stats, ProxyHandler.breakers.stats,
+            lambda: {'reads': ProxyHandler.reads.stats(), 'writes': ProxyHandler.writes.stats()},
+            ProxyHandler.hedged.policy.stats, hints.stats if hints else None))
+        if hints:
+            hints.start(ProxyHandler.lb.backends)
+        if ProxyHandler.known_ids:
+            ProxyHandler.known_ids.start()
+        ProxyHandler.pools.prewarm(ProxyHandler.lb.backends)
+        server = ProxyServer(('0.0.0.0', port), ProxyHandler, reuse_port)
+        logger.info('ProxyServer running on 0.0.0.0:%s', port)
+
+        def stop(*_):
+            # SIGTERM: stop accepting, then let the requests in flight finish (serve_forever runs on this thread)
+            ProxyHandler.drain.draining = True
+            threading.Thread(target=server.shutdown, daemon=True).start()
+        signal.signal(signal.SIGTERM, stop)
+        watch_master(stop)
+        notify_ready()
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            logger.info('Shutting down proxy...')
+        finally:
+            server.server_close()
+        if ProxyHandler.drain.draining:
+            logger.info('Draining %d request(s) in flight...', ProxyHandler.drain.active)
+            if not ProxyHandler.drain.wait(DRAIN_SECONDS):
+                logger.warning('%d request(s) still in flight after %ss', ProxyHandler.drain.active, DRAIN_SECONDS)
     finally:
-        server.server_close()
         ProxyHandler.cache.stop()
+        if engine != 'asyncio':
+            ProxyHandler.scatter.shutdown()
+            ProxyHandler.replicator.shutdown(wait=ProxyHandler.drain.draining)
+            ProxyHandler.bulk_chunks.shutdown(wait=False)
+            if ProxyHandler.hints:
+                ProxyHandler.hints.shutdown()
+            if ProxyHandler.known_ids:
+                ProxyHandler.known_ids.shutdown()
+            ProxyHandler.hedged.shutdown()
+            ProxyHandler.pools.close()
 
 if __name__ == '__main__':
-    run()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Caching reverse proxy in front of the InfoNode backends')
+    parser.add_argument('port', nargs='?', type=int, default=8080)
+    parser.add_argument('--engine', choices=('threading', 'asyncio'),
+                        default=os.environ.get('PROXY_ENGINE', 'threading'),
+                        help='threading: one OS thread per connection (default); asyncio: single event loop')
+    parser.add_argument('--workers', type=int, default=WORKERS,
+                        help='pre-fork: worker processes sharing the port (default PROXY_WORKERS or 1)')
+    args = parser.parse_args()
+    if args.workers > 1 and not WORKER_SLOT:
+        sys.exit(Master([sys.executable, '-u', os.path.abspath(__file__), str(args.port), '--engine', args.engine],
+                        args.workers, DRAIN_SECONDS, HINT_DIR, SHARED_CACHE_DIR).run())
+    run(args.port, args.engine, reuse_port=bool(WORKER_SLOT))
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Quorum write replication: send a write to every backend in parallel and return once W of them acknowledged.
+Backends still in flight finish in the background, each with a bounded number of retries. With hand_off the
+write is not retried here: hand_off(backend) takes it over at its first failure (hinted handoff, whose replay
+keeps the backend's writes in order), and answered(backend) is called once the backend applied or rejected it.
+Only first attempts run on the send executor, so new writes never queue behind retry backoffs: retries, and
+first attempts that waited in the queue past their write's deadline, move to a separate tail executor (or
+straight to hand_off, which replays them anyway).
+"""
+import time
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeout
+from concurrent.futures import wait as wait_for
+from typing import Callable, List, Optional, Tuple
+
+logger = logging.getLogger("replicator")
+
+
+class QuorumReplicator:
+    def __init__(self, max_workers: int = 32, retries: int = 2, backoff: float = 0.2):
+        self.retries = retries
+        self.backoff = backoff
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='replicate')
+        self._tail = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='replicate-tail')
+        # one result per backend of every write not finished yet, for shutdown(wait=True)
+        self._outstanding = set()
+        self._lock = threading.Lock()
+
+    def replicate(self, backends: List[str], send: Callable[[str, float], int], quorum: int, timeout: float,
+                  hand_off: Optional[Callable[[str], None]] = None,
+                  answered: Optional[Callable[[str], None]] = None) -> Tuple[List[str], List[tuple], List[str]]:
+        """
+        Call send(backend, timeout) -> HTTP status for every backend concurrently.
+        Returns (success, errors, pending) as soon as `quorum` backends answered 200, the quorum became
+        unreachable, or `timeout` elapsed; pending backends keep replicating in the background.
+        """
+        quorum = max(1, min(quorum, len(backends)))
+        expires = time.monotonic() + timeout
+        futures = {}
+        for b in backends:
+            result = self._track(Future())
+            self._submit(self._executor, result, self._first_send, send, b, timeout, expires, hand_off, answered)
+            futures[result] = b
+        success = []
+        errors = []
+        try:
+            for fut in as_completed(futures, timeout=timeout):
+                backend = futures[fut]
+                ok, detail = fut.result()
+                if ok:
+                    success.append(backend)
+                else:
+                    errors.append((backend, detail))
+                if len(success) >= quorum or len(errors) > len(backends) - quorum:
+                    break
+        except FuturesTimeout:
+            pass
+        done = set(success) | {b for b, _ in errors}
+        pending = [b for b in backends if b not in done]
+        return success, errors, pending
+
+    def _track(self, result: Future) -> Future:
+        with self._lock:
+            self._outstanding.add(result)
+        result.add_done_callback(self._untrack)
+        return result
+
+    def _untrack(self, result: Future):
+        with self._lock:
+            self._outstanding.discard(result)
+
+    @staticmethod
+    def _submit(executor, result, fn, *args):
+        """Run fn(*args, result) on executor; whatever escapes it (or the submit itself) fails the result."""
+        def run():
+            try:
+                fn(*args, result)
+            except Exception as e:
+                if not result.done():
+                    result.set_exception(e)
+        try:
+            executor.submit(run)
+        except RuntimeError as e:
+            # shut down without waiting: the write is dropped like any other unfinished background replication
+            result.set_exception(e)
+
+    def _first_send(self, send, backend, timeout, expires, hand_off, answered, result):
+        if time.monotonic() >= expires:
+            # queued until its write gave up waiting: free the send slot for writes that are still waited on
+            if hand_off is not None:
+                self._give_up(backend, 0, 'deadline exceeded', hand_off, answered, result)
+            else:
+                self._submit(self._tail, result, self._attempt, send, backend, timeout, 0, hand_off, answered)
+            return
+        self._attempt(send, backend, timeout, 0, hand_off, answered, result)
+
+    def _attempt(self, send, backend, timeout, attempt, hand_off, answered, result):
+        if attempt:
+            time.sleep(self.backoff * (2 ** (attempt - 1)))
+        retries = 0 if hand_off is not None else self.retries
+        retry = True
+        try:
+            status = send(backend, timeout)
+            if status == 200:
+                if answered is not None:
+                    answered(backend)
+                result.set_result((True, status))
+                return
+            detail = status
+            # below 500 the backend rejected the write itself; retrying will not help
+            retry = status >= 500
+        except Exception as e:
+            detail = str(e)
+        if retry and attempt < retries:
+            self._submit(self._tail, result, self._attempt, send, backend, timeout, attempt + 1, hand_off, answered)
+            return
+        self._give_up(backend, attempt + 1, detail, hand_off, answered, result)
+
+    @staticmethod
+    def _give_up(backend, attempts, detail, hand_off, answered, result):
+        logger.warning("Replication to %s failed after %d attempt(s): %s", backend, attempts, detail)
+        if isinstance(detail, int) and detail < 500:
+            if answered is not None:
+                answered(backend)
+        elif hand_off is not None:
+            hand_off(backend)
+        result.set_result((False, detail))
+
+    def shutdown(self, wait: bool = False):
+        """wait: finish the background replications first (a draining proxy still owes them)."""
+        if wait:
+            # retries are submitted from running attempts, so let them all finish before closing the executors
+            while True:
+                with self._lock:
+                    outstanding = list(self._outstanding)
+                if not outstanding:
+                    break
+                wait_for(outstanding)
+        self._executor.shutdown(wait=wait)
+        self._tail.shutdown(wait=wait)
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Concurrent scatter-gather: run one call per backend in parallel under a single overall deadline.
+Backends that fail or miss the deadline are reported back instead of stalling the caller.
+stream() is the incremental form: results are handed over item by item through a bounded queue.
+"""
+import time
+import heapq
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+_DONE = object()
+
+
+class StreamClosed(Exception):
+    """The consumer of a GatherStream went away."""
+
+
+class GatherStream:
+    """
+    Items produced by one worker per backend, in arrival order, as (backend, item) pairs.
+    At most buffer_items are queued; producers block (back-pressure) until the consumer catches up.
+    Backends that fail or go idle_timeout seconds without producing anything end up in .missing.
+    """
+
+    def __init__(self, executor, backends: List[str], fn: Callable[[str, Callable[[Any], None]], None],
+                 buffer_items: int, idle_timeout: float):
+        self.missing: Dict[str, str] = {}
+        self._backends = list(backends)
+        self._finished = set()
+        self._idle_timeout = idle_timeout
+        self._queue = queue.Queue(max(buffer_items, 1))
+        self._closed = threading.Event()
+        for b in self._backends:
+            executor.submit(self._run, fn, b)
+
+    def _queue_for(self, backend) -> queue.Queue:
+        return self._queue
+
+    def _put(self, backend, item):
+        q = self._queue_for(backend)
+        while not self._closed.is_set():
+            try:
+                q.put((backend, item), timeout=0.1)
+                return
+            except queue.Full:
+                continue
+        raise StreamClosed()
+
+    def _run(self, fn, backend):
+        try:
+            fn(backend, lambda item: self._put(backend, item))
+        except Exception as e:
+            if not self._closed.is_set():
+                self.missing[backend] = str(e) or e.__class__.__name__
+        try:
+            self._put(backend, _DONE)
+        except StreamClosed:
+            pass
+
+    def __iter__(self) -> Iterator[Tuple[str, Any]]:
+        try:
+            while len(self._finished) < len(self._backends):
+                try:
+                    backend, item = self._queue.get(timeout=self._idle_timeout)
+                except queue.Empty:
+                    for b in self._backends:
+                        if b not in self._finished:
+                            self.missing.setdefault(b, 'deadline exceeded')
+                    return
+                if item is _DONE:
+                    self._finished.add(backend)
+                    continue
+                yield backend, item
+        finally:
+            self.close()
+
+    def close(self):
+        """Stop the producers; safe to call more than once."""
+        self._closed.set()
+
+
+class MergeStream(GatherStream):
+    """
+    GatherStream for producers that each emit in key order: items are yielded merged in key order.
+    Every backend gets its own bounded queue, so a fast backend cannot crowd out the one the merge waits on.
+    """
+
+    def __init__(self, executor, backends, fn, buffer_items, idle_timeout, key: Callable[[Any], Any]):
+        self._key = key
+        per_backend = max(buffer_items // max(len(backends), 1), 1)
+        self._queues = {b: queue.Queue(per_backend) for b in backends}
+        super().__init__(executor, backends, fn, buffer_items, idle_timeout)
+
+    def _queue_for(self, backend) -> queue.Queue:
+        return self._queues[backend]
+
+    def _pull(self, heap, index):
+        backend = self._backends[index]
+        try:
+            _, item = self._queues[backend].get(timeout=self._idle_timeout)
+        except queue.Empty:
+            self.missing.setdefault(backend, 'deadline exceeded')
+            return
+        if item is _DONE:
+            self._finished.add(backend)
+        else:
+            heapq.heappush(heap, (self._key(item), index, item))
+
+    def __iter__(self) -> Iterator[Tuple[str, Any]]:
+        heap = []
+        try:
+            for index in range(len(self._backends)):
+                self._pull(heap, index)
+            while heap:
+                _, index, item = heapq.heappop(heap)
+                yield self._backends[index], item
+                self._pull(heap, index)
+        finally:
+            self.close()
+
+
+class ScatterGather:
+    def __init__(self, max_workers: int = 32):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='scatter')
+
+    def gather(self, backends: List[str], fn: Callable[[str, float], Any],
+               deadline: float) -> Tuple[Dict[str, Any], Dict[str, str]]:
+        """
+        Call fn(backend, timeout) for every backend concurrently; timeout is the time left until the deadline.
+        Returns (results, missing): results maps backend -> return value, missing maps backend -> reason.
+        """
+        expires = time.monotonic() + deadline
+        futures = {self._executor.submit(self._call, fn, b, expires): b for b in backends}
+        done, not_done = wait(futures, timeout=deadline)
+
+        results = {}
+        missing = {}
+        for fut in done:
+            backend = futures[fut]
+            try:
+                results[backend] = fut.result()
+            except Exception as e:
+                missing[backend] = str(e) or e.__class__.__name__
+        for fut in not_done:
+            fut.cancel()
+            missing[futures[fut]] = 'deadline exceeded'
+        return results, missing
+
+    def stream(self, backends: List[str], fn: Callable[[str, Callable[[Any], None]], None],
+               buffer_items: int = 1000, idle_timeout: float = 5.0, key: Callable[[Any], Any] = None) -> GatherStream:
+        """
+        Call fn(backend, emit) for every backend concurrently; fn passes each item it produces to emit().
+        Iterate the returned GatherStream to consume the items; close() it to abandon the rest.
+        With key, every fn must emit in key order and the items are yielded merged in key order.
+        """
+        if key is not None:
+            return MergeStream(self._executor, backends, fn, buffer_items, idle_timeout, key)
+        return GatherStream(self._executor, backends, fn, buffer_items, idle_timeout)
+
+    @staticmethod
+    def _call(fn, backend, expires):
+        remaining = expires - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError('deadline exceeded')
+        return fn(backend, remaining)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Cache entries shared by the proxy processes of one host when there is no Redis: one file per entry in a
+directory, normally on tmpfs (/dev/shm), so pre-fork workers see each other's entries and invalidations.
+- an entry is written to a temporary file and renamed into place, so a reader never sees half of one
+- each file holds the soft expiry, the hard expiry, the key (checked on read, names are digests) and the value
+- a tag is a file listing the names of the entries stored with it; appends take a shared lock and
+  invalidate_tag() an exclusive one, so no entry stored before an invalidation escapes it
+- expired entries are not served; sweep(), run by the pre-fork master, deletes them
+"""
+import os
+import time
+import fcntl
+import struct
+import hashlib
+import itertools
+from contextlib import contextmanager
+from typing import Iterable, Optional, Tuple
+
+# fresh_until, expiry (epoch seconds, 0 = never), key length
+_HEADER = struct.Struct('!ddI')
+# temporary files older than this belong to a writer that died before renaming them
+_ORPHAN_SECONDS = 60
+
+
+class SharedDirCache:
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._entries = os.path.join(directory, 'entries')
+        self._tags = os.path.join(directory, 'tags')
+        self._lock_path = os.path.join(directory, 'tags.lock')
+        os.makedirs(self._entries, exist_ok=True)
+        os.makedirs(self._tags, exist_ok=True)
+        self._seq = itertools.count()
+
+    @staticmethod
+    def _name(text: str) -> str:
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def _temp(self, folder: str, name: str) -> str:
+        return os.path.join(folder, f'.{name}.{os.getpid()}.{next(self._seq)}')
+
+    @contextmanager
+    def _locked(self, mode):
+        # a descriptor of its own per use: flock() excludes open files, so threads exclude each other too
+        fd = os.open(self._lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, mode)
+            yield
+        finally:
+            os.close(fd)
+
+    def put(self, key: str, value: bytes, fresh_until: float, expiry: float, tags: Iterable[str] = ()):
+        name = self._name(key)
+        encoded = key.encode('utf-8')
+        tmp = self._temp(self._entries, name)
+        with open(tmp, 'wb') as f:
+            f.write(_HEADER.pack(fresh_until, expiry, len(encoded)) + encoded)
+            f.write(value)
+        os.replace(tmp, os.path.join(self._entries, name))
+        tags = tuple(tags)
+        if tags:
+            line = (name + '\n').encode('ascii')
+            with self._locked(fcntl.LOCK_SH):
+                for tag in tags:
+                    _append(os.path.join(self._tags, self._name(tag)), line)
+
+    def get(self, key: str) -> Optional[Tuple[memoryview, float]]:
+        """(value, fresh_until), or None if missing or past its hard expiry."""
+        try:
+            with open(os.path.join(self._entries, self._name(key)), 'rb') as f:
+                raw = f.read()
+        except FileNotFoundError:
+            return None
+        if len(raw) < _HEADER.size:
+            return None
+        fresh_until, expiry, key_len = _HEADER.unpack_from(raw)
+        start = _HEADER.size + key_len
+        if raw[_HEADER.size:start] != key.encode('utf-8') or (expiry and expiry <= time.time()):
+            return None
+        return memoryview(raw)[start:], fresh_until
+
+    def invalidate(self, key: str):
+        _unlink(os.path.join(self._entries, self._name(key)))
+
+    def invalidate_tag(self, tag: str):
+        path = os.path.join(self._tags, self._name(tag))
+        with self._locked(fcntl.LOCK_EX):
+            try:
+                with open(path, 'rb') as f:
+                    names = set(f.read().split())
+            except FileNotFoundError:
+                return
+            _unlink(path)
+        for name in names:
+            _unlink(os.path.join(self._entries, name.decode('ascii')))
+
+    def sweep(self) -> int:
+        """Delete expired entries and orphaned temporary files, and prune tag files; returns entries deleted."""
+        now = time.time()
+        removed = 0
+        for entry in os.scandir(self._entries):
+            if entry.name.startswith('.'):
+                _unlink_orphan(entry, now)
+                continue
+            try:
+                with open(entry.path, 'rb') as f:
+                    head = f.read(_HEADER.size)
+            except FileNotFoundError:
+                continue
+            if len(head) == _HEADER.size:
+                _, expiry, _ = _HEADER.unpack(head)
+                if not expiry or expiry > now:
+                    continue
+            _unlink(entry.path)
+            removed += 1
+        for tag in os.scandir(self._tags):
+            if tag.name.startswith('.'):
+                _unlink_orphan(tag, now)
+                continue
+            with self._locked(fcntl.LOCK_EX):
+                try:
+                    with open(tag.path, 'rb') as f:
+                        names = set(f.read().split())
+                except FileNotFoundError:
+                    continue
+                alive = [n for n in names if os.path.exists(os.path.join(self._entries, n.decode('ascii')))]
+                if not alive:
+                    _unlink(tag.path)
+                elif len(alive) < len(names):
+                    tmp = self._temp(self._tags, tag.name)
+                    with open(tmp, 'wb') as f:
+                        f.write(b''.join(n + b'\n' for n in alive))
+                    os.replace(tmp, tag.path)
+        return removed
+
+
+def _append(path: str, data: bytes):
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+    try:
+        os.write(fd, data)
+    finally:
+        os.close(fd)
+
+
+def _unlink(path: str):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def _unlink_orphan(entry: os.DirEntry, now: float):
+    try:
+        if entry.stat().st_mtime < now - _ORPHAN_SECONDS:
+            _unlink(entry.path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Request coalescing ("single flight"): concurrent calls for the same key share one execution.
+The first caller runs the fetch, the others wait for it and get the same result (or exception).
+do_background() starts a fetch without waiting for it, e.g. to refresh a stale cache entry.
+"""
+import asyncio
+import logging
+import threading
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+logger = logging.getLogger("singleflight")
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+
+    def _join(self, key):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                return call, False
+            call = self._calls[key] = _Call()
+            return call, True
+
+    def _run(self, key, call, fn):
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.result
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """Return (result, shared); shared is True when the result came from another caller's fetch."""
+        call, leader = self._join(key)
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        return self._run(key, call, fn), False
+
+    def do_background(self, key: str, fn: Callable[[], Any]) -> bool:
+        """Run fn in a background thread unless a call for key is already in flight; True if started."""
+        call, leader = self._join(key)
+        if leader:
+            threading.Thread(target=self._run_logged, args=(key, call, fn), daemon=True).start()
+        return leader
+
+    def _run_logged(self, key, call, fn):
+        try:
+            self._run(key, call, fn)
+        except Exception as e:
+            logger.warning("Background fetch for %s failed: %s", key, e)
+
+
+class AsyncSingleFlight:
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Future] = {}
+
+    def _start(self, key, fn):
+        task = self._calls.get(key)
+        if task is not None:
+            return task, False
+        task = self._calls[key] = asyncio.ensure_future(fn())
+        task.add_done_callback(lambda t: self._forget(key, t))
+        return task, True
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        task, leader = self._start(key, fn)
+        # shielded so one waiter going away does not cancel the fetch the others are waiting on
+        return await asyncio.shield(task), not leader
+
+    def do_background(self, key: str, fn: Callable[[], Awaitable[Any]]) -> bool:
+        return self._start(key, fn)[1]
+
+    def _forget(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("Fetch for %s failed: %s", key, task.exception())
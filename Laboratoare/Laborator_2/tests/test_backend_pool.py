@@ -0,0 +1,74 @@
+import time
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from async_proxy import AsyncBackendPool
+from backend_pool import BackendPool
+
+BODY_DELAY = 0.3
+
+
+class SlowBody(BaseHTTPRequestHandler):
+    """Answers the headers right away and the body only BODY_DELAY later, like a large list."""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = b'[' + b','.join(b'{"id": "e%d"}' % i for i in range(100)) + b']'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.flush()
+        time.sleep(BODY_DELAY)
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Breaker:
+    generation = 1
+
+    def __init__(self):
+        self.records = []
+
+    def record(self, ok, latency=None, generation=None):
+        self.records.append((ok, latency))
+
+
+@pytest.fixture
+def backend():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SlowBody)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_port}'
+    server.shutdown()
+    server.server_close()
+
+
+def test_threaded_pool_records_time_to_headers(backend):
+    breaker = Breaker()
+    pool = BackendPool(backend, size=1, breaker=breaker)
+    resp = pool.request('GET', '/employees')
+    assert resp.status_code == 200 and len(resp.json()) == 100
+    [(ok, latency)] = breaker.records
+    assert ok and latency < BODY_DELAY
+    pool.close()
+
+
+def test_async_pool_records_time_to_headers(backend):
+    breaker = Breaker()
+
+    async def main():
+        pool = AsyncBackendPool(backend, size=1, breaker=breaker)
+        status, _, body = await pool.request('GET', '/employees', {})
+        async with pool.stream('/employees', {}) as (stream_status, _, pieces):
+            streamed = b''.join([data async for data in pieces])
+        return status, body, stream_status, streamed
+
+    status, body, stream_status, streamed = asyncio.run(main())
+    assert status == stream_status == 200 and body == streamed and body.count(b'"id"') == 100
+    assert len(breaker.records) == 2
+    assert all(ok and latency < BODY_DELAY for ok, latency in breaker.records)
@@ -0,0 +1,79 @@
+import asyncio
+import json
+import uuid
+from concurrent.futures import Future
+
+import pytest
+
+from async_proxy import AsyncProxy
+from bulk import BulkBatcher
+from proxy_server import ProxyHandler
+
+
+def ids(chunks):
+    return [item['id'] for chunk in chunks for _, item in chunk]
+
+
+def test_given_ids_are_kept_as_strings():
+    batcher = BulkBatcher()
+    chunks = batcher.feed(b'[{"id": "a"}, {"id": 7}, {"id": 0}, {"id": false}]') + batcher.close()
+    assert ids(chunks) == ['a', '7', '0', 'False']
+
+
+@pytest.mark.parametrize('item', [{}, {'id': None}, {'id': ''}])
+def test_missing_ids_get_a_uuid(item):
+    batcher = BulkBatcher()
+    chunks = batcher.feed(json.dumps([item, dict(item)]).encode()) + batcher.close()
+    first, second = ids(chunks)
+    assert uuid.UUID(first) and uuid.UUID(second) and first != second
+
+
+def test_assigned_id_is_in_the_body_sent_to_every_backend():
+    batcher = BulkBatcher()
+    chunk, = batcher.feed(b'{"name": "x"}\n') + batcher.close()
+    body = json.loads(BulkBatcher.body(chunk))
+    assert body == [{'name': 'x', 'id': chunk[0][1]['id']}]
+
+
+def test_chunks_and_results_keep_upload_order():
+    batcher = BulkBatcher(chunk_items=2)
+    chunks = batcher.feed(b'[{"id": "a"}, 3, {"id": "b"}, {"id": "c"}') + batcher.feed(b']') + batcher.close()
+    assert [[index for index, _ in chunk] for chunk in chunks] == [[0, 2], [3]]
+    batcher.applied(chunks[0], [{'results': [{'status': 200}, {'status': 200}]}], 1)
+    batcher.failed(chunks[1])
+    status, body = batcher.summary()
+    summary = json.loads(body)
+    assert status == 200
+    assert [(r['index'], r['status']) for r in summary['results']] == [(0, 200), (1, 400), (2, 200), (3, 502)]
+    assert batcher.ids == ['a', 'b']
+
+
+def test_malformed_backend_replies_fail_their_items():
+    batcher = BulkBatcher()
+    chunk, = batcher.feed(b'[{"id": "a"}, {"id": "b"}, {"id": "c"}]') + batcher.close()
+    batcher.applied(chunk, [{'results': [{'status': 200}, 'ok']}, {'results': None}], 1)
+    status, body = batcher.summary()
+    results = json.loads(body)['results']
+    assert status == 200 and batcher.ids == ['a']
+    assert [(r['id'], r['status']) for r in results] == [('a', 200), ('b', 502), ('c', 502)]
+    assert results[1]['error'] == results[2]['error'] == 'malformed backend reply'
+
+
+def test_a_failed_chunk_fails_its_items_in_both_engines():
+    batcher = BulkBatcher(chunk_items=1)
+    first, second = batcher.feed(b'[{"id": "a"}, {"id": "b"}]') + batcher.close()
+    fut = Future()
+    fut.set_exception(ValueError('bad reply'))
+    ProxyHandler._settle_chunk(batcher, first, fut)
+
+    async def failing():
+        raise ValueError('bad reply')
+
+    async def settle():
+        await AsyncProxy._settle_chunk(batcher, second, asyncio.ensure_future(failing()))
+
+    asyncio.run(settle())
+    status, body = batcher.summary()
+    assert status == 502
+    assert [(r['id'], r['status'], r['error']) for r in json.loads(body)['results']] == [
+        ('a', 502, 'replication failed'), ('b', 502, 'replication failed')]
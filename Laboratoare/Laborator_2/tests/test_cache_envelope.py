@@ -0,0 +1,52 @@
+import gzip
+
+import pytest
+
+from cache_envelope import pack, unpack
+
+
+def test_round_trip_serves_the_stored_wire_bytes():
+    body = b'{"id": "7", "name": "Ann"}'
+    env = unpack(pack(200, {'Content-Type': 'application/json', 'X-Backend': 'n1'}, body))
+    assert env.status == 200
+    assert bytes(env.body) == body and env.body_len == len(body)
+    assert env.headers()['Content-Type'] == 'application/json'
+    assert env.headers()['ETag'] == env.etag
+    head, _, rest = bytes(env.wire).partition(b'\r\n\r\n')
+    assert rest == body and b'X-Backend: n1' in head
+
+
+def test_stored_validators_are_replaced_not_copied():
+    env = unpack(pack(200, {'ETag': '"old"', 'Vary': 'Cookie', 'Content-Encoding': 'br', 'X-A': '1'}, b'x'))
+    assert env.headers() == {'X-A': '1', 'ETag': env.etag}
+
+
+def test_gzip_variant_is_only_picked_for_clients_that_accept_it():
+    body = b'[' + b'{"id": 1},' * 200 + b'{}]'
+    gz = gzip.compress(body, mtime=0)
+    env = unpack(pack(200, {'Content-Type': 'application/json'}, body, gz))
+    assert env.for_encoding(False) is env
+    variant = env.for_encoding(True)
+    assert bytes(variant.body) == gz and gzip.decompress(bytes(variant.body)) == body
+    assert variant.headers()['Content-Encoding'] == 'gzip'
+    assert variant.headers()['Vary'] == env.headers()['Vary'] == 'Accept-Encoding'
+    assert variant.status == env.status == 200
+
+
+def test_without_a_gzip_variant_everyone_gets_identity():
+    env = unpack(pack(404, {}, b'Not Found'))
+    assert env.for_encoding(True) is env and env.status == 404 and 'Vary' not in env.headers()
+
+
+def test_unpack_is_a_view_over_the_stored_buffer():
+    raw = bytearray(pack(200, {}, b'abc'))
+    env = unpack(memoryview(raw))
+    raw[-1:] = b'z'
+    assert bytes(env.body) == b'abz'
+
+
+@pytest.mark.parametrize('raw', [b'', b'PXE3', b'{"status": 200, "body": "x"}', pack(200, {}, b'abc')[:-1],
+                                 pack(200, {}, b'abc') + b'!', b'PXE2' + pack(200, {}, b'abc')[4:]])
+def test_anything_else_is_not_an_envelope(raw):
+    with pytest.raises(ValueError):
+        unpack(raw)
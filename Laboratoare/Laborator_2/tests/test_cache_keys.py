@@ -0,0 +1,53 @@
+from proxy_common import CACHE_KEY_MAX_COMPONENT, LIST_TAG, cache_tags, id_tag, make_cache_key
+
+
+def key(path, **kwargs):
+    return make_cache_key('GET', path, **kwargs)[0]
+
+
+def test_equivalent_requests_share_a_key():
+    assert key('/employees?id=7&format=json') == key('/employees/?format=json&id=7') == key('/employees?id=7')
+    assert key('/employees?limit=5&cursor=abc') == key('/employees?cursor=abc&limit=5')
+    assert key('/employees?id=7') == 'GET:/employees?id=7|json'
+
+
+def test_representations_get_their_own_key():
+    assert key('/employees?id=7', accept='application/xml') == key('/employees?id=7&format=xml')
+    assert key('/employees?id=7&format=xml') != key('/employees?id=7')
+    assert key('/employees?id=7&format=XML') == key('/employees?id=7&format=xml')
+    assert key('/employees?format=json', accept='application/xml') == key('/employees')
+
+
+def test_different_requests_do_not_collide():
+    assert key('/employees?id=7') != key('/employees?id=8')
+    assert key('/employees?id=7') != key('/employees?id=7&id=8')
+    assert key('/employees?id=') != key('/employees')
+    assert make_cache_key('GET', '/employees')[0] != make_cache_key('HEAD', '/employees')[0]
+
+
+def test_long_components_are_digested():
+    long_id = 'x' * (CACHE_KEY_MAX_COMPONENT + 1)
+    k = key('/employees?id=' + long_id)
+    assert long_id not in k and len(k) < 100
+    assert k == key('/employees?id=' + long_id) != key('/employees?id=' + long_id + 'y')
+
+
+def test_bodies_are_digested_into_write_keys():
+    post, emp_id = make_cache_key('POST', '/employees', b'{"id": 7, "name": "Ann"}')
+    assert emp_id == '7' and '|#' in post and 'Ann' not in post
+    assert post != make_cache_key('POST', '/employees', b'{"id": 7, "name": "Bob"}')[0]
+    assert make_cache_key('POST', '/employees', b'not json')[1] is None
+
+
+def test_target_id_of_reads():
+    assert make_cache_key('GET', '/employees?id=7&id=8')[1] == '7'
+    assert make_cache_key('GET', '/employees')[1] is None
+
+
+def test_tags_cover_every_variant_of_a_resource():
+    assert cache_tags(key('/employees?id=7&format=xml')) == (id_tag('7'),)
+    assert cache_tags(key('/employees?limit=5')) == (LIST_TAG,)
+    assert cache_tags(key('/employees')) == (LIST_TAG,)
+    assert cache_tags(key('/employees?q=' + 'z' * (CACHE_KEY_MAX_COMPONENT + 1))) == (LIST_TAG,)
+    assert cache_tags(key('/other')) == ()
+    assert cache_tags(make_cache_key('POST', '/employees', b'{}')[0]) == ()
@@ -0,0 +1,103 @@
+import time
+
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitBreakers
+
+
+def tripped(**settings):
+    settings.setdefault('failures', 2)
+    settings.setdefault('open_seconds', 0.05)
+    breaker = CircuitBreaker('b1', **settings)
+    for _ in range(breaker.failures):
+        breaker.record(False, generation=breaker.generation)
+    assert breaker.state == OPEN
+    return breaker
+
+
+def test_trips_after_consecutive_failures():
+    breaker = CircuitBreaker('b1', failures=3)
+    for ok in (False, False, True, False, False):
+        breaker.record(ok, 0.01)
+    assert breaker.state == CLOSED
+    breaker.record(False)
+    assert breaker.state == OPEN and breaker.stats()['trips'] == 1
+
+
+def test_trips_on_error_rate():
+    breaker = CircuitBreaker('b1', failures=100, error_rate=0.5, min_requests=4)
+    for ok in (True, False, True, False):
+        breaker.record(ok)
+    assert breaker.state == OPEN
+
+
+def test_trips_on_slow_percentile():
+    breaker = CircuitBreaker('b1', slow_seconds=0.2, min_requests=4, percentile=50)
+    for latency in (0.3, 0.3, 0.01, 0.3):
+        breaker.record(True, latency)
+    assert breaker.state == OPEN
+
+
+def test_open_rejects_until_open_seconds_then_hands_out_one_trial():
+    breaker = tripped()
+    assert not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow() and breaker.state == HALF_OPEN
+    assert not breaker.allow()
+    assert breaker.stats()['rejected'] == 2
+
+
+def test_probes_in_a_row_close_it():
+    breaker = tripped(probes=2)
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record(True, generation=breaker.generation)
+    assert breaker.state == HALF_OPEN
+    # the next trial is handed out right away
+    assert breaker.allow()
+    breaker.record(True, generation=breaker.generation)
+    assert breaker.state == CLOSED
+
+
+def test_failed_trial_reopens_it():
+    breaker = tripped()
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record(False, generation=breaker.generation)
+    assert breaker.state == OPEN and not breaker.allow()
+    assert breaker.stats()['trips'] == 1
+
+
+def test_outcomes_of_requests_sent_before_the_trip_are_ignored():
+    breaker = CircuitBreaker('b1', failures=2, open_seconds=0.05, probes=1)
+    sent_while_closed = breaker.generation
+    breaker.record(False, generation=breaker.generation)
+    breaker.record(False, generation=breaker.generation)
+    assert breaker.state == OPEN
+    # a late success must not close a breaker that never ran a trial
+    breaker.record(True, generation=sent_while_closed)
+    assert breaker.state == OPEN
+    time.sleep(0.06)
+    assert breaker.allow()
+    # nor may a late failure cost the trial
+    breaker.record(False, generation=sent_while_closed)
+    assert breaker.state == HALF_OPEN
+    breaker.record(True, generation=breaker.generation)
+    assert breaker.state == CLOSED
+    assert breaker.stats()['stale_outcomes'] == 2
+
+
+def test_late_trial_outcome_after_close_is_ignored():
+    breaker = tripped(probes=1)
+    time.sleep(0.06)
+    assert breaker.allow()
+    trial = breaker.generation
+    breaker.record(True, generation=trial)
+    assert breaker.state == CLOSED
+    breaker.record(False, generation=trial)
+    assert breaker.stats()['consecutive_failures'] == 0
+
+
+def test_split_keeps_order_and_reports_skipped():
+    breakers = CircuitBreakers(failures=1, open_seconds=10)
+    breakers.record('b2', False)
+    allowed, skipped = breakers.split(['b1', 'b2', 'b3'])
+    assert allowed == ['b1', 'b3'] and skipped == {'b2': 'circuit open'}
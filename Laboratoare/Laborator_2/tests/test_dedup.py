@@ -0,0 +1,48 @@
+from dedup import Resolver
+from pagination import id_key, order_key, token
+from scatter_gather import ScatterGather
+
+
+def test_dedupe_keeps_the_lww_winner_at_the_first_position():
+    rows = [{'id': 'a', 'version': 1}, {'id': 'b'}, {'id': 'a', 'version': 3}, {'name': 'no id'}, {'id': 'b'}]
+    assert Resolver('lww').dedupe(rows) == [{'id': 'a', 'version': 3}, {'id': 'b'}, {'name': 'no id'}]
+    assert Resolver('first').dedupe(rows)[0] == {'id': 'a', 'version': 1}
+    assert Resolver('none').dedupe(rows) == rows
+
+
+def test_lww_prefers_versioned_rows():
+    r = Resolver('lww')
+    assert r.winner({'id': 'a'}, {'id': 'a', 'version': 1}) == {'id': 'a', 'version': 1}
+    assert r.winner({'id': 'a', 'version': 1}, {'id': 'a'}) == {'id': 'a', 'version': 1}
+
+
+def test_streamed_pages_merge_into_one_row_per_id():
+    ids = [f'e{i:03d}' for i in range(40)]
+    nodes = {
+        'n1': sorted(({'id': i, 'version': 1} for i in ids), key=id_key),
+        'n2': sorted(({'id': i, 'version': 2} for k, i in enumerate(ids) if k % 2), key=id_key),
+    }
+    requests = []
+
+    def read_pages(backend, emit):
+        # what read_pages does against a node: bounded token-ordered pages of 7 rows
+        after = None
+        while True:
+            requests.append(backend)
+            rows = [r for r in nodes[backend] if after is None or token(r['id']) > token(after)][:7]
+            for row in rows:
+                emit(row)
+            if len(rows) < 7:
+                return
+            after = rows[-1]['id']
+
+    scatter = ScatterGather(4)
+    try:
+        stream = scatter.stream(list(nodes), read_pages, 8, 5.0, key=id_key)
+        rows = list(Resolver('lww').collapse(item for _, item in stream))
+    finally:
+        scatter.shutdown()
+    assert [r['id'] for r in rows] == sorted(ids, key=order_key)
+    assert [r['version'] for r in rows] == [2 if int(r['id'][1:]) % 2 else 1 for r in rows]
+    assert not stream.missing
+    assert requests.count('n1') == 40 // 7 + 1
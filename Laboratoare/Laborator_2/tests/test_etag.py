@@ -0,0 +1,41 @@
+import gzip
+
+import pytest
+
+from cache_envelope import etag_matches, pack, unpack
+from proxy_common import not_modified
+
+
+def envelope(body, status=200, headers=None, gzipped=None):
+    return unpack(pack(status, headers or {}, body, gzipped))
+
+
+def test_etag_depends_on_the_body_only():
+    a = envelope(b'[1, 2]', headers={'X-Backend': 'n1'})
+    b = envelope(b'[1, 2]', headers={'X-Backend': 'n2'})
+    assert a.etag == b.etag and a.etag.startswith('"') and a.etag.endswith('"')
+    assert envelope(b'[1, 3]').etag != a.etag
+
+
+def test_gzip_variant_has_its_own_etag():
+    body = b'x' * 2000
+    env = envelope(body, gzipped=gzip.compress(body))
+    assert env.for_encoding(True).etag == env.etag[:-1] + '-gzip"'
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('"abc"', True), ('W/"abc"', True), ('"x", "abc"', True), ('*', True),
+    ('"abcd"', False), ('abc', False), ('', False),
+])
+def test_if_none_match_uses_weak_comparison(header, expected):
+    assert etag_matches(header, '"abc"') is expected
+
+
+def test_not_modified_only_for_cached_200s():
+    ok = envelope(b'body')
+    assert not_modified(ok.etag, ok)
+    assert not not_modified('', ok)
+    assert not not_modified('"other"', ok)
+    missing = envelope(b'Not Found', status=404)
+    assert not not_modified(missing.etag, missing)
+    assert not not_modified(ok.etag, b'body')
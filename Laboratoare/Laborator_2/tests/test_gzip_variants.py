@@ -0,0 +1,39 @@
+import gzip
+import os
+
+import pytest
+
+from proxy_common import GZIP_MIN_BYTES, accepts_gzip, decode_cache_entry, encode_cache_entry
+
+JSON = {'Content-Type': 'application/json'}
+
+
+def test_large_compressible_bodies_get_a_gzip_variant():
+    body = b'[' + b'{"id": "e1", "name": "employee"},' * 100 + b'{}]'
+    assert len(body) >= GZIP_MIN_BYTES
+    env = decode_cache_entry(encode_cache_entry(200, JSON, body))
+    variant = env.for_encoding(True)
+    assert variant is not env and gzip.decompress(bytes(variant.body)) == body
+
+
+@pytest.mark.parametrize('headers, body', [
+    (JSON, b'{"id": "e1"}'),                              # under GZIP_MIN_BYTES
+    ({'Content-Type': 'image/png'}, b'x' * 4096),         # not compressible
+    (JSON, os.urandom(4096)),                             # would not get smaller
+], ids=['small', 'binary', 'random'])
+def test_no_variant_when_it_would_not_help(headers, body):
+    env = decode_cache_entry(encode_cache_entry(200, headers, body))
+    assert env.for_encoding(True) is env
+
+
+def test_hop_by_hop_and_per_request_headers_are_not_stored():
+    env = decode_cache_entry(encode_cache_entry(200, dict(JSON, Connection='close', Date='x', Server='y'), b'{}'))
+    assert set(env.headers()) == {'Content-Type', 'ETag'}
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('gzip', True), ('gzip, deflate, br', True), ('br;q=1.0, gzip;q=0.5', True), ('*', True), ('x-gzip', True),
+    ('gzip;q=0', False), ('identity', False), ('', False), (None, False), ('*;q=0', False), ('gzip;q=zero', False),
+])
+def test_accept_encoding(header, expected):
+    assert accepts_gzip(header) is expected
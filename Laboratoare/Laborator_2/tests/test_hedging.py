@@ -0,0 +1,94 @@
+import threading
+import time
+
+from hedging import HedgePolicy, HedgedReads
+
+
+def warmed(policy, latency=0.01):
+    for _ in range(policy.min_samples):
+        policy.record(latency)
+    return policy
+
+
+def test_unhedged_reads_run_on_the_calling_thread():
+    reads = HedgedReads(HedgePolicy(enabled=False))
+    threads = []
+
+    def fn(backend):
+        threads.append(threading.current_thread())
+        if backend == 'b1':
+            raise RuntimeError('down')
+        return backend
+
+    try:
+        assert reads.call(['b1', 'b2'], fn) == ('b2', 'b2', [('b1', 'down')])
+    finally:
+        reads.shutdown()
+    assert threads == [threading.current_thread()] * 2
+
+
+def test_a_slow_read_is_raced_against_the_next_backend():
+    reads = HedgedReads(warmed(HedgePolicy(min_samples=5, max_fraction=1.0)))
+
+    def fn(backend):
+        if backend == 'slow':
+            time.sleep(0.5)
+        return backend
+
+    start = time.monotonic()
+    try:
+        assert reads.call(['slow', 'fast'], fn)[0] == 'fast'
+    finally:
+        reads.shutdown()
+    assert time.monotonic() - start < 0.3
+    assert reads.policy.stats()['hedge_wins'] == 1
+
+
+def test_reads_do_not_queue_behind_a_busy_pool():
+    reads = HedgedReads(warmed(HedgePolicy(min_samples=5, max_fraction=0.0)), max_workers=1)
+    release = threading.Event()
+    inline = []
+
+    def fn(backend):
+        if backend == 'blocked':
+            release.wait(2)
+        else:
+            inline.append(threading.current_thread())
+        return backend
+
+    first = threading.Thread(target=reads.call, args=(['blocked'], fn))
+    first.start()
+    time.sleep(0.05)
+    try:
+        assert reads.call(['free'], fn)[0] == 'free'
+        assert inline == [threading.current_thread()]
+    finally:
+        release.set()
+        first.join()
+        reads.shutdown()
+
+
+def test_an_abandoned_loser_counts_against_the_hedge_budget():
+    policy = warmed(HedgePolicy(min_samples=5, max_fraction=0.5))
+    reads = HedgedReads(policy)
+    release = threading.Event()
+
+    def fn(backend):
+        if backend == 'stuck':
+            release.wait(2)
+        return backend
+
+    try:
+        for _ in range(3):
+            policy.started()
+        assert reads.call(['stuck', 'fast'], fn)[0] == 'fast'
+        # 4 reads, 1 hedge and 1 loser still running: another hedge would exceed half of the reads
+        assert policy.stats()['abandoned'] == 1 and not policy.try_hedge()
+        release.set()
+        deadline = time.monotonic() + 2
+        while policy.stats()['abandoned'] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert policy.stats()['abandoned'] == 0 and policy.try_hedge()
+    finally:
+        release.set()
+        reads.shutdown()
@@ -0,0 +1,181 @@
+import json
+import threading
+import time
+
+from hinted_handoff import HintedHandoff, HintLog
+from replicator import QuorumReplicator
+
+
+class Backend:
+    """Records the bodies applied, in order; answers `status` while it is set, 200 otherwise."""
+
+    def __init__(self):
+        self.applied = []
+        self.status = None
+        self.healthy = threading.Event()
+        self.healthy.set()
+
+    def send(self, backend, method, path, body, timeout):
+        if self.status is not None:
+            return self.status
+        self.applied.append(body)
+        return 200
+
+
+def wait_caught_up(hints, seconds=5.0):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        if all(log['pending_bytes'] == 0 for log in hints.stats().values()):
+            return
+        time.sleep(0.01)
+    raise AssertionError(f'hints not replayed: {hints.stats()}')
+
+
+def make_hints(tmp_path, node, **settings):
+    settings.setdefault('replay_rate', 0)
+    settings.setdefault('retry_seconds', 0.02)
+    return HintedHandoff(str(tmp_path), node.send, lambda b: node.healthy.is_set(), **settings)
+
+
+def test_writes_queue_behind_pending_hints(tmp_path):
+    node = Backend()
+    node.healthy.clear()
+    hints = make_hints(tmp_path, node)
+    direct, deferred = hints.split(['b1'], 'PUT', '/employees', b'A')
+    hints.hand_off('b1', direct['b1'])
+    direct, deferred = hints.split(['b1'], 'PUT', '/employees', b'B')
+    assert direct == {} and deferred == ['b1']
+    hints.start(['b1'])
+    try:
+        node.healthy.set()
+        wait_caught_up(hints)
+    finally:
+        hints.shutdown()
+    assert node.applied == [b'A', b'B']
+    # caught up: the next write goes straight to the backend again
+    assert list(hints.split(['b1'], 'PUT', '/employees', b'C')[0]) == ['b1']
+
+
+def test_newer_write_applied_while_older_one_fails_is_replayed_after_it(tmp_path):
+    node = Backend()
+    hints = make_hints(tmp_path, node)
+    a = hints.split(['b1'], 'PUT', '/employees', b'A')[0]['b1']
+    b = hints.split(['b1'], 'PUT', '/employees', b'B')[0]['b1']
+    # B gets through first, then A fails for good
+    node.send('b1', 'PUT', '/employees', b'B', 1)
+    hints.answered('b1', b)
+    hints.hand_off('b1', a)
+    hints.start(['b1'])
+    try:
+        wait_caught_up(hints)
+    finally:
+        hints.shutdown()
+    assert node.applied == [b'B', b'A', b'B']
+
+
+def test_answered_writes_before_the_oldest_unanswered_one_are_not_replayed(tmp_path):
+    node = Backend()
+    hints = make_hints(tmp_path, node)
+    a = hints.split(['b1'], 'PUT', '/employees', b'A')[0]['b1']
+    b = hints.split(['b1'], 'PUT', '/employees', b'B')[0]['b1']
+    c = hints.split(['b1'], 'PUT', '/employees', b'C')[0]['b1']
+    hints.answered('b1', a)
+    hints.hand_off('b1', c)
+    # B was still in flight when C failed: it goes into the log ahead of C, its own outcome no longer matters
+    hints.hand_off('b1', b)
+    hints.answered('b1', b)
+    hints.start(['b1'])
+    try:
+        wait_caught_up(hints)
+    finally:
+        hints.shutdown()
+    assert node.applied == [b'B', b'C']
+    assert hints.stats()['b1']['appended'] == 2
+
+
+def test_retry_race_through_the_replicator(tmp_path):
+    # write A is still failing against the backend while the newer write B gets through: B must win
+    node = Backend()
+    hints = make_hints(tmp_path, node)
+    replicator = QuorumReplicator(retries=2, backoff=0.05)
+    a_sent = threading.Event()
+
+    def send_a(backend, timeout):
+        a_sent.set()
+        time.sleep(0.1)
+        return 500
+
+    def send_b(backend, timeout):
+        return node.send(backend, 'PUT', '/employees', b'B', timeout)
+
+    def write(body, send):
+        tickets, _ = hints.split(['b1'], 'PUT', '/employees', body)
+        return replicator.replicate(list(tickets), send, 1, 5, lambda b: hints.hand_off(b, tickets[b]),
+                                    lambda b: hints.answered(b, tickets[b]))
+
+    first = threading.Thread(target=write, args=(b'A', send_a))
+    first.start()
+    a_sent.wait(1)
+    assert write(b'B', send_b)[0] == ['b1']
+    first.join()
+    hints.start(['b1'])
+    try:
+        wait_caught_up(hints)
+    finally:
+        hints.shutdown()
+        replicator.shutdown(wait=True)
+    assert node.applied[-1] == b'B'
+    assert node.applied.index(b'A') < len(node.applied) - 1
+
+
+def test_rejected_hint_is_dropped_and_replay_goes_on(tmp_path):
+    node = Backend()
+    node.healthy.clear()
+    hints = make_hints(tmp_path, node)
+    for body in (b'A', b'B'):
+        tickets, deferred = hints.split(['b1'], 'PUT', '/employees', body)
+        for backend, ticket in tickets.items():
+            hints.hand_off(backend, ticket)
+    node.status = 400
+    hints.start(['b1'])
+    try:
+        node.healthy.set()
+        wait_caught_up(hints)
+    finally:
+        hints.shutdown()
+    assert hints.stats()['b1']['dropped'] == 2 and node.applied == []
+
+
+def test_hints_survive_a_restart(tmp_path):
+    node = Backend()
+    hints = make_hints(tmp_path, node)
+    for body in (b'A', b'B'):
+        tickets, _ = hints.split(['b1'], 'PUT', '/employees', body)
+        if tickets:
+            hints.hand_off('b1', tickets['b1'])
+    hints.shutdown()
+    with open(tmp_path / 'b1.log') as f:
+        assert [json.loads(line)['method'] for line in f] == ['PUT', 'PUT']
+
+    again = make_hints(tmp_path, node)
+    again.start(['b1'])
+    try:
+        wait_caught_up(again)
+    finally:
+        again.shutdown()
+    assert node.applied == [b'A', b'B']
+
+
+def test_outstanding_until_sends_are_answered_and_hints_replayed(tmp_path):
+    log = HintLog(str(tmp_path), 'http://b1')
+    assert not log.outstanding()
+    ticket = log.reserve('POST', '/employees', b'{"id": "1"}')
+    assert log.outstanding()
+    log.answered(ticket)
+    assert not log.outstanding()
+    log.hand_off(log.reserve('POST', '/employees', b'{"id": "2"}'))
+    assert log.outstanding()
+    hint, offset = log.next()
+    log.done(offset)
+    assert not log.outstanding()
+    log.close()
@@ -0,0 +1,66 @@
+import json
+
+import pytest
+
+from json_stream import ArrayItemParser, ChunkedArrayWriter
+
+
+def parse_in_pieces(data: bytes, size: int):
+    parser, items = ArrayItemParser(), []
+    for i in range(0, len(data), size):
+        items += parser.feed(data[i:i + size])
+    return items + parser.close()
+
+
+ROWS = [{'id': 'e1', 'name': 'Ann [x], {y}'}, {'id': 'ü', 'name': 'quote " and \\ backslash'}, [1, 2], 'str', 3]
+
+
+@pytest.mark.parametrize('size', [1, 2, 7, 1000])
+def test_items_survive_any_split_of_the_body(size):
+    data = json.dumps(ROWS, ensure_ascii=False).encode('utf-8')
+    assert parse_in_pieces(data, size) == ROWS
+
+
+def test_a_lone_object_is_one_item():
+    assert parse_in_pieces(b' {"id": "e1"} ', 3) == [{'id': 'e1'}]
+
+
+@pytest.mark.parametrize('data', [b'[{"id": 1}', b'[{"id": 1},', b'"text"', b'[1] 2'])
+def test_truncated_or_malformed_bodies_raise(data):
+    with pytest.raises(ValueError):
+        parse_in_pieces(data, 4)
+
+
+def unchunk(frames: bytes) -> bytes:
+    body, rest = b'', frames
+    while True:
+        size, _, rest = rest.partition(b'\r\n')
+        size = int(size, 16)
+        if not size:
+            return body
+        body, rest = body + rest[:size], rest[size + 2:]
+
+
+def test_writer_emits_one_array_in_bounded_chunks():
+    writer, frames = ChunkedArrayWriter(chunk_size=64, keep_max=10 ** 6), b''
+    for row in ROWS * 10:
+        frame = writer.add(row)
+        assert len(frame) < 64 + 80
+        frames += frame
+    frames += writer.finish()
+    assert frames.endswith(b'0\r\n\r\n')
+    assert json.loads(unchunk(frames)) == ROWS * 10
+    assert writer.body == unchunk(frames) and writer.count == 50
+
+
+def test_writer_drops_its_copy_past_keep_max():
+    writer = ChunkedArrayWriter(chunk_size=16, keep_max=100)
+    for row in ROWS * 10:
+        writer.add(row)
+    writer.finish({'X-Missing-Backends': 'n2'})
+    assert writer.body is None
+
+
+def test_empty_array_with_trailers():
+    frames = ChunkedArrayWriter().finish({'X-Missing-Backends': 'n2'})
+    assert frames == b'2\r\n[]\r\n0\r\nX-Missing-Backends: n2\r\n\r\n'
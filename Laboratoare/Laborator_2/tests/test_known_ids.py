@@ -0,0 +1,114 @@
+import time
+
+import pytest
+
+from known_ids import BloomFilter, KnownIds
+from pagination import order_key
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def pager(stores, calls=None):
+    """page() over in-memory backends, answering like a node: ids after `after` in token order."""
+    def page(backend, after, limit):
+        if calls is not None:
+            calls.append((backend, after))
+        ids = sorted(stores[backend], key=order_key)
+        if after is not None:
+            ids = [i for i in ids if order_key(i) > order_key(after)]
+        return ids[:limit]
+    return page
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(1000, 0.01)
+    ids = [f'e{i}' for i in range(1000)]
+    for i in ids:
+        bloom.add(i)
+    assert all(i in bloom for i in ids)
+    false_positives = sum(f'x{i}' in bloom for i in range(10000))
+    assert false_positives < 300 and 0 < bloom.fill() < 1
+
+
+def test_processes_mapping_one_file_share_the_filter(tmp_path):
+    path = str(tmp_path / 'known-ids')
+    first, second = BloomFilter(100, 0.01, path), BloomFilter(100, 0.01, path)
+    first.add('e1')
+    assert 'e1' in second
+    with pytest.raises(ValueError):
+        BloomFilter(5000, 0.01, path)
+
+
+def test_a_file_of_another_size_falls_back_to_a_private_filter(tmp_path):
+    path = str(tmp_path / 'known-ids')
+    BloomFilter(5000, 0.01, path)
+    known = KnownIds(['b1'], pager({'b1': []}), capacity=100, path=path)
+    known.add('e1')
+    assert 'e1' in known.filter and 'e1' not in BloomFilter(5000, 0.01, path)
+
+
+def test_loads_every_backend_page_by_page_in_token_order():
+    stores = {'b1': [f'e{i}' for i in range(7)], 'b2': ['e3', 'x1']}
+    calls = []
+    known = KnownIds(list(stores), pager(stores, calls), capacity=100, page_rows=3, reload_seconds=0)
+    assert not known.definitely_absent('nope')
+    known.start()
+    try:
+        assert wait_for(lambda: known.ready)
+    finally:
+        known.shutdown()
+    b1_pages = [after for backend, after in calls if backend == 'b1']
+    ordered = sorted(stores['b1'], key=order_key)
+    assert b1_pages == [None, ordered[2], ordered[5]]
+    assert not any(known.definitely_absent(i) for i in stores['b1'] + stores['b2'])
+    assert known.definitely_absent('nope') and known.stats()['absent_lookups'] == 1
+
+
+def test_not_ready_until_every_backend_was_paged():
+    stores = {'b1': ['e1'], 'b2': ['e2']}
+    page = pager(stores)
+    failures = []
+
+    def flaky(backend, after, limit):
+        if backend == 'b2' and len(failures) < 2:
+            failures.append(backend)
+            raise ConnectionError('down')
+        return page(backend, after, limit)
+
+    known = KnownIds(list(stores), flaky, capacity=100, retry_seconds=0.05, reload_seconds=0)
+    known.start()
+    try:
+        assert wait_for(lambda: known.ready)
+    finally:
+        known.shutdown()
+    assert len(failures) == 2 and known.stats()['last_error'] is None
+    assert not known.definitely_absent('e2')
+
+
+def test_reloads_pick_up_ids_written_behind_the_proxys_back():
+    stores = {'b1': ['e1']}
+    known = KnownIds(['b1'], pager(stores), capacity=100, reload_seconds=0.05)
+    known.start()
+    try:
+        assert wait_for(lambda: known.ready)
+        stores['b1'].append('direct')
+        assert wait_for(lambda: 'direct' in known.filter)
+    finally:
+        known.shutdown()
+
+
+def test_writes_feed_the_filter():
+    known = KnownIds(['b1'], pager({'b1': []}), capacity=100)
+    known.ready = True
+    known.add('w1', None, '', 7)
+    assert not known.definitely_absent('w1') and not known.definitely_absent(7)
+    assert known.definitely_absent('w2')
+
+
+def test_default_reload_is_finite():
+    assert KnownIds(['b1'], pager({'b1': []}), capacity=100).reload_seconds > 0
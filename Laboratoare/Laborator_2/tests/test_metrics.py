@@ -0,0 +1,61 @@
+import threading
+
+from metrics import Registry
+from proxy_common import route_label
+
+
+def lines(registry):
+    return registry.render().splitlines()
+
+
+def test_counters_from_many_threads_add_up():
+    registry = Registry()
+    hits = registry.counter('hits_total', 'Hits.', ('route',))
+    threads = [threading.Thread(target=lambda: [hits.inc('/a') for _ in range(1000)]) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    hits.inc('/b', amount=2)
+    out = lines(registry)
+    assert out[:2] == ['# HELP hits_total Hits.', '# TYPE hits_total counter']
+    assert 'hits_total{route="/a"} 8000' in out and 'hits_total{route="/b"} 2' in out
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    latency = registry.histogram('latency_seconds', 'Latency.', ('route',), buckets=(0.1, 1.0))
+    for v in (0.05, 0.1, 0.5, 3.0):
+        latency.observe(v, '/a')
+    out = lines(registry)
+    assert 'latency_seconds_bucket{route="/a",le="0.1"} 2' in out
+    assert 'latency_seconds_bucket{route="/a",le="1.0"} 3' in out
+    assert 'latency_seconds_bucket{route="/a",le="+Inf"} 4' in out
+    assert 'latency_seconds_sum{route="/a"} 3.65' in out and 'latency_seconds_count{route="/a"} 4' in out
+
+
+def test_label_values_are_escaped_and_collectors_rendered():
+    registry = Registry()
+    registry.gauge('up', 'Up.', ('backend',)).inc('a"b\\c\nd')
+    registry.collector(lambda: [('pool_idle', 'gauge', 'Idle.', ('backend',), [(('n1',), 3)])])
+    out = lines(registry)
+    assert 'up{backend="a\\"b\\\\c\\nd"} 1' in out
+    assert '# TYPE pool_idle gauge' in out and 'pool_idle{backend="n1"} 3' in out
+
+
+def test_finished_threads_are_folded_into_one_shard():
+    registry = Registry()
+    hits = registry.counter('hits_total', 'Hits.')
+    for _ in range(300):
+        t = threading.Thread(target=hits.inc)
+        t.start()
+        t.join()
+    assert registry.snapshot() == {('hits_total', ()): 300}
+    assert len(registry._shards) < 256
+
+
+def test_route_labels_stay_bounded():
+    assert route_label('/employees?id=12345') == '/employees?id'
+    assert route_label('/employees/?limit=5&cursor=x') == '/employees?page'
+    assert route_label('/employees') == '/employees'
+    assert route_label('/random/path/42') == 'other'
@@ -0,0 +1,97 @@
+import pytest
+
+from dedup import Resolver
+from pagination import (backend_page_path, decode_cursor, encode_cursor, id_key, merge_pages, murmur3_token,
+                        order_key, page_params, token)
+
+
+@pytest.mark.parametrize('last_id', ['e000001', '0', '', 'id with spaces/and+signs', 'ünïcode'])
+def test_cursor_round_trip(last_id):
+    token = encode_cursor(last_id)
+    assert '=' not in token
+    assert decode_cursor(token) == last_id
+
+
+@pytest.mark.parametrize('token', ['', 'not-base64!', encode_cursor('x')[:-2], 'eyJ2IjoyLCJhZnRlciI6IngifQ'])
+def test_foreign_cursors_are_rejected(token):
+    with pytest.raises(ValueError):
+        decode_cursor(token)
+
+
+def test_page_params():
+    assert page_params('', 100) is None
+    assert page_params('limit=10', 100) == (10, None)
+    assert page_params('limit=1000', 100) == (100, None)
+    assert page_params('cursor=' + encode_cursor('e5'), 100) == (100, 'e5')
+    with pytest.raises(ValueError):
+        page_params('limit=0', 100)
+    with pytest.raises(ValueError):
+        page_params('limit=ten', 100)
+
+
+def test_backend_page_path():
+    assert backend_page_path('/employees', 5, None) == '/employees?limit=5'
+    assert backend_page_path('/employees', 5, 'e 1') == '/employees?limit=5&after=e+1'
+
+
+@pytest.mark.parametrize('data, expected', [
+    (b'123', -7468325962851647638),
+    (b'\x00\xff\x10\xfa\x99' * 10, 5837342703291459765),
+    (b'\xfe' * 8, -8927430733708461935),
+    (b'\x10' * 8, 1446172840243228796),
+    (str(2 ** 63 - 1).encode(), 7162290910810015547),
+])
+def test_tokens_match_cassandra(data, expected):
+    assert murmur3_token(data) == expected
+
+
+def test_token_of_an_id_is_the_token_of_its_utf8_bytes():
+    assert token('123') == murmur3_token(b'123')
+    assert token(123) == token('123')
+    assert token('ünïcode') == murmur3_token('ünïcode'.encode('utf-8'))
+
+
+def backend_page(rows, after, limit):
+    """What a node answers for ?limit=&after=: WHERE token(id) > token(after) LIMIT limit."""
+    rows = sorted(rows, key=id_key)
+    return [r for r in rows if after is None or token(r['id']) > token(after)][:limit]
+
+
+def walk(backends, limit, resolver=None):
+    """Every page a client gets following the cursors."""
+    pages, after = [], None
+    while True:
+        rows, cursor = merge_pages([backend_page(b, after, limit) for b in backends], limit, resolver)
+        pages.append(rows)
+        if cursor is None:
+            return pages
+        after = decode_cursor(cursor)
+        assert len(pages) < 100
+
+
+def test_walk_returns_every_id_once_in_order():
+    ids = [f'e{i:03d}' for i in range(23)]
+    # replicas with gaps and overlaps; together they hold every id
+    backends = [
+        [{'id': i} for k, i in enumerate(ids) if k % 3 != 0],
+        [{'id': i} for k, i in enumerate(ids) if k % 3 != 1],
+        [{'id': i} for i in ids[5:12]],
+    ]
+    for limit in (1, 2, 5, 7, 50):
+        pages = walk(backends, limit)
+        served = [r['id'] for page in pages for r in page]
+        assert served == sorted(ids, key=order_key)
+        assert all(len(page) <= limit for page in pages)
+
+
+def test_copies_collapse_to_the_lww_winner_across_page_boundaries():
+    a = [{'id': 'e1', 'version': 1}, {'id': 'e2', 'version': 5}, {'id': 'e3', 'version': 1}]
+    b = [{'id': 'e1', 'version': 2}, {'id': 'e2', 'version': 4}, {'id': 'e3'}]
+    pages = walk([a, b], 1, Resolver('lww'))
+    winners = [{'id': 'e1', 'version': 2}, {'id': 'e2', 'version': 5}, {'id': 'e3', 'version': 1}]
+    assert [r for page in pages for r in page] == sorted(winners, key=id_key)
+
+
+def test_last_page_has_no_cursor():
+    rows, cursor = merge_pages([[{'id': 'e1'}], [{'id': 'e2'}]], 5)
+    assert [r['id'] for r in rows] == sorted(['e1', 'e2'], key=order_key) and cursor is None
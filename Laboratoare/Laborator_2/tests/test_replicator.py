@@ -0,0 +1,107 @@
+import threading
+import time
+
+from replicator import QuorumReplicator
+
+
+def replicate(send, backends=('b1', 'b2', 'b3'), quorum=2, timeout=2.0, **kwargs):
+    replicator = QuorumReplicator(retries=2, backoff=0.01)
+    try:
+        return replicator.replicate(list(backends), send, quorum, timeout, **kwargs)
+    finally:
+        replicator.shutdown(wait=True)
+
+
+def test_returns_once_the_quorum_acknowledged():
+    release = threading.Event()
+
+    def send(backend, timeout):
+        if backend == 'b3':
+            release.wait(2)
+        return 200
+
+    start = time.monotonic()
+    replicator = QuorumReplicator()
+    success, errors, pending = replicator.replicate(['b1', 'b2', 'b3'], send, 2, 2.0)
+    assert time.monotonic() - start < 1
+    assert sorted(success) == ['b1', 'b2'] and errors == [] and pending == ['b3']
+    release.set()
+    replicator.shutdown(wait=True)
+
+
+def test_stops_once_the_quorum_is_out_of_reach():
+    success, errors, pending = replicate(lambda b, t: 200 if b == 'b3' else 400, backends=('b1', 'b2', 'b3'))
+    assert sorted(b for b, _ in errors) == ['b1', 'b2']
+    assert len(success) + len(pending) == 1
+
+
+def test_retries_5xx_and_errors_but_not_rejections():
+    calls = {'b1': 0, 'b2': 0, 'b3': 0}
+
+    def send(backend, timeout):
+        calls[backend] += 1
+        if backend == 'b1':
+            return 200 if calls[backend] == 3 else 503
+        if backend == 'b2':
+            raise ConnectionError('refused')
+        return 404
+
+    success, errors, pending = replicate(send, quorum=1)
+    assert success == ['b1'] or 'b1' in pending
+    time.sleep(0.1)
+    assert calls == {'b1': 3, 'b2': 3, 'b3': 1}
+
+
+def test_hand_off_replaces_the_retries():
+    calls, handed, answered = [], [], []
+
+    def send(backend, timeout):
+        calls.append(backend)
+        return {'b1': 503, 'b2': 200, 'b3': 400}[backend]
+
+    replicate(send, quorum=3, hand_off=handed.append, answered=answered.append)
+    assert sorted(calls) == ['b1', 'b2', 'b3']
+    # a rejected write is answered, not handed off: replaying it would not help
+    assert handed == ['b1'] and sorted(answered) == ['b2', 'b3']
+
+
+def test_retry_backoffs_do_not_hold_up_new_writes():
+    replicator = QuorumReplicator(max_workers=1, retries=2, backoff=0.5)
+    try:
+        replicator.replicate(['b1'], lambda b, t: 503, 1, 2.0)
+        # b1 now sits in its backoff on the tail executor; the only send worker is free again
+        start = time.monotonic()
+        success, errors, pending = replicator.replicate(['b2'], lambda b, t: 200, 1, 2.0)
+        assert success == ['b2'] and time.monotonic() - start < 0.3
+    finally:
+        replicator.shutdown(wait=True)
+
+
+def test_sends_queued_past_their_deadline_are_handed_off_without_sending():
+    replicator = QuorumReplicator(max_workers=1)
+    release = threading.Event()
+    calls, handed = [], []
+
+    def send(backend, timeout):
+        calls.append(backend)
+        release.wait(2)
+        return 200
+
+    try:
+        success, errors, pending = replicator.replicate(['b1', 'b2'], send, 2, 0.2, hand_off=handed.append)
+        assert success == [] and sorted(pending) == ['b1', 'b2']
+        release.set()
+    finally:
+        replicator.shutdown(wait=True)
+    assert calls == ['b1'] and handed == ['b2']
+
+
+def test_shutdown_waits_for_retries():
+    calls = []
+
+    def send(backend, timeout):
+        calls.append(backend)
+        return 503
+
+    replicate(send, backends=('b1',), quorum=1)
+    assert calls == ['b1', 'b1', 'b1']
@@ -0,0 +1,94 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from singleflight import AsyncSingleFlight, SingleFlight
+
+
+def test_concurrent_callers_share_one_fetch():
+    flight = SingleFlight()
+    calls, results = [], []
+    release = threading.Event()
+
+    def fetch():
+        calls.append(1)
+        release.wait(2)
+        return 'body'
+
+    threads = [threading.Thread(target=lambda: results.append(flight.do('k', fetch))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    time.sleep(0.1)
+    release.set()
+    for t in threads:
+        t.join(2)
+    assert len(calls) == 1
+    assert sorted(results) == [('body', False)] + [('body', True)] * 7
+
+
+def test_waiters_get_the_leaders_exception():
+    flight = SingleFlight()
+    started, errors = threading.Event(), []
+
+    def fetch():
+        started.set()
+        time.sleep(0.1)
+        raise ConnectionError('backend down')
+
+    def call():
+        try:
+            flight.do('k', fetch)
+        except ConnectionError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait(2)
+    call()
+    leader.join(2)
+    assert len(errors) == 2 and errors[0] is errors[1]
+
+
+def test_a_finished_call_is_not_reused():
+    flight = SingleFlight()
+    assert flight.do('k', lambda: 1) == (1, False)
+    assert flight.do('k', lambda: 2) == (2, False)
+
+
+def test_background_fetch_starts_once_per_key():
+    flight = SingleFlight()
+    release, done = threading.Event(), threading.Event()
+
+    def fetch():
+        release.wait(2)
+        done.set()
+
+    assert flight.do_background('k', fetch) is True
+    assert flight.do_background('k', fetch) is False
+    release.set()
+    assert done.wait(2)
+
+
+def test_async_callers_share_one_fetch_and_survive_a_cancelled_waiter():
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return 'body'
+
+    async def main():
+        flight = AsyncSingleFlight()
+        impatient = asyncio.ensure_future(flight.do('k', fetch))
+        waiters = [asyncio.ensure_future(flight.do('k', fetch)) for _ in range(3)]
+        await asyncio.sleep(0)
+        impatient.cancel()
+        results = await asyncio.gather(*waiters)
+        with pytest.raises(asyncio.CancelledError):
+            await impatient
+        return results
+
+    assert asyncio.run(main()) == [('body', True)] * 3
+    assert len(calls) == 1
@@ -0,0 +1,84 @@
+import json
+
+import pytest
+
+import cache_layer
+from proxy_common import cache_key_for, decode_cache_entry, store_response
+from write_through import WriteThrough, stored_employee
+
+ID_KEY = cache_key_for('GET', '/employees', [('id', '7')], 'json')
+XML_KEY = cache_key_for('GET', '/employees', [('id', '7')], 'xml')
+LIST_KEY = cache_key_for('GET', '/employees', [], 'json')
+JSON = {'Content-Type': 'application/json'}
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    monkeypatch.setattr(cache_layer, 'redis', None)
+    cache = cache_layer.CacheLayer()
+    yield cache
+    cache.stop()
+
+
+def cached_json(cache, key):
+    entry = cache.get_entry(key)
+    return None if entry is None else json.loads(bytes(decode_cache_entry(entry[0]).body))
+
+
+def cache_list(cache, rows, headers=JSON, ttl=30):
+    store_response(cache, LIST_KEY, 200, headers, json.dumps(rows).encode(), ttl)
+
+
+def write(wt, emp):
+    wt.applied(wt.begin(emp['id']), emp['id'], emp)
+
+
+def test_the_written_employee_is_cached_and_other_variants_dropped(cache):
+    store_response(cache, XML_KEY, 200, {}, b'<old/>', 30)
+    write(WriteThrough(cache), {'id': '7', 'name': 'Ann'})
+    assert cached_json(cache, ID_KEY) == {'id': '7', 'name': 'Ann'}
+    assert cache.get_entry(XML_KEY) is None
+
+
+def test_a_fresh_complete_list_is_patched_in_place(cache):
+    cache_list(cache, [{'id': '1'}, {'id': '7', 'name': 'old'}])
+    wt = WriteThrough(cache)
+    write(wt, {'id': '7', 'name': 'Ann'})
+    assert cached_json(cache, LIST_KEY) == [{'id': '1'}, {'id': '7', 'name': 'Ann'}]
+    write(wt, {'id': '9', 'name': 'Bob'})
+    assert cached_json(cache, LIST_KEY)[-1] == {'id': '9', 'name': 'Bob'}
+
+
+def test_partial_or_oversized_lists_are_dropped_instead(cache):
+    cache_list(cache, [{'id': '1'}], headers=dict(JSON, **{'X-Missing-Backends': 'n2'}))
+    write(WriteThrough(cache), {'id': '7'})
+    assert cache.get_entry(LIST_KEY) is None
+    cache_list(cache, [{'id': '1', 'title': 'x' * 100}])
+    write(WriteThrough(cache, list_max_bytes=50), {'id': '7'})
+    assert cache.get_entry(LIST_KEY) is None
+
+
+def test_an_older_write_finishing_last_only_drops_entries(cache):
+    wt = WriteThrough(cache)
+    older, newer = wt.begin('7'), wt.begin('7')
+    wt.applied(newer, '7', {'id': '7', 'name': 'new'})
+    assert cached_json(cache, ID_KEY) == {'id': '7', 'name': 'new'}
+    wt.applied(older, '7', {'id': '7', 'name': 'old'})
+    assert cache.get_entry(ID_KEY) is None
+
+
+def test_failed_or_disabled_writes_only_drop_entries(cache):
+    cache_list(cache, [{'id': '1'}])
+    store_response(cache, ID_KEY, 200, JSON, b'{"id": "7"}', 30)
+    wt = WriteThrough(cache)
+    wt.failed(wt.begin('7'), '7')
+    assert cache.get_entry(ID_KEY) is None and cache.get_entry(LIST_KEY) is None
+    write(WriteThrough(cache, enabled=False), {'id': '7'})
+    assert cache.get_entry(ID_KEY) is None
+
+
+def test_stored_employee_from_the_ack():
+    assert stored_employee(b'{"status": "ok", "employee": {"id": "7"}}') == {'id': '7'}
+    assert stored_employee(b'{"status": "ok"}') is None
+    assert stored_employee(b'not json') is None
+    assert stored_employee(b'[1]') is None
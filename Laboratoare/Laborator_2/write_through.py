@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Write-through cache population: after an acknowledged POST/PUT the next read of the written employee, and of
+the list, is served from the cache instead of paying a backend fan-out.
+- every cached variant (format, query, page) of the employee and of the list is dropped, by cache tag
+- the JSON per-id entry is then stored from the employee as the backend stored it (returned with its ack)
+- the cached JSON list is patched in place (row replaced or appended) when it is fresh, complete and under
+  list_max_bytes; otherwise it stays dropped and the next read refetches it
+Concurrent writes to one id are ordered by begin(): only the newest write started for an id fills the cache,
+an older one finishing later only drops entries.
+"""
+import json
+import math
+import logging
+import threading
+from itertools import count
+from typing import Any, Dict, Optional
+
+from proxy_common import (LIST_TAG, id_tag, cache_key_for, decode_cache_entry, store_response,
+                          invalidate_after_write)
+
+logger = logging.getLogger("proxy")
+
+_JSON = {'Content-Type': 'application/json; charset=utf-8'}
+
+
+def stored_employee(ack) -> Optional[Dict[str, Any]]:
+    """The employee as the backend stored it, from its write answer (None for an answer without it)."""
+    try:
+        return json.loads(ack).get('employee')
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+class WriteThrough:
+    def __init__(self, cache, enabled: bool = True, list_max_bytes: int = 1024 * 1024, ttl: int = 30,
+                 stale_seconds: int = 0):
+        self.cache = cache
+        self.enabled = enabled
+        self.list_max_bytes = list_max_bytes
+        self.ttl = ttl
+        self.stale_seconds = stale_seconds
+        self._seq = count(1)
+        self._latest: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        # one list read-modify-write at a time, so concurrent patches do not drop each other's row
+        self._list_lock = threading.Lock()
+
+    def begin(self, employee_id) -> int:
+        token = next(self._seq)
+        if employee_id:
+            with self._lock:
+                self._latest[employee_id] = token
+        return token
+
+    def _finish(self, token, employee_id) -> bool:
+        """Whether this was the newest write started for the id."""
+        with self._lock:
+            newest = self._latest.get(employee_id) == token
+            if newest:
+                del self._latest[employee_id]
+            return newest
+
+    def failed(self, token, employee_id):
+        # some backend may still have applied the write
+        self._finish(token, employee_id)
+        invalidate_after_write(self.cache, employee_id)
+
+    def applied(self, token, employee_id, employee: Optional[Dict[str, Any]]):
+        """employee: the stored record from the backend's ack (None if it sent none: only drop entries)."""
+        newest = self._finish(token, employee_id)
+        if not (self.enabled and newest and employee_id and isinstance(employee, dict)):
+            invalidate_after_write(self.cache, employee_id)
+            return
+        try:
+            self.cache.invalidate_tag(id_tag(employee_id))
+            body = json.dumps(employee, ensure_ascii=False).encode('utf-8')
+            store_response(self.cache, cache_key_for('GET', '/employees', [('id', employee_id)], 'json'), 200,
+                           dict(_JSON, **{'X-Backend': 'write-through'}), body, self.ttl, self.stale_seconds)
+            list_key = cache_key_for('GET', '/employees', [], 'json')
+            with self._list_lock:
+                cached_list = self.cache.get_entry(list_key)
+                self.cache.invalidate_tag(LIST_TAG)
+                if cached_list is not None:
+                    self._patch_list(list_key, cached_list, employee_id, employee)
+        except Exception as e:
+            logger.warning("Write-through for id %s failed (%s), dropping entries", employee_id, e)
+            invalidate_after_write(self.cache, employee_id)
+
+    def _patch_list(self, key, cached, employee_id, employee) -> bool:
+        raw, stale_for = cached
+        if stale_for > 0:
+            return False
+        try:
+            envelope = decode_cache_entry(raw)
+        except ValueError:
+            return False
+        headers = envelope.headers()
+        if envelope.status != 200 or 'X-Missing-Backends' in headers or envelope.body_len > self.list_max_bytes:
+            return False
+        rows = json.loads(bytes(envelope.body))
+        if not isinstance(rows, list):
+            return False
+        for i, row in enumerate(rows):
+            if isinstance(row, dict) and str(row.get('id')) == employee_id:
+                rows[i] = employee
+                break
+        else:
+            rows.append(employee)
+        # keep the time the list had left, so patching never makes it look fresher than it is
+        ttl = max(1, math.ceil(-stale_for)) if self.ttl else 0
+        store_response(self.cache, key, 200, headers, json.dumps(rows, ensure_ascii=False).encode('utf-8'), ttl,
+                       self.stale_seconds)
+        return True